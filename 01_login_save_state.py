@@ -1,15 +1,30 @@
+import argparse
+import os
 from playwright.sync_api import sync_playwright
 from pathlib import Path
 
+from sessions import STATES_DIR, state_path
+
 ## DEV
 # BASE = "https://seicthdev.service-now.com"
 
 #PRD
 BASE = "https://seicth.service-now.com/"
 
+BASE = os.environ.get("SNOW_BASE", BASE)
 STATE = Path("state.json")
 
 def main():
+    parser = argparse.ArgumentParser(description="Log in to ServiceNow (SSO + MFA) and save the session state")
+    parser.add_argument("--name", help=f"save as {STATES_DIR}/<name>.json (one per service account) "
+                                       f"instead of {STATE}")
+    parser.add_argument("--state", help="save to this path (used by the exporter to refresh an expired session)")
+    args = parser.parse_args()
+    target = Path(args.state) if args.state else state_path(args.name) if args.name else STATE
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if args.name:
+        print(f"Saving session '{args.name}' - log in with the account for this session")
+
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=False)  # เห็นหน้าจอเพื่อทำ SSO/MFA
         context = browser.new_context()
@@ -38,8 +53,8 @@ def main():
         page.wait_for_timeout(2000)
         page.wait_for_url("**/now/**", timeout=10 * 60 * 1000)  # รอนานสุด 10 นาทีให้ทำ MFA
 
-        context.storage_state(path=str(STATE))
-        print(f"\n✅ Saved session state to: {STATE.resolve()}")
+        context.storage_state(path=str(target))
+        print(f"\n✅ Saved session state to: {target.resolve()}")
 
         browser.close()
 
@@ -1,625 +1,1358 @@
-import re
+import argparse
+import json
+import os
+import queue
+import threading
+import time
 from pathlib import Path
+from urllib.parse import quote, urlsplit
 from playwright.sync_api import sync_playwright
 
+import auth
+import export_async
+import snow_api
+from asset_cache import ASSET_CACHE_DIR, DEFAULT_MAX_MB, AssetCache
+from attachments import (ALL_ATTACHMENTS_ZIP, ATTACHMENT_DIR, category_path, classify_attachment, extract_zip, link_or_copy,
+                         safe_name, store_path)
+from auth import MAX_REAUTH_PER_RECORD, REAUTH_MODES, Reauthenticator, SessionExpired
+from concurrency import DEFAULT_TARGETS_MS, AimdController
+from dom_extract import downloadable, form_snapshot, list_rows
+from download_engine import RANGE_CONNECTIONS, HttpDownloader, part_path
+from manifest import STATUS_DONE, Manifest
+from memory import DEFAULT_LIMIT_MB, DEFAULT_RECYCLE_EVERY, MemoryMonitor
+from sessions import DEFAULT_SESSION_LIMIT, SessionPool, resolve_states
+from metrics import METRICS_DIR, Metrics
+from net_filter import DEFAULT_PROFILE, PROFILES, NetworkFilter
+from postprocess import DEFAULT_UNPACK_WORKERS, PostProcessor
+from retry import COOLDOWN_S, ERROR_THRESHOLD, MAX_ATTEMPTS, CircuitBreaker, RetryQueue, retry_call
+from selector_registry import SELECTOR_STATS, SelectorRegistry
+from waits import STAGE_BUDGETS, Waiter
+
 ## DEV
 # BASE = "https://seicthdev.service-now.com"
 
 #PRD
 BASE = "https://seicth.service-now.com/"
 
-STATE = "state.json"
-OUT = Path("output")
-DOWNLOADED_LOG = Path("downloaded.log")  # Log file to track completed downloads
+# override ได้ด้วย env (เช่น bench_export.py ชี้ไปที่ mock_servicenow.py)
+BASE = os.environ.get("SNOW_BASE", BASE)
+STATE = os.environ.get("SNOW_STATE", "state.json")
+OUT = Path(os.environ.get("SNOW_OUT", "output"))
+DOWNLOADED_LOG = Path("downloaded.log")  # Log file เดิม (import เข้า manifest ครั้งแรก)
+BACKUP_LOGS = [DOWNLOADED_LOG, Path("backup_prd") / "downloaded.log"]
 
-# ปรับ URL list ให้ตรงกับของคุณ (ตัวอย่างเป็น change_request list)
-CHANGE_LIST_URL = (
-    f"{BASE}/now/nav/ui/classic/params/target/"
-    "change_request_list.do?sysparm_view=cab"
-)
+# high-water marks สำหรับ --since-last-run (เก็บใน manifest meta)
+WATERMARK_CHANGES = "watermark_change_sys_updated_on"
+WATERMARK_ATTACHMENTS = "watermark_attachment_sys_created_on"
 
-def safe_name(s: str) -> str:
-    s = s.strip()
-    s = re.sub(r'[\\/:*?"<>|]+', "_", s)
-    return s[:150]
+# ปรับ URL list ให้ตรงกับของคุณ (ตัวอย่างเป็น change_request list)
+# เปิด list ตรง (ไม่ผ่าน nav shell) เรียง CAB Date ใหม่ก่อนด้วย sysparm_query แทนการคลิกหัวคอลัมน์
+# และเปิดที่ offset ไหนก็ได้ด้วย sysparm_first_row
+LIST_PAGE_URL = f"{BASE}/change_request_list.do?sysparm_view=cab"
+# จำนวนแถวต่อหน้า = ตัวเลือกสูงสุดของ Rows per page (หน้าน้อยลง = render list น้อยลง)
+LIST_PAGE_ROWS = 100
+
+# ตำแหน่งใน list ที่ทำเสร็จถึงแล้ว (manifest meta) - resume แล้วเปิดหน้านั้นเลยไม่ต้องเดินจากหน้า 1
+LIST_CHECKPOINT = "list_checkpoint"
+
+# เปิด record ตรงด้วย sys_id หรือ change number (ใช้ใน worker mode ที่ไม่ได้คลิกจาก list)
+CHANGE_FORM_URL = f"{BASE}/change_request.do?sys_id="
+CHANGE_RECORD_URL = f"{BASE}/change_request.do?sysparm_query=number="
+
+# PDF export ของ form (แทนการกด Additional actions -> Export -> PDF)
+PDF_EXPORT_URL = f"{BASE}/change_request.do?PDF&sys_id="
+
+LIST_TABLE_SELECTOR = "table.list_table, table[role='table'], div[role='grid']"
+
+# รอตาม signal จริงแทน sleep แบบ fix เวลา (แชร์สถิติระหว่าง worker)
+waiter = Waiter()
+
+# latency ต่อ stage ของ run นี้ (metrics/run-*.jsonl + p50/p95/p99 ตอนจบ)
+metrics = Metrics()
+waiter.listeners.append(lambda stage, elapsed_ms, ok: metrics.observe(f"wait.{stage}", elapsed_ms, ok))
+
+# ตัดรูป / font / analytics / AMB ออกจากทุก context (ตั้งค่าใหม่จาก --block ใน main)
+net_filter = NetworkFilter()
+# cache js/css ของ UI ข้าม run (เปิดใน main ตาม --asset-cache-mb)
+asset_cache = AssetCache(max_bytes=0)
+# RSS ของ Python / Chromium และการ recycle context (ตั้งค่าใน main ตาม --recycle-every / --recycle-rss-mb)
+memory_monitor = MemoryMonitor(0, 0, metrics)
+# storage state ที่ context ใช้ได้ (--sessions) พร้อม limit ต่อ session และสุขภาพของแต่ละ session
+session_pool = SessionPool([("default", STATE)], limit=1)
+# login ใหม่เมื่อ session หมดอายุกลาง run (ตั้งค่าใน main ตาม --reauth)
+reauth = Reauthenticator()
+# ลำดับ selector / frame-page ที่เจอปุ่มของ UI บน instance นี้ (โหลด / บันทึก selector_stats.json ใน main)
+selectors = SelectorRegistry(urlsplit(BASE).netloc, path=None)
+# แตก / จัด attachments_all.zip ใน process pool แยก (เปิดใน main ตาม --unpack-workers, 0 = แตกใน thread เดิม)
+postprocessor = PostProcessor(workers=0)
+# record ที่ fail -> ลองใหม่ตอนท้าย run / error พุ่ง -> พักทุก worker (ตั้งค่าใน main ตาม --retries / --breaker-*)
+retries = RetryQueue(max_attempts=0)
+breaker = CircuitBreaker(threshold=0)
+# จำนวน record ที่ทำพร้อมกัน (--adaptive: ปรับตาม latency ของ form / PDF, ไม่งั้น fix เท่า --workers)
+concurrency = AimdController(max_limit=1)
 
 def wait_download(download, target: Path):
+    # save ลง .part ก่อนแล้ว rename - ไฟล์ชื่อจริงมีอยู่ = ครบแน่นอน
     target.parent.mkdir(parents=True, exist_ok=True)
-    download.save_as(str(target))
-
-def load_downloaded() -> set:
-    """Load the set of already downloaded change numbers from log file"""
-    if not DOWNLOADED_LOG.exists():
-        return set()
-
-    downloaded = set()
-    with open(DOWNLOADED_LOG, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                downloaded.add(line)
-    return downloaded
-
-def mark_downloaded(change_number: str):
-    """Mark a change number as downloaded by appending to log file"""
-    with open(DOWNLOADED_LOG, 'a', encoding='utf-8') as f:
-        f.write(f"{change_number}\n")
-        f.flush()  # Ensure it's written immediately
-
-def main():
-    OUT.mkdir(parents=True, exist_ok=True)
-
-    # Load already downloaded change numbers for resume capability
-    downloaded = load_downloaded()
-    if downloaded:
-        print(f"Found {len(downloaded)} already downloaded change(s). Will skip them.")
-    else:
-        print("No previous downloads found. Starting fresh.")
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)  # ตอนแรกแนะนำ headless=False เพื่อ debug selector
-        context = browser.new_context(storage_state=STATE, accept_downloads=True)
-        page = context.new_page()
-
-        # เข้า list
-        page.goto(CHANGE_LIST_URL, wait_until="domcontentloaded")
-
-        # รอให้หน้าโหลดเสร็จ
-        page.wait_for_timeout(3000)
-
-        # ServiceNow classic list มักอยู่ใน iframe: gsft_main
-        # ถ้าไม่ใช่ classic ให้เอา frame logic ออก
-        gsft_frame = page.frame(name="gsft_main")
-        if gsft_frame:
-            print("Found gsft_main iframe (Classic UI)")
-            frame = gsft_frame
+    part = part_path(target)
+    download.save_as(str(part))
+    os.replace(part, target)
+
+def open_manifest() -> Manifest:
+    """Open the SQLite manifest, importing the old downloaded.log files on first run"""
+    manifest = Manifest()
+    imported = manifest.import_logs(BACKUP_LOGS)
+    if imported:
+        print(f"Imported {imported} change(s) from downloaded.log into {manifest.path}")
+    return manifest
+
+def get_frame(page):
+    """Return the gsft_main iframe for Classic UI, or the page itself"""
+    return page.frame(name="gsft_main") or page
+
+def go_to_next_page(page, frame) -> bool:
+    """Click vcr_next on the list. Returns True if a new page was loaded, False on the last page.
+    Raises if the click or the wait for the next page failed."""
+    # Scroll หน้าลงไปล่างสุดก่อน เพื่อให้ pagination buttons เข้ามาในมุมมอง
+    try:
+        frame.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+    except:
+        pass
+
+    # ใช้ JavaScript หาและ click ปุ่ม Next เพราะ Playwright click อาจถูกบัง
+    try:
+        # ลอง click ด้วย JavaScript โดยตรง (หลีกเลี่ยงปัญหา element ถูกบัง)
+        result = frame.evaluate("""
+            () => {
+                // หาปุ่ม Next โดยใช้ name attribute
+                const btn = document.querySelector('button[name="vcr_next"]');
+                if (!btn) {
+                    return { found: false, reason: 'button not found' };
+                }
+
+                // ตรวจสอบว่า disabled หรือไม่
+                if (btn.disabled) {
+                    return { found: true, disabled: true };
+                }
+
+                // จำเลข change แถวแรกไว้ เพื่อรอจนหน้าใหม่แสดงแทน
+                const first = document.querySelector('a.linked.formlink');
+                const previous = first ? first.innerText.trim() : '';
+
+                // Click ด้วย JavaScript
+                btn.click();
+                return { found: true, disabled: false, clicked: true, previous: previous };
+            }
+        """)
+
+        print(f"Next Page button check: {result}")
+
+        if not result.get('found'):
+            print("No Next Page button found. Reached last page.")
+            return False
+        elif result.get('disabled'):
+            print("Next Page button is disabled. Reached last page.")
+            return False
+        elif result.get('clicked'):
+            print("Successfully clicked Next Page button with JavaScript")
+
+            # รอให้หน้าใหม่โหลด (แถวแรกเปลี่ยน) และตารางมา
+            with metrics.stage("next_page"):
+                waiter.list_changed("next_page", frame, result.get('previous', ''))
+                waiter.selector("list_table", frame, LIST_TABLE_SELECTOR)
+            return True
         else:
-            print("No gsft_main iframe (Modern UI or direct page)")
-            frame = page
+            print("[WARN] Unexpected result from Next Page button click")
+            return False
+
+    except Exception as e:
+        # ไม่ใช่หน้าสุดท้าย - ให้ caller โหลดหน้าถัดไปใหม่แทนการจบ enumeration
+        print(f"[WARN] Failed to click Next Page with JavaScript: {e}")
+        raise
+
+def wait_for_form(page, frame):
+    # รอ form มา (GlideForm พร้อมใช้งาน)
+    if not waiter.form_ready("form_ready", frame, raise_on_timeout=False):
+        print(f"[WARN] Form not ready, trying to continue anyway. Current URL: {page.url}")
+
+def export_pdf_direct(folder: Path, number: str, downloader: HttpDownloader, sys_id):
+    """Fetch the record's PDF export URL directly and stream it to CHG....pdf. Returns the path, or None on failure."""
+    if not sys_id:
+        print("[WARN] Direct PDF export: sys_id not found")
+        return None
+
+    target = folder / f"{safe_name(number)}.pdf"
+    try:
+        print("Generating PDF (direct URL)...")
+        size = downloader.fetch(f"{PDF_EXPORT_URL}{sys_id}", target, expect_prefix=b"%PDF")
+        print(f"PDF saved ({size:,} bytes)")
+        return target
+    except Exception as e:
+        print(f"[WARN] Direct PDF export failed, falling back to UI: {e}")
+        return None
+
+def export_pdf(page, frame, folder: Path, number: str):
+    """Returns (files written, error or None) like every stage below"""
+    # ---------- (A) Export PDF ผ่าน UI ----------
+    # Step 1-5: Additional actions -> Export -> PDF -> Export -> Download
+    try:
+        # Step 1: กดปุ่ม "Additional actions" (icon menu) - frame หรือ page หลัก ตามที่ registry เรียนรู้ไว้
+        additional_actions_btn = selectors.find("additional_actions", page, frame)
+        if additional_actions_btn is None:
+            raise RuntimeError("Additional actions button not found")
+
+        additional_actions_btn.click(timeout=5_000)
+        print("Clicked Additional actions button")
+
+        # Step 2: รอให้ Export menu แสดงก่อนที่จะ hover (frame / page, data-context-menu-label / item_id)
+        export_menu = selectors.first_visible(waiter, "actions_menu", "export_menu", page, frame)
+        print("[DEBUG] Found Export menu")
+
+        export_menu.hover()
+
+        # Step 3: คลิก "PDF" item (รอให้ submenu แสดง)
+        pdf_item = frame.locator('div.context_item[role="menuitem"]:has-text("PDF")').first
+        waiter.locator("export_submenu", pdf_item)
+        pdf_item.click()
+
+        # Step 4: กดปุ่ม "Export" ใน dialog เพื่อเริ่ม generate PDF (รอให้ Export dialog ขึ้นมา)
+        export_btn = selectors.first_visible(waiter, "pdf_dialog", "ok_button", page, frame)
+
+        export_btn.click()
+        print("Generating PDF...")
+
+        # Step 5: รอให้ PDF generation เสร็จ และปุ่ม Download ปรากฏ
+        download_btn = selectors.first_visible(waiter, "pdf_ready", "download_button", page, frame)
+
+        with page.expect_download() as dl:
+            download_btn.click()
+        download = dl.value
+        target = folder / f"{safe_name(number)}.pdf"
+        wait_download(download, target)
+        print("PDF saved")
+        return [target], None
+    except Exception as e:
+        print(f"[WARN] Export PDF failed: {e}")
+        return [], e
+
+def attachment_link(frame, attachment: dict):
+    """Locator of one attachment link from the form snapshot"""
+    if attachment["sys_id"]:
+        return frame.locator(f'a.attachment[href*="{attachment["sys_id"]}"]').first
+    return frame.locator('a.attachment[href*="sys_attachment.do"]', has_text=attachment["filename"]).first
+
+def download_supporting_documents(page, frame, folder: Path, snapshot: dict, stored: set):
+    # ---------- (D) Download from Supporting Documents (CRFile, UAT Signoff, AppScan) ----------
+    # ไฟล์ที่ได้จาก Download All ของ record นี้แล้ว (stored) ไม่โหลดซ้ำ แค่ link เข้าโฟลเดอร์ตามประเภท
+    files, errors = [], []
+    try:
+        if snapshot["supporting_docs_tab"]:
+            # attachment download links จาก snapshot (อ่านจาก DOM ไปแล้วครั้งเดียว)
+            attachments = downloadable(snapshot["attachments"])
+            print(f"[DEBUG] Found {len(attachments)} download link(s)")
+
+            # คลิกแท็บ "Supporting Documents" เฉพาะเมื่อยังต้องคลิกดาวน์โหลด
+            if any(store_path(folder, a["name"]) not in stored for a in attachments):
+                frame.locator('span.tab_caption_text:has-text("Supporting Documents")').first.click()
+                print("Opened Supporting Documents tab")
+
+            if len(attachments) > 0:
+                print(f"Processing {len(attachments)} attachment(s) in Supporting Documents")
+
+                for attachment in attachments:
+                    filename = attachment["filename"]
+                    try:
+                        # ตัดสินใจ subfolder จากชื่อไฟล์
+                        subfolder_name = classify_attachment(filename)
+                        source = store_path(folder, attachment["name"])
+
+                        if source in stored:
+                            print(f"Linking {subfolder_name}: {filename} (already in {ATTACHMENT_DIR}/)")
+                        else:
+                            # ดาวน์โหลดครั้งเดียวเข้า Attachment/
+                            print(f"Downloading {subfolder_name}: {filename}")
+                            link = attachment_link(frame, attachment)
+                            with metrics.stage("file_download", file=filename):
+                                with page.expect_download() as dl:
+                                    link.click()
+                                download_file = dl.value
+                                wait_download(download_file, source)
+                            stored.add(source)
+
+                        files.append(link_or_copy(source, category_path(folder, filename, source.name)))
+                        print(f"✓ {subfolder_name} downloaded: {filename}")
+
+                    except Exception as e:
+                        print(f"[WARN] Could not download {filename}: {e}")
+                        errors.append(f"{filename}: {e}")
+            else:
+                print("No attachments found in Supporting Documents")
 
-        # รอให้ตารางมา - ลองหลาย selector
-        print("Waiting for table to load...")
-        try:
-            # ลอง selector หลายแบบ
-            frame.wait_for_selector("table.list_table, table[role='table'], div[role='grid']", timeout=60_000)
-            print("Table found!")
-        except Exception as e:
-            print(f"[ERROR] Cannot find table. Current URL: {page.url}")
-            print("Taking screenshot for debug...")
-            page.screenshot(path="debug_list_page.png")
-            raise
+        else:
+            print("[WARN] Supporting Documents tab not found")
+
+    except Exception as e:
+        print(f"[WARN] Supporting Documents processing failed: {e}")
+        errors.append(str(e))
+
+    return files, "; ".join(errors) or None
+
+def download_supporting_documents_http(folder: Path, downloader: HttpDownloader, snapshot: dict, stored: set):
+    # ---------- (D) Supporting Documents ผ่าน HTTP ตรง (ไม่ต้องคลิก + expect_download) ----------
+    # แต่ละไฟล์โอนครั้งเดียวเข้า Attachment/ แล้ว link เข้าโฟลเดอร์ตามประเภท
+    files, errors = [], []
+    try:
+        if not snapshot["supporting_docs_tab"]:
+            print("[WARN] Supporting Documents tab not found")
+            return files, None
+
+        # link อยู่ใน DOM อยู่แล้วแม้ไม่ได้เปิดแท็บ ใช้ href + ชื่อไฟล์จาก snapshot
+        links = downloadable(snapshot["attachments"])
+        print(f"[DEBUG] Found {len(links)} download link(s)")
+        if not links:
+            print("No attachments found in Supporting Documents")
+            return files, None
+
+        futures = []
+        for link in links:
+            filename = link["filename"]
+            source = store_path(folder, link["name"])
+            future = None
+            if source not in stored:
+                print(f"Downloading {classify_attachment(filename)}: {filename}")
+                future = downloader.submit(link["href"], source)
+            futures.append((filename, source, future))
+
+        # ทุกไฟล์ของ record นี้ดาวน์โหลดพร้อมกันใน pool แล้วค่อยรอผล
+        for filename, source, future in futures:
+            try:
+                if future is not None:
+                    future.result()
+                    stored.add(source)
+                target = link_or_copy(source, category_path(folder, filename, source.name))
+                files.append(target)
+                print(f"✓ {target.parent.name} downloaded: {filename} ({source.stat().st_size:,} bytes)")
+            except Exception as e:
+                print(f"[WARN] Could not download {filename}: {e}")
+                errors.append(f"{filename}: {e}")
+
+    except Exception as e:
+        print(f"[WARN] Supporting Documents processing failed: {e}")
+        errors.append(str(e))
+
+    return files, "; ".join(errors) or None
+
+def collect_attachments_http(folder: Path, downloader: HttpDownloader, snapshot: dict, stored: set):
+    # ---------- (E) All attachments ผ่าน HTTP: Attachment/ มีทุกไฟล์ของ record ----------
+    # ไฟล์ที่ Supporting Documents โหลดไปแล้วไม่ต้องโหลดซ้ำ (ไม่ขอ zip ที่มีไฟล์ชุดเดิมอีกรอบ)
+    files, errors = [], []
+    futures = []
+    for attachment in downloadable(snapshot["attachments"]):
+        source = store_path(folder, attachment["name"])
+        if source in stored:
+            files.append(source)
+        else:
+            futures.append((attachment["filename"], source, downloader.submit(attachment["href"], source)))
 
-        # คลิกเรียง CAB Date เพื่อให้ download เรียงตามวันที่ใหม่ก่อน
+    for filename, source, future in futures:
         try:
-            print("Sorting by CAB Date (newest first)...")
-            cab_date_header = frame.locator('a.column_head:has-text("CAB Date")').first
-            if cab_date_header.count() > 0:
-                cab_date_header.click()
-                frame.wait_for_timeout(2000)  # รอให้เรียงเสร็จ
-                print("Sorted by CAB Date")
-            else:
-                print("[WARN] CAB Date column not found - skipping sort")
+            future.result()
+            stored.add(source)
+            files.append(source)
         except Exception as e:
-            print(f"[WARN] Could not sort by CAB Date: {e}")
-
-        # ดึง link ของ change number ในหน้าปัจจุบัน
-        # Loop through all pages until no more next page button
-        page_number = 1
-
-        while True:
-            print(f"\n===== Processing Page {page_number} =====")
-
-            # ลองหา rows จากหลาย selector
-            rows = frame.locator("table.list_table tbody tr, table[role='table'] tbody tr, div[role='row']")
-            count = rows.count()
-            print(f"Found {count} rows on page {page_number}")
-
-            for i in range(count):
-                row = rows.nth(i)
-
-                # คลิกที่ Change Number ลิงก์ตัวแรกในแถว
-                link = row.locator("a.linked.formlink").first
-                number = link.inner_text().strip()
-                if not number:
-                    continue
-
-                # Check if already downloaded (for resume capability)
-                if number in downloaded:
-                    print(f"\n=== {number} (Row {i+1}/{count}, Page {page_number}) === [SKIPPED - Already downloaded]")
-                    continue
-
-                folder = OUT / safe_name(number)
-                folder.mkdir(parents=True, exist_ok=True)
-
-                print(f"\n=== {number} (Row {i+1}/{count}, Page {page_number}) ===")
-
-                # เปิด record ในแท็บเดิม
-                link.click()
-
-                # รายการแรกอาจจะต้องรอนานกว่า (session initialization)
-                if i == 0 and page_number == 1:
-                    print("First record - waiting extra time for page to stabilize...")
-                    page.wait_for_timeout(5000)
-                else:
-                    page.wait_for_timeout(2000)
-
-                # หลังคลิกเข้า record หน้า form มักอยู่ใน gsft_main เหมือนเดิม
-                frame = page.frame(name="gsft_main") or page
-
-                # รอ form มา
+            print(f"[WARN] Could not download {filename}: {e}")
+            errors.append(f"{filename}: {e}")
+
+    print(f"Attachments in {ATTACHMENT_DIR}/: {len(files)} file(s), {len(futures)} downloaded now")
+    return files, "; ".join(errors) or None
+
+def download_all_attachments(page, frame, folder: Path, snapshot: dict, stored: set):
+    # ---------- (E) Download All Attachments ----------
+    files, error = [], None
+    if not snapshot["attachments"]:
+        # snapshot เป็นแค่ hint: form ที่โหลดช้า / layout อื่นอาจไม่แสดง link ไฟล์แนบ
+        # ยังเปิด Manage Attachments ดูก่อนบันทึกว่า done (ไม่งั้น record ถูกปิดถาวรโดยไม่มีไฟล์)
+        print("[DEBUG] Form lists no attachments - checking Manage Attachments")
+    try:
+        # คลิกปุ่ม paperclip icon (Manage Attachments)
+        paperclip_btn = selectors.find("header_add_attachment", page, frame)
+
+        if paperclip_btn is not None:
+            paperclip_btn.click()
+            print("Clicked Manage Attachments button")
+
+            # รอให้ Attachments dialog popup ขึ้นมา (ปุ่ม Download All หรือปุ่ม Close แสดง)
+            modal_buttons = (selectors.locators("download_all_button", page, frame)
+                             + selectors.locators("attachment_closemodal", page, frame))
+            waiter.first_visible("attachments_modal", [locator for _, locator in modal_buttons],
+                                 raise_on_timeout=False)
+
+            # หาปุ่ม Download All โดยตรง แทนที่จะตรวจสอบข้อความ (page / frame / onclick ตามลำดับที่เรียนรู้)
+            print("[DEBUG] Looking for Download All button...")
+            download_all_btn = selectors.find("download_all_button", page, frame)
+
+            if download_all_btn is not None:
+                # สร้างโฟลเดอร์ Attachment
+                attachment_folder = folder / ATTACHMENT_DIR
+                attachment_folder.mkdir(parents=True, exist_ok=True)
+                zip_path = attachment_folder / ALL_ATTACHMENTS_ZIP
+
+                print("Downloading all attachments...")
+
+                # ลอง JavaScript click ก่อน (เพราะปุ่มอาจไม่ visible)
                 try:
-                    frame.wait_for_selector("form", timeout=60_000)
-                except Exception as e:
-                    print(f"[WARN] Form not found, trying to continue anyway. Error: {e}")
-                    page.wait_for_timeout(3000)
+                    # เช็คว่า JavaScript หาปุ่มเจอหรือไม่
+                    btn_found = page.evaluate("""
+                        () => {
+                            const btn = document.getElementById('download_all_button');
+                            return btn !== null;
+                        }
+                    """)
+
+                    if btn_found:
+                        print("[DEBUG] JavaScript found button, clicking...")
+                        with page.expect_download() as dl:
+                            page.evaluate("document.getElementById('download_all_button').click()")
+                        download_file = dl.value
+                        wait_download(download_file, zip_path)
+                        print("Attachments downloaded")
+                        files += unpack_attachments(folder, zip_path, stored, snapshot)
+                    else:
+                        # JavaScript ไม่เจอ ลอง Playwright force click
+                        print("[DEBUG] JavaScript didn't find button, trying Playwright force click...")
+                        with page.expect_download() as dl:
+                            download_all_btn.click(force=True, timeout=10_000)
+                        download_file = dl.value
+                        wait_download(download_file, zip_path)
+                        print("Attachments downloaded")
+                        files += unpack_attachments(folder, zip_path, stored, snapshot)
 
-                # ---------- (A) Export PDF ผ่าน UI ----------
-                # Step 1-5: Additional actions -> Export -> PDF -> Export -> Download
-                try:
-                    # Step 1: กดปุ่ม "Additional actions" (icon menu)
-                    additional_actions_btn = frame.locator('button.additional-actions-context-menu-button[aria-label="additional actions"]').first
-                    if additional_actions_btn.count() == 0:
-                        # ลองหาใน page หลัก (ไม่ใช่ใน frame)
-                        additional_actions_btn = page.locator('button.additional-actions-context-menu-button[aria-label="additional actions"]').first
-
-                    additional_actions_btn.click(timeout=5_000)
-                    print("Clicked Additional actions button")
-
-                    # รอให้เมนูแสดงและ stable
-                    frame.wait_for_timeout(2000)  # เพิ่มเวลารอให้มากขึ้น
-
-                    # Step 2: รอให้ Export menu แสดงก่อนที่จะ hover
-                    export_menu = None
-                    for attempt in range(3):  # ลอง 3 ครั้ง
-                        try:
-                            # ลองหา Export menu item ทั้งใน frame และ page context
-                            export_menu = frame.locator('div.context_item[role="menuitem"][data-context-menu-label="Export"]').first
-                            if export_menu.count() == 0:
-                                # fallback 1: ลองหาด้วย item_id ใน frame
-                                export_menu = frame.locator('div.context_item[item_id="context_exportmenu"]').first
-
-                            if export_menu.count() == 0:
-                                # fallback 2: ลองหาใน page context
-                                export_menu = page.locator('div.context_item[role="menuitem"][data-context-menu-label="Export"]').first
-
-                            if export_menu.count() == 0:
-                                # fallback 3: ลองหาด้วย item_id ใน page context
-                                export_menu = page.locator('div.context_item[item_id="context_exportmenu"]').first
-
-                            if export_menu.count() > 0:
-                                # รอให้ visible
-                                export_menu.wait_for(state="visible", timeout=5_000)
-                                print(f"[DEBUG] Found Export menu (attempt {attempt+1})")
-                                break
-                            else:
-                                if attempt < 2:
-                                    print(f"Export menu not found, retrying... (attempt {attempt+1}/3)")
-                                    frame.wait_for_timeout(1500)  # เพิ่มเวลารอระหว่าง retry
-                        except Exception as e:
-                            if attempt < 2:
-                                print(f"Error waiting for Export menu, retrying... (attempt {attempt+1}/3): {e}")
-                                frame.wait_for_timeout(1500)
-                            else:
-                                raise
-
-                    if export_menu is None or export_menu.count() == 0:
-                        raise Exception("Export menu not found after 3 attempts")
-
-                    export_menu.hover()
-                    frame.wait_for_timeout(500)  # รอให้ submenu แสดง
-
-                    # Step 3: คลิก "PDF" item
-                    pdf_item = frame.locator('div.context_item[role="menuitem"]:has-text("PDF")').first
-                    pdf_item.click()
-                    frame.wait_for_timeout(1000)  # รอให้ Export dialog ขึ้นมา
-
-                    # Step 4: กดปุ่ม "Export" ใน dialog เพื่อเริ่ม generate PDF
-                    export_btn = frame.locator('button#ok_button').first
-                    if export_btn.count() == 0:
-                        export_btn = page.locator('button#ok_button').first
-
-                    export_btn.click()
-                    print("Generating PDF...")
-
-                    # รอให้ PDF generation เสร็จ และปุ่ม Download ปรากฏ
-                    frame.wait_for_timeout(3000)  # รอให้ process PDF
-
-                    # Step 5: กดปุ่ม "Download" เพื่อดาวน์โหลด PDF
-                    download_btn = frame.locator('button#download_button').first
-                    if download_btn.count() == 0:
-                        download_btn = page.locator('button#download_button').first
-
-                    # รอให้ปุ่ม Download พร้อม
-                    download_btn.wait_for(state="visible", timeout=30_000)
-
-                    with page.expect_download() as dl:
-                        download_btn.click()
-                    download = dl.value
-                    wait_download(download, folder / f"{safe_name(number)}.pdf")
-                    print("PDF saved")
                 except Exception as e:
-                    print(f"[WARN] Export PDF failed: {e}")
+                    print(f"[WARN] Could not download attachments: {e}")
+                    # ถ้า download ไม่สำเร็จก็ข้าม (manifest จะบันทึกเป็น failed ไว้ทำใหม่ตอน resume)
+                    error = e
 
-                # ---------- (D) Download from Supporting Documents (CRFile, UAT Signoff, AppScan) ----------
-                try:
-                    # คลิกแท็บ "Supporting Documents"
-                    supporting_docs_tab = frame.locator('span.tab_caption_text:has-text("Supporting Documents")').first
-                    if supporting_docs_tab.count() > 0:
-                        supporting_docs_tab.click()
-                        frame.wait_for_timeout(1500)
-                        print("Opened Supporting Documents tab")
-
-                        # หา attachment download links เท่านั้น (ไม่รวม rename, view buttons)
-                        print("[DEBUG] Searching for download links in Supporting Documents...")
-                        attachment_links = frame.locator('a.attachment[href*="sys_attachment.do"]').all()
-                        print(f"[DEBUG] Found {len(attachment_links)} download link(s)")
-
-                        if len(attachment_links) > 0:
-                            print(f"Processing {len(attachment_links)} attachment(s) in Supporting Documents")
-
-                            for link in attachment_links:
-                                try:
-                                    # ดึงชื่อไฟล์
-                                    filename = link.inner_text().strip()
-                                    if not filename:
-                                        continue
-
-                                    # ตัดสินใจ subfolder จากชื่อไฟล์
-                                    filename_upper = filename.upper()
-                                    filename_lower = filename.lower()
-
-                                    if 'UAT' in filename_upper or 'SIGNOFF' in filename_upper:
-                                        subfolder_name = 'UAT Signoff'
-                                    elif 'APP SCAN' in filename_upper or 'APPSCAN' in filename_upper or 'app scan' in filename_lower:
-                                        subfolder_name = 'AppScan'
-                                    elif filename.startswith('RE') or 'SDR' in filename_upper or 'FORM' in filename_upper:
-                                        subfolder_name = 'CRFile'
-                                    else:
-                                        subfolder_name = 'Supporting Documents'
-
-                                    # สร้างโฟลเดอร์
-                                    subfolder = folder / subfolder_name
-                                    subfolder.mkdir(parents=True, exist_ok=True)
-
-                                    # ดาวน์โหลด
-                                    print(f"Downloading {subfolder_name}: {filename}")
-
-                                    with page.expect_download() as dl:
-                                        link.click()
-                                    download_file = dl.value
-                                    wait_download(download_file, subfolder / safe_name(filename))
-                                    print(f"✓ {subfolder_name} downloaded: {filename}")
-
-                                    # รอสักครู่หลัง download แต่ละไฟล์
-                                    frame.wait_for_timeout(500)
-
-                                except Exception as e:
-                                    print(f"[WARN] Could not download {filename}: {e}")
-                        else:
-                            print("No attachments found in Supporting Documents")
+                print("[DEBUG] Closing Attachments dialog...")
+                close_attachments_modal(page, frame)
+            else:
+                print("[INFO] No attachments or Download All button not found - closing dialog")
+                close_attachments_modal(page, frame)
+        else:
+            print("[INFO] No attachments button found (may not have attachments)")
 
-                    else:
-                        print("[WARN] Supporting Documents tab not found")
+    except Exception as e:
+        print(f"[WARN] Attachments download failed: {e}")
+        error = e
 
-                except Exception as e:
-                    print(f"[WARN] Supporting Documents processing failed: {e}")
+    return files, error
 
-                # ---------- (E) Download All Attachments ----------
-                try:
-                    # คลิกปุ่ม paperclip icon (Manage Attachments)
-                    paperclip_btn = frame.locator('button#header_add_attachment').first
-                    if paperclip_btn.count() == 0:
-                        # fallback: หาด้วย class และ aria-label
-                        paperclip_btn = frame.locator('button.icon-paperclip[aria-label="Manage Attachments"]').first
-
-                    if paperclip_btn.count() == 0:
-                        # ลองหาใน page หลัก
-                        paperclip_btn = page.locator('button#header_add_attachment').first
-
-                    if paperclip_btn.count() > 0:
-                        paperclip_btn.click()
-                        print("Clicked Manage Attachments button")
-
-                        # รอให้ Attachments dialog popup ขึ้นมา
-                        frame.wait_for_timeout(2000)
-
-                        # หาปุ่ม Download All โดยตรง แทนที่จะตรวจสอบข้อความ
-                        print("[DEBUG] Looking for Download All button...")
-
-                        # ลองหาใน page หลักก่อน (modal อาจจะอยู่นอก frame)
-                        download_all_btn = page.locator('input#download_all_button').first
-                        if download_all_btn.count() > 0:
-                            print("[DEBUG] Found Download All button in page context")
-                        else:
-                            # ลองหาใน frame
-                            download_all_btn = frame.locator('input#download_all_button').first
-                            if download_all_btn.count() > 0:
-                                print("[DEBUG] Found Download All button in frame context")
-
-                        if download_all_btn.count() == 0:
-                            # fallback: หาด้วย onclick
-                            download_all_btn = page.locator('input[onclick*="downloadAllAttachments"]').first
-                            if download_all_btn.count() > 0:
-                                print("[DEBUG] Found Download All button by onclick attribute")
-
-                        if download_all_btn.count() > 0:
-                            # สร้างโฟลเดอร์ Attachment
-                            attachment_folder = folder / "Attachment"
-                            attachment_folder.mkdir(parents=True, exist_ok=True)
-
-                            print("Downloading all attachments...")
-
-                            # ลอง JavaScript click ก่อน (เพราะปุ่มอาจไม่ visible)
-                            try:
-                                # เช็คว่า JavaScript หาปุ่มเจอหรือไม่
-                                btn_found = page.evaluate("""
-                                    () => {
-                                        const btn = document.getElementById('download_all_button');
-                                        return btn !== null;
-                                    }
-                                """)
-
-                                if btn_found:
-                                    print("[DEBUG] JavaScript found button, clicking...")
-                                    with page.expect_download() as dl:
-                                        page.evaluate("document.getElementById('download_all_button').click()")
-                                    download_file = dl.value
-                                    wait_download(download_file, attachment_folder / "attachments_all.zip")
-                                    print("Attachments downloaded")
-                                else:
-                                    # JavaScript ไม่เจอ ลอง Playwright force click
-                                    print("[DEBUG] JavaScript didn't find button, trying Playwright force click...")
-                                    with page.expect_download() as dl:
-                                        download_all_btn.click(force=True, timeout=10_000)
-                                    download_file = dl.value
-                                    wait_download(download_file, attachment_folder / "attachments_all.zip")
-                                    print("Attachments downloaded")
-
-                            except Exception as e:
-                                print(f"[WARN] Could not download attachments: {e}")
-                                # ถ้า download ไม่สำเร็จก็ข้าม
-
-                            # ปิด dialog ด้วยปุ่ม Close
-                            print("[DEBUG] Closing Attachments dialog...")
-                            close_btn = page.locator('button#attachment_closemodal').first
-                            if close_btn.count() == 0:
-                                close_btn = frame.locator('button#attachment_closemodal').first
-                            if close_btn.count() > 0:
-                                close_btn.click()
-                            else:
-                                # fallback: ใช้ ESC ถ้าหาปุ่มไม่เจอ
-                                page.keyboard.press("Escape")
-                            frame.wait_for_timeout(500)
-                        else:
-                            print("[INFO] No attachments or Download All button not found - closing dialog")
-                            # ปิด dialog ด้วยปุ่ม Close
-                            close_btn = page.locator('button#attachment_closemodal').first
-                            if close_btn.count() == 0:
-                                close_btn = frame.locator('button#attachment_closemodal').first
-                            if close_btn.count() > 0:
-                                close_btn.click()
-                            else:
-                                # fallback: ใช้ ESC ถ้าหาปุ่มไม่เจอ
-                                page.keyboard.press("Escape")
-                            frame.wait_for_timeout(500)
-                    else:
-                        print("[INFO] No attachments button found (may not have attachments)")
+def close_attachments_modal(page, frame):
+    # ปิด dialog ด้วยปุ่ม Close
+    close_btn = selectors.find("attachment_closemodal", page, frame)
+    if close_btn is not None:
+        close_btn.click()
+        waiter.locator("modal_close", close_btn, state="hidden", raise_on_timeout=False)
+    else:
+        # fallback: ใช้ ESC ถ้าหาปุ่มไม่เจอ
+        page.keyboard.press("Escape")
+
+def unpack_attachments(folder: Path, zip_path: Path, stored: set, snapshot: dict) -> list:
+    """Extract the Download All zip into Attachment/ so Supporting Documents can link instead of downloading.
+    With the post-processing pool on, the zip is left for the Supporting Documents stage to hand off."""
+    if postprocessor.enabled:
+        return [zip_path]
+    try:
+        # ชื่อไฟล์ตาม assign_names เหมือนการโหลดทีละไฟล์ (ไฟล์ชื่อซ้ำใน record ไม่ถูกคลิกโหลดซ้ำ)
+        extracted = extract_zip(zip_path, folder / ATTACHMENT_DIR, downloadable(snapshot["attachments"]))
+    except Exception as e:
+        print(f"[WARN] Could not extract {zip_path.name}: {e}")
+        return [zip_path]
+    stored.update(extracted)
+    return [zip_path] + extracted
+
+def route_supporting_documents(page, frame, folder: Path, number: str, snapshot: dict, stored: set):
+    """UI mode: hand the Download All zip to the post-processing pool (returns None - the pool records
+    supporting_docs), otherwise link from the extracted zip / click each link here"""
+    zip_path = folder / ATTACHMENT_DIR / ALL_ATTACHMENTS_ZIP
+    if snapshot["supporting_docs_tab"] and zip_path.exists():
+        # ส่งหลัง attachments_zip ถูกบันทึกแล้ว - ผลของ pool (รวม zip เสีย) ไม่ถูก record_stage ทับ
+        expected = [{"filename": attachment["filename"], "name": attachment["name"], "size": attachment.get("size")}
+                    for attachment in downloadable(snapshot["attachments"])]
+        if postprocessor.submit(number, folder, zip_path, expected):
+            print(f"Supporting Documents: {zip_path.name} queued for unpacking and routing")
+            return None
+        if not stored:
+            # zip จาก run ก่อน (Supporting Documents ค้างอยู่) - แตกแทนการคลิกโหลดทีละไฟล์
+            unpack_attachments(folder, zip_path, stored, snapshot)
+    return download_supporting_documents(page, frame, folder, snapshot, stored)
+
+def run_pdf_stage(page, frame, folder: Path, number: str, args, downloader, sys_id):
+    # ลอง URL ตรงก่อน ถ้าไม่ได้ค่อยกลับไปใช้เมนูใน UI
+    if args.pdf == "url":
+        target = export_pdf_direct(folder, number, downloader, sys_id)
+        if target is not None:
+            return [target], None
+    return export_pdf(page, frame, folder, number)
+
+def process_record(page, frame, number: str, args, manifest: Manifest, downloader=None, sys_id=None) -> list:
+    """Run the pending PDF, Supporting Documents and Download All stages for an opened record.
+    Returns the artifacts that failed."""
+    folder = OUT / safe_name(number)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    # sys_id + attachment ทั้งหมดของ form ด้วย evaluate ครั้งเดียว ทุก stage ใช้ข้อมูลชุดนี้
+    snapshot = form_snapshot(frame)
+    sys_id = sys_id or snapshot["sys_id"]
+
+    # ไฟล์แนบที่อยู่ใน Attachment/ แล้วจากการโอนของ record นี้ (แต่ละไฟล์โอนครั้งเดียว)
+    stored = set()
+    if args.attachments == "http":
+        stages = {
+            "pdf": lambda: run_pdf_stage(page, frame, folder, number, args, downloader, sys_id),
+            "supporting_docs": lambda: download_supporting_documents_http(folder, downloader, snapshot, stored),
+            "attachments_zip": lambda: collect_attachments_http(folder, downloader, snapshot, stored),
+        }
+    else:
+        # UI: Download All ก่อน แล้ว Supporting Documents มาจากไฟล์ใน zip (ไม่คลิกโหลดซ้ำ)
+        # แตก / จัดไฟล์ใน post-processing pool ระหว่างที่ browser ไปทำ record ถัดไป
+        stages = {
+            "pdf": lambda: run_pdf_stage(page, frame, folder, number, args, downloader, sys_id),
+            "attachments_zip": lambda: download_all_attachments(page, frame, folder, snapshot, stored),
+            "supporting_docs": lambda: route_supporting_documents(page, frame, folder, number, snapshot, stored),
+        }
+
+    # resume: ทำเฉพาะ artifact ที่ยังไม่สำเร็จ (ตามลำดับของ stages)
+    pending = [artifact for artifact in stages if artifact in manifest.pending_artifacts(number)]
+    manifest.upsert_change(number, sys_id=sys_id)
+    failed = []
+    deferred = []
+    record_start = time.perf_counter()
+    for artifact in pending:
+        start = time.perf_counter()
+        result = stages[artifact]()
+        if result is None:
+            deferred.append(artifact)  # ส่งต่อให้ post-processing pool แล้ว (pool บันทึกผลลง manifest)
+            continue
+        files, error = result
+        duration_ms = (time.perf_counter() - start) * 1000
+        if error and auth.session_expired(page, downloader):
+            # ไม่ใช่ความผิดของ artifact - ไม่บันทึกว่า failed ให้ทำ record นี้ใหม่หลัง login
+            raise SessionExpired(f"{artifact}: {error}")
+        metrics.observe(artifact, duration_ms, error is None, number=number)
+        if manifest.record_stage(number, artifact, files, error, duration_ms) != STATUS_DONE:
+            failed.append(artifact)
+    metrics.observe("record", (time.perf_counter() - record_start) * 1000, not failed, number=number)
+
+    if failed:
+        print(f"[WARN] {number} incomplete: {', '.join(failed)}")
+    elif deferred:
+        print(f"✓ {number} downloaded - {', '.join(deferred)} finishing in the background")
+    else:
+        print(f"✓ {number} completed and recorded in manifest")
+    return failed
+
+def print_wait_summary():
+    print("\n===== Wait times per stage =====")
+    for line in waiter.summary():
+        print(line)
+    if net_filter.enabled:
+        print("\n===== Blocked requests =====")
+        for line in net_filter.summary():
+            print(line)
+    if asset_cache.enabled:
+        print("\n===== Asset cache =====")
+        for line in asset_cache.summary():
+            print(line)
+
+def print_metrics_summary():
+    metrics.write_summary()
+    print("\n===== Stage latency (p50 / p95 / p99) =====")
+    for line in metrics.summary():
+        print(line)
+    if metrics.path:
+        print(f"Metrics written to {metrics.path}")
+
+def new_context(browser, state=None, **kwargs):
+    """BrowserContext from state (default STATE) with the network filter installed"""
+    context = browser.new_context(storage_state=state or STATE, **kwargs)
+    # ลำดับสำคัญ: handler ที่ลงทะเบียนหลังทำงานก่อน -> filter ตัดสินก่อนแล้ว fallback มาที่ cache
+    asset_cache.install(context)
+    net_filter.install(context)
+    return context
+
+def make_downloader(context, args):
+    """HTTP downloader sharing the context's session cookies, or None when every stage uses the UI"""
+    if args.attachments != "http" and args.pdf != "url":
+        return None
+    downloader = HttpDownloader.from_context(context, BASE, max_workers=args.download_concurrency,
+                                             range_connections=args.range_connections)
+    downloader.listeners.append(
+        lambda url, size, elapsed_ms, ok: metrics.observe("http_fetch", elapsed_ms, ok, size, url=url))
+    downloader.throttle_listeners.append(lambda status, retry_after: breaker.throttled(status, retry_after))
+    return downloader
+
+def open_session(browser, login=None) -> dict:
+    """BrowserContext + page from login's storage state (STATE if None) that finished_record can replace mid-run"""
+    state = login.state if login else STATE
+    context = new_context(browser, state, accept_downloads=True)
+    return {"browser": browser, "login": login, "context": context, "page": context.new_page(), "records": 0,
+            "state_mtime": auth.state_mtime(state)}
+
+def reauthenticate(session: dict, downloader=None, label: str = ""):
+    """Refresh the session's expired login (other workers pause meanwhile), then reopen its context
+    from the new state. Raises SessionExpired if re-authentication failed."""
+    login = session["login"]
+    if not reauth.refresh(login.name, login.path, session["state_mtime"], label):
+        raise SessionExpired(f"session {login.name} expired and could not be re-authenticated")
+    metrics.event("reauth", session=login.name)
+    with metrics.stage("context_recycle"):
+        session["context"].close()
+        session.update(open_session(session["browser"], login))
+        if downloader is not None:
+            downloader.set_cookies(session["context"].cookies(BASE))
+
+def preflight_sessions(p, args):
+    """Check that every session's saved state still logs in before exporting; re-authenticate the stale ones"""
+    browser = p.chromium.launch(headless=args.headless)
+    try:
+        for login in session_pool.sessions:
+            context = new_context(browser, login.state)
+            ok = auth.preflight(context.new_page(), BASE)
+            context.close()
+            if ok:
+                print(f"[INFO] Session {login.name}: logged in")
+            elif not reauth.refresh(login.name, login.path, auth.state_mtime(login.path)):
+                raise SystemExit(f"Session {login.name} is not logged in - run "
+                                 f"python3 01_login_save_state.py --state {login.path}")
+    finally:
+        browser.close()
 
-                except Exception as e:
-                    print(f"[WARN] Attachments download failed: {e}")
-
-                # Mark this change as downloaded (for resume capability)
-                mark_downloaded(number)
-                print(f"✓ {number} completed and logged")
-
-                # ---------- (B) Download attachments จาก paperclip ----------
-                # DISABLED: Focus on PDF export first
-                # try:
-                #     # บาง UI paperclip เป็นไอคอนบน form header
-                #     clip = frame.locator('button[aria-label*="Attachment"], a[aria-label*="Attachment"]').first
-                #     if clip.count() == 0:
-                #         clip = frame.locator("span.icon-paperclip").first
-                #
-                #     if clip.count() > 0:
-                #         clip.click()
-                #
-                #         # modal attachments
-                #         # รอให้ปุ่ม Download All โผล่
-                #         frame.wait_for_timeout(1000)
-                #
-                #         # ถ้า Download All เป็น "download" ไฟล์เดียว (zip) จะจับด้วย expect_download
-                #         dlall = frame.get_by_text("Download All")
-                #         if dlall.count() > 0:
-                #             with page.expect_download() as dl2:
-                #                 dlall.click()
-                #             download2 = dl2.value
-                #             wait_download(download2, folder / "attachments_download_all.zip")
-                #             print("Attachments Download All saved")
-                # except Exception as e:
-                #     print(f"[WARN] Paperclip download failed: {e}")
-
-                # ---------- (C) Supporting Documents tab ----------
-                # DISABLED: Focus on PDF export first
-                """
-                # ในรูปมี UAT SignOff / App Scan / CR File Attachment (เป็น link Click to add...)
-                # ดาวน์โหลดไฟล์แนบจากแต่ละ field ใน Supporting Documents
+def export_record(session: dict, item: dict, args, manifest: Manifest, downloader=None, label: str = "") -> list:
+    """Open item's form by URL and run its pending stages (returns the failed artifacts). If the login
+    expired, re-authenticate and retry the same record."""
+    number = item["number"]
+    for attempt in range(MAX_REAUTH_PER_RECORD + 1):
+        reauth.wait_ready()
+        session["probe"] = breaker.wait(session.get("probe"))
+        page = session["page"]
+        try:
+            with concurrency.slot():
+                with metrics.stage("open_record", number=number):
+                    page.goto(record_url(item), wait_until="domcontentloaded")
+                    auth.check_page(page)
+                    frame = get_frame(page)
+                    wait_for_form(page, frame)
+                auth.check_page(page)
+                return process_record(page, frame, number, args, manifest, downloader, item.get("sys_id"))
+        except SessionExpired as e:
+            if attempt == MAX_REAUTH_PER_RECORD:
+                raise
+            print(f"[WARN] {label}{number}: {e}")
+            reauthenticate(session, downloader, label)
+
+def requeue_failed(item: dict, failed: list, label: str = "") -> bool:
+    """Put a failed record (failed artifacts or an error message) on the retry queue. True if it completed."""
+    if not failed:
+        retries.succeeded(item["number"])
+        return True
+    if not retries.add(item, ", ".join(map(str, failed))):
+        print(f"[WARN] {label}{item['number']} will be retried on resume")
+    return False
+
+def export_or_requeue(session: dict, item: dict, args, manifest: Manifest, downloader=None, label: str = "") -> bool:
+    """export_record; a failed record goes on the retry queue. True if the record completed."""
+    try:
+        failed = export_record(session, item, args, manifest, downloader, label)
+    except SessionExpired:
+        raise
+    except Exception as e:
+        print(f"[WARN] {label}{item['number']} failed: {e}")
+        failed = [e]
+    return requeue_failed(item, failed, label)
+
+def retry_failed(session: dict, args, manifest: Manifest, downloader=None, label: str = "") -> int:
+    """End of run: retry requeued records by form URL (only their pending artifacts) until they complete
+    or run out of retries. Returns how many completed."""
+    recovered = 0
+    while True:
+        batch = retries.next_batch()
+        if not batch:
+            return recovered
+        print(f"\n===== {label}Retrying {len(batch)} failed change(s) =====")
+        for item in batch:
+            number = item["number"]
+            print(f"\n=== {label}{number} (retry {retries.attempts[number]}/{retries.max_attempts}) ===")
+            ok = export_or_requeue(session, item, args, manifest, downloader, label)
+            recovered += ok
+            finished_record(session, downloader, label, ok)
+
+def finished_record(session: dict, downloader=None, label: str = "", ok: bool = True) -> bool:
+    """Count a finished record; recycle the context + page when memory_monitor asks for it, or move it
+    to another login session when this one keeps failing. True if the page was replaced."""
+    session["records"] += 1
+    breaker.record(ok, session.pop("probe", None))
+    login = session["login"]
+    reason = memory_monitor.check(session["records"])
+    if login is not None and not session_pool.report(login, ok):
+        other = session_pool.switch(login)
+        if other is not login:
+            login, reason = other, f"moving to session {other.name}"
+        # ไม่มี session อื่นว่าง - ใช้ context เดิมต่อ (recycle เฉพาะเมื่อ memory ขอ)
+    if not reason:
+        return False
+    print(f"[INFO] {label}Recycling browser context after {session['records']} record(s): {reason}")
+    with metrics.stage("context_recycle"):
+        session["context"].close()
+        session.update(open_session(session["browser"], login))
+        if downloader is not None:
+            downloader.set_cookies(session["context"].cookies(BASE))
+    return True
+
+def run_sequential(p, args, manifest: Manifest, query: str = ""):
+    """Single-page mode: open each record directly by sys_id (default) or click it from the list"""
+    browser = p.chromium.launch(headless=args.headless)  # ตอนแรกแนะนำ headless=False เพื่อ debug selector
+    session = open_session(browser, session_pool.acquire())
+    # downloader ใช้ cookies ชุดเดียวกับ context จึงใช้ต่อได้ข้ามการ recycle
+    downloader = make_downloader(session["context"], args)
+
+    run = run_direct if args.navigate == "direct" else run_click_through
+    try:
+        run(session, args, manifest, downloader, query)
+    except SessionExpired as e:
+        # record ที่เหลือยัง pending ใน manifest - รันใหม่หลัง login
+        print(f"[ERROR] {e} - stopping; rerun to resume")
+
+    print_wait_summary()
+    if downloader is not None:
+        downloader.close()
+        print("\n===== Large / resumed downloads =====")
+        for line in downloader.summary():
+            print(line)
+    session_pool.release(session["login"])
+    browser.close()
+
+def list_page_url(first_row: int, query: str = "") -> str:
+    return (f"{LIST_PAGE_URL}&sysparm_query={quote(snow_api.change_query(query))}"
+            f"&sysparm_rows={LIST_PAGE_ROWS}&sysparm_first_row={first_row}")
+
+def open_list_at(page, first_row: int, query: str = ""):
+    """Load the list (filtered by query, newest CAB date first) starting at first_row. Returns the list frame."""
+    return open_list_at_url(page, list_page_url(first_row, query))
+
+def open_list_at_url(page, url: str):
+    with metrics.stage("list_load"):
+        page.goto(url, wait_until="domcontentloaded")
+        auth.check_page(page)
+        frame = get_frame(page)
+        waiter.selector("list_table", frame, LIST_TABLE_SELECTOR)
+    return frame
+
+def load_list_checkpoint(manifest: Manifest, base_query: str, excluding: bool) -> int:
+    """sysparm_first_row to resume from (1 if there is no checkpoint for the CAB range / order / page size).
+
+    excluding: the list filters out exported numbers - rows completed before the checkpoint are no longer
+    in it, so the checkpoint moves up by that many rows.
+    """
+    raw = manifest.get_meta(LIST_CHECKPOINT)
+    if not raw:
+        return 1
+    checkpoint = json.loads(raw)
+    if checkpoint.get("query") != snow_api.change_query(base_query) or checkpoint.get("rows") != LIST_PAGE_ROWS:
+        print("[INFO] CAB range / list order / page size changed since the checkpoint - starting from page 1")
+        return 1
+    first_row = checkpoint["first_row"]
+    if excluding:
+        # ประมาณค่าเกินได้ (ตัดเลขไม่หมดเพราะยาวเกิน URL) -> เริ่มเร็วไปนิดหน่อย ไม่ข้ามงาน
+        first_row = max(1, first_row - checkpoint.get("completed", 0))
+    print(f"[INFO] Resuming list at row {first_row} (page {(first_row - 1) // LIST_PAGE_ROWS + 1}, "
+          f"checkpoint saved {checkpoint['updated']})")
+    return first_row
+
+def save_list_checkpoint(manifest: Manifest, base_query: str, first_row: int, completed: int):
+    # key เฉพาะส่วนที่คงที่ข้าม run (ช่วง CAB date + ลำดับ + page size) ไม่รวมเลขที่ export แล้วที่ถูกตัดออก
+    manifest.set_meta(LIST_CHECKPOINT, json.dumps({
+        "first_row": first_row, "page": (first_row - 1) // LIST_PAGE_ROWS + 1, "completed": completed,
+        "query": snow_api.change_query(base_query), "rows": LIST_PAGE_ROWS,
+        "updated": time.strftime("%Y-%m-%d %H:%M:%S")}))
+
+def walk_list_pages(session: dict, manifest: Manifest, query: str = "", downloader=None, base_query: str = ""):
+    """Yield (page_number, frame, pending rows) for every list page, starting at the checkpoint.
+
+    The checkpoint moves past a page only after the caller has finished it. Rows before the
+    checkpoint (e.g. new CABs sorted to the top) are walked last, then the checkpoint is cleared.
+    It is keyed on base_query (the CAB range, without the exported numbers query excludes).
+    """
+    start = load_list_checkpoint(manifest, base_query, query != base_query)
+    first_row, wrapped = start, start == 1
+    completed = 0  # แถวที่เดินผ่านแล้วเสร็จครบ - run หน้าถูกตัดออกจาก list ทำให้ checkpoint เลื่อนขึ้น
+
+    while not (wrapped and first_row >= start > 1):
+        reauth.wait_ready()
+        try:
+            frame = retry_call(lambda: open_list_at(session["page"], first_row, query), f"List page (row {first_row})")
+        except SessionExpired as e:
+            print(f"[WARN] List page: {e}")
+            reauthenticate(session, downloader)
+            frame = retry_call(lambda: open_list_at(session["page"], first_row, query), f"List page (row {first_row})")
+        rows = [row for row in list_rows(frame) if row["number"]]
+        page_number = (first_row - 1) // LIST_PAGE_ROWS + 1
+
+        # ตัดสินใจทั้งหน้าจาก query เดียวใน manifest (ไม่ต้องเช็คทีละแถว)
+        pending_numbers = set(manifest.pending_among([row["number"] for row in rows]))
+        pending = [row for row in rows if row["number"] in pending_numbers]
+        print(f"\n===== Page {page_number} (row {first_row}): {len(rows)} row(s), "
+              f"{len(rows) - len(pending)} already done =====")
+        if pending:
+            yield page_number, frame, pending
+
+        if len(rows) < LIST_PAGE_ROWS:
+            if wrapped:
+                break
+            # ถึงหน้าสุดท้าย - วนกลับไปเก็บแถวก่อน checkpoint
+            print(f"[INFO] End of list - checking rows 1 to {start - 1}")
+            first_row, wrapped = 1, True
+            continue
+        first_row += len(rows)
+        completed += len(rows) - len(manifest.pending_among([row["number"] for row in rows]))
+        save_list_checkpoint(manifest, base_query, first_row, completed)
+
+    manifest.set_meta(LIST_CHECKPOINT, "")
+
+def run_direct(session: dict, args, manifest: Manifest, downloader, query: str = ""):
+    """Per list page: read pending (number, sys_id) rows, then goto each form - the list is loaded once per page"""
+    done = 0
+    for page_number, frame, pending in walk_list_pages(session, manifest, query, downloader, cab_range_query(args)):
+        for i, item in enumerate(pending):
+            number = item["number"]
+            done += 1
+            print(f"\n=== {number} ({i + 1}/{len(pending)}, Page {page_number}) ===")
+            ok = export_or_requeue(session, item, args, manifest, downloader)
+            finished_record(session, downloader, ok=ok)
+
+    print(f"\n===== Completed! Opened {done} change(s) directly =====")
+    retry_failed(session, args, manifest, downloader)
+
+def run_click_through(session: dict, args, manifest: Manifest, downloader, query: str = ""):
+    """Original loop: click each row, export, go_back to the list"""
+    done = 0
+    for page_number, frame, pending in walk_list_pages(session, manifest, query, downloader, cab_range_query(args)):
+        list_url = session["page"].url
+        for i, item in enumerate(pending):
+            number = item["number"]
+            done += 1
+            print(f"\n=== {number} (Row {i+1}/{len(pending)}, Page {page_number}) ===")
+
+            failed, reload_list = [], False
+            for attempt in range(MAX_REAUTH_PER_RECORD + 1):
+                reauth.wait_ready()
+                session["probe"] = breaker.wait(session.get("probe"))
+                page = session["page"]
                 try:
-                    # คลิกแท็บ Supporting Documents
-                    tab = frame.get_by_role("tab", name="Supporting Documents")
-                    if tab.count() > 0:
-                        tab.click()
-                        frame.wait_for_timeout(1500)
-                        print("Opened Supporting Documents tab")
-
-                        # รายการ field attachments ที่ต้องการดาวน์โหลด
-                        attachment_fields = [
-                            ("UAT SignOff File Attachment", "uat_signoff"),
-                            ("App Scan File Attachment", "app_scan"),
-                            ("CR File Attachment", "cr_file"),
-                        ]
-
-                        for label, folder_name in attachment_fields:
-                            try:
-                                # หา label row
-                                label_elem = frame.locator(f"text={label}").first
-                                if label_elem.count() == 0:
-                                    continue
-
-                                # หาช่อง attachment ที่อยู่ติดกับ label (มักเป็น sibling หรือ parent row)
-                                # วิธีที่ 1: ลองหาปุ่ม paperclip หรือ attachment link ในบริเวณเดียวกับ label
-                                # วิธีที่ 2: หา "Click to add..." link ถ้ามีไฟล์แนบแล้วจะเป็น link ที่แสดงจำนวนไฟล์
-
-                                # หา parent row ของ label
-                                parent_row = label_elem.locator("xpath=ancestor::tr[1]")
-
-                                # ลองหา paperclip icon หรือ attachment link ในแถวนี้
-                                attachment_links = parent_row.locator("a[aria-label*='Attachment'], span.icon-paperclip, a:has-text('attachment')").all()
-
-                                # หรือลองหาปุ่มที่แสดงจำนวนไฟล์ เช่น "2 attachments"
-                                attachment_count_links = parent_row.locator("a.list_edit_attachment").all()
-
-                                if len(attachment_count_links) > 0:
-                                    # มีไฟล์แนบ - คลิกเพื่อเปิด attachment modal
-                                    print(f"  Found attachments in {label}")
-                                    attachment_count_links[0].click()
-                                    frame.wait_for_timeout(1000)
-
-                                    # สร้างโฟลเดอร์ย่อยสำหรับ field นี้
-                                    field_folder = folder / "supporting_documents" / folder_name
-                                    field_folder.mkdir(parents=True, exist_ok=True)
-
-                                    # ดาวน์โหลดไฟล์ทั้งหมดจาก modal
-                                    # วิธีที่ 1: ลองหาปุ่ม "Download All"
-                                    download_all_btn = frame.locator("button:has-text('Download All'), a:has-text('Download All')").first
-                                    if download_all_btn.count() > 0:
-                                        with page.expect_download() as dl:
-                                            download_all_btn.click()
-                                        download = dl.value
-                                        wait_download(download, field_folder / f"{folder_name}_all.zip")
-                                        print(f"    Downloaded all files from {label}")
-                                    else:
-                                        # วิธีที่ 2: ดาวน์โหลดทีละไฟล์
-                                        file_links = frame.locator("a[href*='sys_attachment']").all()
-                                        for idx, file_link in enumerate(file_links):
-                                            try:
-                                                filename = file_link.inner_text().strip()
-                                                if filename:
-                                                    with page.expect_download() as dl:
-                                                        file_link.click()
-                                                    download = dl.value
-                                                    wait_download(download, field_folder / safe_name(filename))
-                                                    print(f"    Downloaded: {filename}")
-                                            except Exception as e:
-                                                print(f"    [WARN] Failed to download file {idx}: {e}")
-
-                                    # ปิด modal (กด ESC หรือหาปุ่ม close)
-                                    page.keyboard.press("Escape")
-                                    frame.wait_for_timeout(500)
-
-                                elif len(attachment_links) > 0:
-                                    # มี paperclip icon - คลิกเพื่อเปิด
-                                    print(f"  Found attachment icon in {label}")
-                                    attachment_links[0].click()
-                                    frame.wait_for_timeout(1000)
-
-                                    # ทำการดาวน์โหลดเหมือนข้างบน
-                                    field_folder = folder / "supporting_documents" / folder_name
-                                    field_folder.mkdir(parents=True, exist_ok=True)
-
-                                    download_all_btn = frame.locator("button:has-text('Download All'), a:has-text('Download All')").first
-                                    if download_all_btn.count() > 0:
-                                        with page.expect_download() as dl:
-                                            download_all_btn.click()
-                                        download = dl.value
-                                        wait_download(download, field_folder / f"{folder_name}_all.zip")
-                                        print(f"    Downloaded all files from {label}")
-
-                                    page.keyboard.press("Escape")
-                                    frame.wait_for_timeout(500)
-                                else:
-                                    print(f"  No attachments found for {label}")
-
-                            except Exception as e:
-                                print(f"  [WARN] Failed to process {label}: {e}")
-
-                        # กลับไปแท็บแรก (optional)
-                        # main_tab = frame.get_by_role("tab", name="Planning")
-                        # if main_tab.count() > 0:
-                        #     main_tab.click()
-
+                    with metrics.stage("open_record", number=number):
+                        # คลิกที่ Change Number ลิงก์ของแถวนี้ (หาจาก sys_id หลังกลับมาจาก go_back)
+                        if item["sys_id"]:
+                            link = frame.locator(f'a.linked.formlink[href*="{item["sys_id"]}"]').first
+                        else:
+                            link = frame.locator("a.linked.formlink", has_text=number).first
+                        link.click()
+
+                        # หลังคลิกเข้า record หน้า form มักอยู่ใน gsft_main เหมือนเดิม
+                        frame = get_frame(page)
+                        wait_for_form(page, frame)
+                    auth.check_page(page)
+                    failed = process_record(page, frame, number, args, manifest, downloader, item["sys_id"])
+                    break
+                except SessionExpired as e:
+                    if attempt == MAX_REAUTH_PER_RECORD:
+                        raise
+                    # login ใหม่แล้วเปิดหน้า list เดิม คลิก record เดิมอีกครั้ง
+                    print(f"[WARN] {number}: {e}")
+                    reauthenticate(session, downloader)
+                    frame = open_list_at_url(session["page"], list_url)
                 except Exception as e:
-                    print(f"[WARN] Supporting Documents handling skipped: {e}")
-                """
+                    # คลิก / เปิด form ไม่สำเร็จ - ลองใหม่ตอนท้าย run (เปิดด้วย URL)
+                    print(f"[WARN] {number} failed: {e}")
+                    failed, reload_list = [e], True
+                    break
+            ok = requeue_failed(item, failed)
 
+            if reload_list:
+                # ไม่รู้ว่าหน้าอยู่ที่ไหน (list หรือ form) - โหลดหน้า list เดิมแทน go_back
+                frame = retry_call(lambda: open_list_at_url(session["page"], list_url), "List page")
+            else:
                 # กลับไป list (ปุ่ม back ของ browser)
-                page.go_back()
-                frame = page.frame(name="gsft_main") or page
-                # รอให้กลับไปหน้า list
-                frame.wait_for_selector("table.list_table, table[role='table'], div[role='grid']", timeout=60_000)
-                page.wait_for_timeout(1000)  # รอให้ตารางโหลดเสร็จ
+                with metrics.stage("go_back"):
+                    page.go_back()
+                    frame = get_frame(page)
+                    # รอให้กลับไปหน้า list และตารางโหลดเสร็จ
+                    waiter.list_ready("go_back", frame)
+
+            if finished_record(session, downloader, ok=ok):
+                # context ใหม่ยังไม่มีหน้า list - เปิดหน้าเดิมต่อ
+                frame = open_list_at_url(session["page"], list_url)
+
+    print(f"\n===== Completed! Processed {done} change(s) =====")
+    retry_failed(session, args, manifest, downloader)
+
+def enumerate_pending(page, downloaded: set, work_queue: queue.Queue, seen: set, query: str = "") -> int:
+    """Walk the CAB list and put every pending change number on work_queue (no record is opened)"""
+    frame = open_list_at(page, 1, query)
+    page_number = 1
+    queued = 0
+
+    while True:
+        items = list_rows(frame)
+        for item in items:
+            number = item["number"]
+            if not number or number in downloaded or number in seen:
+                continue
+            seen.add(number)
+            work_queue.put(item)
+            queued += 1
+        print(f"[LIST] Page {page_number}: {len(items)} rows, {queued} change(s) queued so far")
 
-            # หลังจากประมวลผลทุก row ในหน้านี้แล้ว ตรวจสอบว่ามีปุ่ม Next Page หรือไม่
-            print(f"\nCompleted page {page_number}. Checking for next page...")
+        try:
+            more = go_to_next_page(page, frame)
+        except Exception:
+            # vcr_next ไม่สำเร็จ: โหลดหน้าถัดไปด้วย URL (ลองซ้ำแบบ backoff) แทนการจบ enumeration กลางทาง
+            first_row = page_number * LIST_PAGE_ROWS + 1
+            frame = retry_call(lambda: open_list_at(page, first_row, query), f"List page {page_number + 1}")
+            more = True
+        if not more:
+            break
+        page_number += 1
+
+    return queued
+
+def cab_range_query(args) -> str:
+    """--cab-from / --cab-to as an encoded query (the part of the list query that is the same every run)"""
+    return snow_api.date_range_query(snow_api.CAB_DATE_FIELD, args.cab_from, args.cab_to)
+
+def pending_query(downloaded: set, args) -> str:
+    """Encoded query so the list / Table API returns (mostly) pending work only:
+    the --cab-from / --cab-to range plus already exported numbers excluded (as many as fit in the URL)"""
+    date_range = cab_range_query(args)
+    exclusion, excluded = snow_api.exclude_numbers_query(downloaded, max_chars=args.max_query_chars)
+    if downloaded and args.max_query_chars > 0:
+        print(f"[INFO] Server-side filter excludes {excluded}/{len(downloaded)} exported change(s) "
+              f"({len(exclusion)} chars), the rest are skipped client-side")
+    return snow_api.and_query(date_range, exclusion)
+
+def api_session(page) -> snow_api.ApiSession:
+    # context.request แชร์ cookies จาก state.json กับ browser context
+    return snow_api.ApiSession(page.context.request, BASE, token_page=page)
+
+def enumerate_pending_api(page, downloaded: set, work_queue: queue.Queue, seen: set, query: str = "") -> int:
+    """Stream pending change requests from the Table API into work_queue"""
+    queued = 0
+    for record in api_session(page).iter_change_requests(query):
+        number = record.get("number", "").strip()
+        if not number or number in downloaded or number in seen:
+            continue
+        seen.add(number)
+        work_queue.put(record)
+        queued += 1
+        if queued % 500 == 0:
+            print(f"[API] {queued} change(s) queued so far")
+    return queued
+
+def enumerate_since_last_run(page, manifest: Manifest, work_queue: queue.Queue, seen: set):
+    """Queue only changes updated, or given new attachments, since the stored watermarks.
+
+    Returns (queued, new watermarks) - the watermarks are saved by the caller after the workers finish.
+    """
+    api = api_session(page)
+    change_mark = manifest.get_meta(WATERMARK_CHANGES)
+    attachment_mark = manifest.get_meta(WATERMARK_ATTACHMENTS)
+    marks = {WATERMARK_CHANGES: change_mark, WATERMARK_ATTACHMENTS: attachment_mark}
+    queued = 0
+
+    def enqueue(item: dict):
+        nonlocal queued
+        if item["number"] in seen:
+            return
+        seen.add(item["number"])
+        work_queue.put(item)
+        queued += 1
+
+    # งานค้างจากรอบก่อน (failed / stale) ต้องทำต่อแม้จะเก่ากว่า watermark
+    for number, sys_id in manifest.incomplete_changes():
+        enqueue({"number": number, "sys_id": sys_id})
+    print(f"[SYNC] {queued} incomplete change(s) from previous runs")
+
+    # 1) record ที่ถูกแก้หลัง watermark -> PDF ใหม่
+    query = snow_api.since_query("sys_updated_on", change_mark)
+    for record in api.iter_change_requests(query):
+        updated = record.get("sys_updated_on", "")
+        if updated <= change_mark:
+            continue  # อยู่ในช่วง overlap ของ time zone
+        marks[WATERMARK_CHANGES] = max(marks[WATERMARK_CHANGES], updated)
+        manifest.invalidate(record["number"], ["pdf"])
+        enqueue(record)
+    print(f"[SYNC] Changes updated since {change_mark}: {queued} queued so far")
+
+    # 2) attachment ใหม่หลัง watermark -> Supporting Documents + attachments zip ใหม่
+    query = "table_name=change_request^" + snow_api.since_query("sys_created_on", attachment_mark)
+    changed_sys_ids = set()
+    for attachment in api.iter_attachments(query):
+        created = attachment.get("sys_created_on", "")
+        if created <= attachment_mark:
+            continue
+        marks[WATERMARK_ATTACHMENTS] = max(marks[WATERMARK_ATTACHMENTS], created)
+        changed_sys_ids.add(attachment["table_sys_id"])
+
+    sys_ids = sorted(changed_sys_ids)
+    for i in range(0, len(sys_ids), 100):
+        for record in api.iter_change_requests("sys_idIN" + ",".join(sys_ids[i:i + 100])):
+            manifest.invalidate(record["number"], ["supporting_docs", "attachments_zip"])
+            enqueue(record)
+    print(f"[SYNC] {len(sys_ids)} change(s) with new attachments since {attachment_mark}")
+
+    return queued, marks
+
+def current_watermarks(page) -> dict:
+    """Newest sys_updated_on / attachment sys_created_on on the instance (baseline for the next sync)"""
+    api = api_session(page)
+    marks = {}
+    for key, path, query, field in (
+        (WATERMARK_CHANGES, "/api/now/table/change_request", "ORDERBYDESCsys_updated_on", "sys_updated_on"),
+        (WATERMARK_ATTACHMENTS, "/api/now/attachment",
+         "table_name=change_request^ORDERBYDESCsys_created_on", "sys_created_on"),
+    ):
+        records = api.get_result(path, snow_api.page_params(query, (field,), 1, 0))
+        if records:
+            marks[key] = records[0][field]
+    return marks
+
+def record_url(item: dict) -> str:
+    """Form URL for a queued change: by sys_id when known, otherwise by number"""
+    if item.get("sys_id"):
+        return f"{CHANGE_FORM_URL}{item['sys_id']}"
+    return f"{CHANGE_RECORD_URL}{item['number']}"
+
+def run_worker(worker_id: int, work_queue: queue.Queue, stats: dict, args, manifest: Manifest):
+    """Worker thread: own Playwright + BrowserContext from a pooled login session, opens each queued record directly"""
+    # sync API ใช้ข้าม thread ไม่ได้ ต้องมี playwright instance ของตัวเองในแต่ละ thread
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=args.headless)
+        session = open_session(browser, session_pool.acquire())
+        print(f"[W{worker_id}] Using session {session['login'].name}")
+        downloader = make_downloader(session["context"], args)
 
-            # Scroll หน้าลงไปล่างสุดก่อน เพื่อให้ pagination buttons เข้ามาในมุมมอง
-            try:
-                frame.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                page.wait_for_timeout(500)
-            except:
-                pass
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
 
-            # ใช้ JavaScript หาและ click ปุ่ม Next เพราะ Playwright click อาจถูกบัง
+            number = item["number"]
+            print(f"\n=== [W{worker_id}] {number} ===")
             try:
-                # ลอง click ด้วย JavaScript โดยตรง (หลีกเลี่ยงปัญหา element ถูกบัง)
-                result = frame.evaluate("""
-                    () => {
-                        // หาปุ่ม Next โดยใช้ name attribute
-                        const btn = document.querySelector('button[name="vcr_next"]');
-                        if (!btn) {
-                            return { found: false, reason: 'button not found' };
-                        }
+                manifest.upsert_change(number, item.get("sys_id"), item.get(snow_api.CAB_DATE_FIELD),
+                                       item.get("sys_updated_on"))
+                ok = export_or_requeue(session, item, args, manifest, downloader, f"[W{worker_id}] ")
+            except SessionExpired as e:
+                # record ที่เหลือยัง pending ใน manifest - รันใหม่หลัง login
+                print(f"[ERROR] [W{worker_id}] {e} - stopping this worker; rerun to resume")
+                break
+            except Exception as e:
+                print(f"[WARN] [W{worker_id}] {number} failed: {e}")
+                ok = requeue_failed(item, [e], f"[W{worker_id}] ")
+            if ok:
+                stats[worker_id] = stats.get(worker_id, 0) + 1
+            finished_record(session, downloader, f"[W{worker_id}] ", ok)
+
+        if downloader is not None:
+            downloader.close()
+            for line in downloader.summary():
+                print(f"[W{worker_id}]{line}")
+        session_pool.release(session["login"])
+        browser.close()
 
-                        // ตรวจสอบว่า disabled หรือไม่
-                        if (btn.disabled) {
-                            return { found: true, disabled: true };
-                        }
+def start_workers(count: int, work_queue: queue.Queue, stats: dict, args, manifest: Manifest) -> list:
+    threads = [
+        threading.Thread(target=run_worker, name=f"W{i + 1}",
+                         args=(i + 1, work_queue, stats, args, manifest))
+        for i in range(count)
+    ]
+    for t in threads:
+        t.start()
+    return threads
+
+def retry_parallel(stats: dict, args, manifest: Manifest):
+    """End of run: feed requeued records to a fresh set of workers until they complete or run out of retries"""
+    while True:
+        batch = retries.next_batch()
+        if not batch:
+            return
+        print(f"\n===== Retrying {len(batch)} failed change(s) =====")
+        work_queue = queue.Queue()
+        for item in batch:
+            work_queue.put(item)
+        count = min(args.workers, len(batch))
+        for _ in range(count):
+            work_queue.put(None)
+        for t in start_workers(count, work_queue, stats, args, manifest):
+            t.join()
+
+def run_parallel(p, downloaded: set, args, manifest: Manifest, query: str = ""):
+    """Enumerate pending changes (Table API or list UI) and fan them out to N worker contexts"""
+    work_queue = queue.Queue()
+    stats = {}
+    seen = set()
+
+    if args.workers > session_pool.capacity:
+        print(f"[WARN] {args.workers} workers but the sessions allow {session_pool.capacity} context(s) - "
+              f"using {session_pool.capacity} (add sessions or raise --session-limit)")
+        args.workers = session_pool.capacity
+    threads = start_workers(args.workers, work_queue, stats, args, manifest)
+
+    # main thread หา change ที่ต้อง export แล้วส่งให้ worker ผ่าน queue
+    browser = p.chromium.launch(headless=args.headless)
+    context = new_context(browser, session_pool.sessions[0].state)
+    page = context.new_page()
+    marks = {}
+    try:
+        queued = 0
+        enumerate_mode = args.enumerate
+        if args.since_last_run:
+            if manifest.get_meta(WATERMARK_CHANGES) and manifest.get_meta(WATERMARK_ATTACHMENTS):
+                queued, marks = enumerate_since_last_run(page, manifest, work_queue, seen)
+                enumerate_mode = None
+            else:
+                # ยังไม่เคยมี watermark: export ตามปกติ แล้วเริ่มนับ watermark จากตอนนี้
+                print("[SYNC] No watermark yet - running a full export and recording the baseline")
+                marks = current_watermarks(page)
+        if enumerate_mode == "api":
+            try:
+                queued = enumerate_pending_api(page, downloaded, work_queue, seen, query)
+            except snow_api.ApiError as e:
+                print(f"[WARN] Table API enumeration failed ({e}) - falling back to list UI")
+                enumerate_mode = "ui"
+        if enumerate_mode == "ui":
+            queued += enumerate_pending(page, downloaded, work_queue, seen, query)
+        print(f"\n[LIST] Enumeration done: {queued} pending change(s)")
+    finally:
+        browser.close()
+        for _ in threads:
+            work_queue.put(None)
+
+    for t in threads:
+        t.join()
+    retry_parallel(stats, args, manifest)
+
+    # เลื่อน watermark หลัง worker ทำเสร็จแล้วเท่านั้น (งานที่ fail จะถูกหยิบจาก manifest รอบหน้า)
+    for key, value in marks.items():
+        if value:
+            manifest.set_meta(key, value)
+            print(f"[SYNC] {key} = {value}")
+
+    print(f"\n===== Completed! {sum(stats.values())} change(s) exported by {args.workers} worker(s) =====")
+    for worker_id in sorted(stats):
+        print(f"  W{worker_id}: {stats[worker_id]}")
+    print_wait_summary()
+
+def wait_budget(value: str) -> tuple:
+    """argparse type for --wait-budget STAGE=MS"""
+    stage, sep, ms = value.partition("=")
+    stage = stage.strip()
+    if not sep or not stage:
+        raise argparse.ArgumentTypeError(f"expected STAGE=MS, got {value!r}")
+    if stage not in STAGE_BUDGETS:
+        raise argparse.ArgumentTypeError(f"unknown wait stage {stage!r} (choose from {', '.join(STAGE_BUDGETS)})")
+    try:
+        budget = int(ms)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{stage}: budget must be whole milliseconds, got {ms.strip()!r}")
+    if budget <= 0:
+        raise argparse.ArgumentTypeError(f"{stage}: budget must be > 0 ms")
+    return stage, budget
 
-                        // Click ด้วย JavaScript
-                        btn.click();
-                        return { found: true, disabled: false, clicked: true };
-                    }
-                """)
 
-                print(f"Next Page button check: {result}")
+def main():
+    parser = argparse.ArgumentParser(description="Export ServiceNow change requests (PDF + attachments)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of parallel browser contexts (default: 1)")
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync",
+                        help="sync_playwright worker threads (default) or the asyncio pipeline in export_async.py "
+                             "(Table API + PDF over HTTP only: no list UI / PDF menu fallback, "
+                             "no --enumerate ui, --navigate click, --attachments ui or --pdf ui)")
+    parser.add_argument("--pages-per-context", type=int, default=2,
+                        help="async engine: pages (records in flight) per browser context (default: 2)")
+    parser.add_argument("--enumerate", choices=["api", "ui"], default="api",
+                        help="find pending changes via the Table API (default) or by paging the list UI")
+    parser.add_argument("--navigate", choices=["direct", "click"], default="direct",
+                        help="list UI with 1 worker: collect sys_ids then open each record by URL (default), "
+                             "or click each row and go_back to the list")
+    parser.add_argument("--attachments", choices=["http", "ui"], default="http",
+                        help="download Supporting Documents over direct HTTP (default) or by clicking each link")
+    parser.add_argument("--pdf", choices=["url", "ui"], default="url",
+                        help="export the PDF from change_request.do?PDF (default; the sync engine falls back to the menu) "
+                             "or via the menu (sync engine only)")
+    parser.add_argument("--download-concurrency", type=int, default=4,
+                        help="parallel HTTP transfers per browser context (default: 4)")
+    parser.add_argument("--range-connections", type=int, default=RANGE_CONNECTIONS,
+                        help="parallel Range requests per large attachment "
+                             f"(default: {RANGE_CONNECTIONS}, 1 = single stream)")
+    parser.add_argument("--wait-budget", action="append", default=[], type=wait_budget, metavar="STAGE=MS",
+                        help="override the upper bound of a wait stage, e.g. --wait-budget pdf_ready=60000")
+    parser.add_argument("--since-last-run", action="store_true",
+                        help="only refresh changes updated / given new attachments since the last run's watermark")
+    parser.add_argument("--cab-from", metavar="YYYY-MM-DD", help="only changes with CAB date on or after this day")
+    parser.add_argument("--cab-to", metavar="YYYY-MM-DD", help="only changes with CAB date on or before this day")
+    parser.add_argument("--max-query-chars", type=int, default=snow_api.MAX_QUERY_CHARS,
+                        help="URL budget for excluding exported numbers in the list / API query "
+                             f"(default: {snow_api.MAX_QUERY_CHARS}, 0 = filter client-side only)")
+    parser.add_argument("--block", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="abort unneeded requests: safe = images/fonts/media/analytics/AMB (default), "
+                             "aggressive = also stylesheets, off = no filtering")
+    parser.add_argument("--block-pattern", action="append", default=[], metavar="REGEX",
+                        help="extra URL pattern to abort (repeatable)")
+    parser.add_argument("--allow-pattern", action="append", default=[], metavar="REGEX",
+                        help="URL pattern that must never be blocked (repeatable)")
+    parser.add_argument("--asset-cache", type=Path, default=ASSET_CACHE_DIR, metavar="DIR",
+                        help="directory of the persistent js/css/font cache (default: asset_cache)")
+    parser.add_argument("--asset-cache-mb", type=int, default=DEFAULT_MAX_MB,
+                        help=f"size limit of the asset cache, 0 disables it (default: {DEFAULT_MAX_MB})")
+    parser.add_argument("--sessions", metavar="NAMES",
+                        help="spread contexts over saved sessions: comma-separated names from states/<name>.json "
+                             "or 'all' (default: state.json only)")
+    parser.add_argument("--session-limit", type=int, default=DEFAULT_SESSION_LIMIT,
+                        help=f"max contexts per session with --sessions (default: {DEFAULT_SESSION_LIMIT})")
+    parser.add_argument("--reauth", choices=REAUTH_MODES, default="login",
+                        help="when a session expires mid-run: rerun the login flow in a browser window (default), "
+                             "wait for the state file to be refreshed, or stop")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="skip checking that each saved session is still logged in before exporting")
+    parser.add_argument("--recycle-every", type=int, default=DEFAULT_RECYCLE_EVERY, metavar="N",
+                        help=f"open a fresh browser context every N records (default: {DEFAULT_RECYCLE_EVERY}, 0 = never)")
+    parser.add_argument("--recycle-rss-mb", type=int, default=DEFAULT_LIMIT_MB, metavar="MB",
+                        help="also recycle when all Chromium processes together use more than MB of RSS "
+                             f"(default: {DEFAULT_LIMIT_MB}, 0 = off)")
+    parser.add_argument("--retries", type=int, default=MAX_ATTEMPTS, metavar="N",
+                        help="retry a failed change up to N times at the end of the run, with exponential backoff "
+                             f"(default: {MAX_ATTEMPTS}, 0 = leave it for the next run)")
+    parser.add_argument("--breaker-threshold", type=float, default=ERROR_THRESHOLD, metavar="RATE",
+                        help="pause all workers when this share of the recent records failed, or on HTTP 429 / 503 "
+                             f"(default: {ERROR_THRESHOLD}, 0 = off)")
+    parser.add_argument("--breaker-cooldown", type=float, default=COOLDOWN_S, metavar="S",
+                        help=f"first pause in seconds, doubled while the instance keeps failing (default: {COOLDOWN_S})")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="adapt the number of records in flight (up to --workers, or --workers x "
+                             "--pages-per-context with the async engine) to form-load / PDF latency and errors")
+    parser.add_argument("--start-concurrency", type=int, default=1, metavar="N",
+                        help="--adaptive: records in flight at the start (default: 1)")
+    parser.add_argument("--target-form-ms", type=int, default=DEFAULT_TARGETS_MS["form"], metavar="MS",
+                        help=f"--adaptive: p90 form-load target (default: {DEFAULT_TARGETS_MS['form']})")
+    parser.add_argument("--target-pdf-ms", type=int, default=DEFAULT_TARGETS_MS["pdf"], metavar="MS",
+                        help=f"--adaptive: p90 PDF generation target (default: {DEFAULT_TARGETS_MS['pdf']})")
+    parser.add_argument("--unpack-workers", type=int, default=DEFAULT_UNPACK_WORKERS,
+                        help="--attachments ui: processes that unpack and route attachments_all.zip in the "
+                             f"background (default: {DEFAULT_UNPACK_WORKERS}, 0 = unpack inline)")
+    parser.add_argument("--selector-stats", type=Path, default=SELECTOR_STATS, metavar="PATH",
+                        help="learned selector order per instance, shared with the DEV script "
+                             f"(default: {SELECTOR_STATS})")
+    parser.add_argument("--metrics-dir", type=Path, default=METRICS_DIR,
+                        help="directory for the per-run stage latency file run-*.jsonl (default: metrics)")
+    parser.add_argument("--prometheus-textfile", type=Path, metavar="PATH",
+                        help="also write the latency summary in Prometheus textfile format to PATH")
+    parser.add_argument("--headless", action="store_true", help="run Chromium headless")
+    args = parser.parse_args()
+    if args.since_last_run and args.engine == "async":
+        parser.error("--since-last-run is only supported by the sync engine")
+    if args.engine == "async" and (args.enumerate == "ui" or args.navigate == "click" or args.attachments == "ui"):
+        # engine async หางานผ่าน Table API อย่างเดียว เปิด record ด้วย URL และโหลดไฟล์แนบผ่าน HTTP เสมอ
+        parser.error("--enumerate ui / --navigate click / --attachments ui are only supported by the sync engine")
+    if args.pdf == "ui" and args.engine == "async":
+        parser.error("--pdf ui is only supported by the sync engine")
+
+    global net_filter, asset_cache, memory_monitor, session_pool, reauth, selectors, postprocessor, retries, breaker
+    global concurrency
+    net_filter = NetworkFilter(args.block, args.block_pattern, args.allow_pattern)
+    asset_cache = AssetCache(args.asset_cache, args.asset_cache_mb * 1024 * 1024)
+    memory_monitor = MemoryMonitor(args.recycle_every, args.recycle_rss_mb, metrics)
+    # ไม่ระบุ --sessions: state.json เดียว ให้ทุก worker ใช้ร่วมกันได้ (เหมือนเดิม)
+    session_limit = args.session_limit if args.sessions else max(1, args.workers)
+    session_pool = SessionPool(resolve_states(args.sessions, STATE), session_limit)
+    reauth = Reauthenticator(args.reauth)
+    retries = RetryQueue(args.retries)
+    breaker = CircuitBreaker(args.breaker_threshold, cooldown_s=args.breaker_cooldown, metrics=metrics)
+    max_in_flight = args.workers * (args.pages_per_context if args.engine == "async" else 1)
+    if args.adaptive:
+        concurrency = AimdController(max_in_flight, args.start_concurrency, metrics=metrics,
+                                     targets_ms={"form": args.target_form_ms, "pdf": args.target_pdf_ms})
+        metrics.listeners.append(concurrency.observe)
+    else:
+        concurrency = AimdController(max_in_flight, start=max_in_flight)
+    selectors = SelectorRegistry(urlsplit(BASE).netloc, args.selector_stats)
+    if args.sessions:
+        print(f"Sessions: {', '.join(s.name for s in session_pool.sessions)} (up to {session_limit} context(s) each)")
 
-                if not result.get('found'):
-                    print("No Next Page button found. Reached last page.")
-                    break
-                elif result.get('disabled'):
-                    print("Next Page button is disabled. Reached last page.")
-                    break
-                elif result.get('clicked'):
-                    print("Successfully clicked Next Page button with JavaScript")
+    waiter.budgets.update(args.wait_budget)
 
-                    # รอให้หน้าใหม่โหลด
-                    page.wait_for_timeout(3000)
+    OUT.mkdir(parents=True, exist_ok=True)
+    metrics.start(args.metrics_dir, args.prometheus_textfile)
 
-                    # รอให้ตารางมา
-                    frame.wait_for_selector("table.list_table, table[role='table'], div[role='grid']", timeout=60_000)
-                    page.wait_for_timeout(1000)
+    # Load already completed change numbers for resume capability
+    manifest = open_manifest()
+    downloaded = manifest.completed_numbers()
+    if downloaded:
+        print(f"Found {len(downloaded)} already downloaded change(s). Will skip them.")
+    else:
+        print("No previous downloads found. Starting fresh.")
 
-                    page_number += 1
-                    continue  # วนต่อไปยังหน้าถัดไป
+    query = pending_query(downloaded, args)
+    # zip ของ Download All มีเฉพาะ --attachments ui (engine sync)
+    unpack_workers = args.unpack_workers if args.attachments == "ui" and args.engine == "sync" else 0
+    postprocessor = PostProcessor(manifest, unpack_workers, metrics)
+    try:
+        if not args.no_preflight:
+            with sync_playwright() as p:
+                preflight_sessions(p, args)
+        if args.engine == "async":
+            export_async.run(args, downloaded, base=BASE, state=STATE, manifest=manifest, query=query,
+                             metrics=metrics, net_filter=net_filter, asset_cache=asset_cache,
+                             memory=memory_monitor, session_pool=session_pool, reauth=reauth,
+                             retries=retries, breaker=breaker, concurrency=concurrency if args.adaptive else None,
+                             record_folder=lambda number: OUT / safe_name(number))
+        else:
+            with sync_playwright() as p:
+                if args.workers > 1 or args.enumerate == "api" or args.since_last_run:
+                    run_parallel(p, downloaded, args, manifest, query)
                 else:
-                    print("[WARN] Unexpected result from Next Page button click")
-                    break
-
-            except Exception as e:
-                print(f"[WARN] Failed to click Next Page with JavaScript: {e}")
-                break
-
-        print(f"\n===== Completed! Processed {page_number} page(s) =====")
-        browser.close()
+                    run_sequential(p, args, manifest, query)
+    finally:
+        print("\n===== Sessions =====")
+        for line in session_pool.summary():
+            print(line)
+        for line in reauth.summary():
+            print(line)
+        if args.adaptive:
+            print("\n===== Adaptive concurrency =====")
+            for line in concurrency.summary():
+                print(line)
+        print("\n===== Retries / circuit breaker =====")
+        for line in retries.summary() + breaker.summary():
+            print(line)
+        selectors.save()
+        lines = selectors.summary()
+        if lines:
+            print("\n===== UI selectors (learned order) =====")
+            for line in lines:
+                print(line)
+        postprocessor.close()
+        if postprocessor.enabled:
+            print("\n===== Unpack (post-processing) =====")
+            for line in postprocessor.summary():
+                print(line)
+        print("\n===== Memory / context recycling =====")
+        for line in memory_monitor.summary():
+            print(line)
+        print_metrics_summary()
+        metrics.close()
+        print("\n===== Manifest =====")
+        for line in manifest.summary():
+            print(line)
+        manifest.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
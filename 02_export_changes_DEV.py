@@ -1,7 +1,14 @@
+import os
 import re
 from pathlib import Path
+from urllib.parse import urlsplit
 from playwright.sync_api import sync_playwright
 
+import auth
+from retry import CALL_ATTEMPTS, retry_call
+from selector_registry import SELECTOR_STATS, SelectorRegistry
+from waits import LIST_CHANGED_JS
+
 ## DEV
 BASE = "https://seicthdev.service-now.com"
 
@@ -18,14 +25,20 @@ CHANGE_LIST_URL = (
     "change_request_list.do?sysparm_view=cab"
 )
 
+# ใช้ selector_stats.json ร่วมกับ 02_export_changes.py (ลำดับที่เรียนรู้แยกตาม instance)
+selectors = SelectorRegistry(urlsplit(BASE).netloc, SELECTOR_STATS)
+
 def safe_name(s: str) -> str:
     s = s.strip()
     s = re.sub(r'[\\/:*?"<>|]+', "_", s)
     return s[:150]
 
 def wait_download(download, target: Path):
+    # save ลง .part ก่อนแล้ว rename - ไฟล์ชื่อจริงมีอยู่ = ครบแน่นอน
     target.parent.mkdir(parents=True, exist_ok=True)
-    download.save_as(str(target))
+    part = target.with_name(target.name + ".part")
+    download.save_as(str(part))
+    os.replace(part, target)
 
 def load_downloaded() -> set:
     """Load the set of already downloaded change numbers from log file"""
@@ -46,6 +59,20 @@ def mark_downloaded(change_number: str):
         f.write(f"{change_number}\n")
         f.flush()  # Ensure it's written immediately
 
+def wait_list_table(page):
+    """Wait for the list table in gsft_main (or the page) and return that frame"""
+    frame = page.frame(name="gsft_main") or page
+    frame.wait_for_selector("table.list_table, table[role='table'], div[role='grid']", timeout=60_000)
+    return frame
+
+def list_page_changed(page, previous: str, timeout: int = 30_000) -> bool:
+    """True once the list's first row differs from previous (the vcr_next click went through)"""
+    try:
+        (page.frame(name="gsft_main") or page).wait_for_function(LIST_CHANGED_JS, arg=previous, timeout=timeout)
+        return True
+    except Exception:
+        return False
+
 def main():
     OUT.mkdir(parents=True, exist_ok=True)
 
@@ -61,6 +88,12 @@ def main():
         context = browser.new_context(storage_state=STATE, accept_downloads=True)
         page = context.new_page()
 
+        # เช็คก่อนว่า state.json ยัง login อยู่ (ไม่งั้นทุก record จะได้หน้า login)
+        if not auth.preflight(page, BASE):
+            print(f"[ERROR] {STATE} is no longer logged in - run 01_login_save_state.py first")
+            browser.close()
+            return
+
         # เข้า list
         page.goto(CHANGE_LIST_URL, wait_until="domcontentloaded")
 
@@ -92,6 +125,7 @@ def main():
         # ดึง link ของ change number ในหน้าปัจจุบัน
         # Loop through all pages until no more next page button
         page_number = 1
+        expired = False
 
         while True:
             print(f"\n===== Processing Page {page_number} =====")
@@ -140,14 +174,20 @@ def main():
                     print(f"[WARN] Form not found, trying to continue anyway. Error: {e}")
                     page.wait_for_timeout(3000)
 
+                # session หมดอายุกลาง run: หยุดโดยไม่ mark record นี้ (รันใหม่หลัง login จะเริ่มที่ record นี้)
+                if auth.page_expired(page):
+                    print(f"[ERROR] {number}: redirected to login page - session expired. "
+                          f"Run 01_login_save_state.py and rerun to resume from this record")
+                    expired = True
+                    break
+
                 # ---------- (A) Export PDF ผ่าน UI ----------
                 # Step 1-5: Additional actions -> Export -> PDF -> Export -> Download
                 try:
                     # Step 1: กดปุ่ม "Additional actions" (icon menu)
-                    additional_actions_btn = frame.locator('button.additional-actions-context-menu-button[aria-label="additional actions"]').first
-                    if additional_actions_btn.count() == 0:
-                        # ลองหาใน page หลัก (ไม่ใช่ใน frame)
-                        additional_actions_btn = page.locator('button.additional-actions-context-menu-button[aria-label="additional actions"]').first
+                    additional_actions_btn = selectors.find("additional_actions", page, frame)
+                    if additional_actions_btn is None:
+                        raise Exception("Additional actions button not found")
 
                     additional_actions_btn.click(timeout=5_000)
                     print("Clicked Additional actions button")
@@ -159,13 +199,10 @@ def main():
                     export_menu = None
                     for attempt in range(3):  # ลอง 3 ครั้ง
                         try:
-                            # ลองหา Export menu item
-                            export_menu = frame.locator('div.context_item[role="menuitem"][data-context-menu-label="Export"]').first
-                            if export_menu.count() == 0:
-                                # fallback: ลองหาด้วย item_id
-                                export_menu = frame.locator('div.context_item[item_id="context_exportmenu"]').first
+                            # ลองหา Export menu item (strategy ที่เคยเจอบน instance นี้ก่อน)
+                            export_menu = selectors.find("export_menu", page, frame)
 
-                            if export_menu.count() > 0:
+                            if export_menu is not None:
                                 # รอให้ visible
                                 export_menu.wait_for(state="visible", timeout=5_000)
                                 break
@@ -180,7 +217,7 @@ def main():
                             else:
                                 raise
 
-                    if export_menu is None or export_menu.count() == 0:
+                    if export_menu is None:
                         raise Exception("Export menu not found after 3 attempts")
 
                     export_menu.hover()
@@ -192,9 +229,9 @@ def main():
                     frame.wait_for_timeout(1000)  # รอให้ Export dialog ขึ้นมา
 
                     # Step 4: กดปุ่ม "Export" ใน dialog เพื่อเริ่ม generate PDF
-                    export_btn = frame.locator('button#ok_button').first
-                    if export_btn.count() == 0:
-                        export_btn = page.locator('button#ok_button').first
+                    export_btn = selectors.find("ok_button", page, frame)
+                    if export_btn is None:
+                        raise Exception("Export (ok_button) not found")
 
                     export_btn.click()
                     print("Generating PDF...")
@@ -203,9 +240,11 @@ def main():
                     frame.wait_for_timeout(3000)  # รอให้ process PDF
 
                     # Step 5: กดปุ่ม "Download" เพื่อดาวน์โหลด PDF
-                    download_btn = frame.locator('button#download_button').first
-                    if download_btn.count() == 0:
-                        download_btn = page.locator('button#download_button').first
+                    download_btn = selectors.find("download_button", page, frame)
+                    if download_btn is None:
+                        # ยัง generate ไม่เสร็จ - รอใน context ที่น่าจะเจอที่สุด
+                        context_name, selector = selectors.ordered("download_button")[0]
+                        download_btn = (frame if context_name == "frame" else page).locator(selector).first
 
                     # รอให้ปุ่ม Download พร้อม
                     download_btn.wait_for(state="visible", timeout=30_000)
@@ -283,16 +322,9 @@ def main():
                 # ---------- (E) Download All Attachments ----------
                 try:
                     # คลิกปุ่ม paperclip icon (Manage Attachments)
-                    paperclip_btn = frame.locator('button#header_add_attachment').first
-                    if paperclip_btn.count() == 0:
-                        # fallback: หาด้วย class และ aria-label
-                        paperclip_btn = frame.locator('button.icon-paperclip[aria-label="Manage Attachments"]').first
+                    paperclip_btn = selectors.find("header_add_attachment", page, frame)
 
-                    if paperclip_btn.count() == 0:
-                        # ลองหาใน page หลัก
-                        paperclip_btn = page.locator('button#header_add_attachment').first
-
-                    if paperclip_btn.count() > 0:
+                    if paperclip_btn is not None:
                         paperclip_btn.click()
                         print("Clicked Manage Attachments button")
 
@@ -307,16 +339,9 @@ def main():
                         if no_attachments_msg.count() > 0:
                             print("No attachments found")
                             # ปิด dialog ด้วยปุ่ม Close
-                            close_btn = frame.locator('button#attachment_closemodal').first
-                            if close_btn.count() == 0:
-                                # fallback: หาด้วย data-dismiss และ class
-                                close_btn = frame.locator('button[data-dismiss="GlideModal"].close').first
-
-                            if close_btn.count() == 0:
-                                # ลองหาใน page หลัก
-                                close_btn = page.locator('button#attachment_closemodal').first
+                            close_btn = selectors.find("attachment_closemodal", page, frame)
 
-                            if close_btn.count() > 0:
+                            if close_btn is not None:
                                 close_btn.click()
                             else:
                                 # fallback: ใช้ ESC ถ้าหาปุ่มไม่เจอ
@@ -325,16 +350,9 @@ def main():
                             frame.wait_for_timeout(500)
                         else:
                             # มี attachments - หาปุ่ม "Download All"
-                            download_all_btn = frame.locator('input#download_all_button[value="Download All"]').first
-                            if download_all_btn.count() == 0:
-                                # fallback: หาด้วย onclick
-                                download_all_btn = frame.locator('input[onclick*="downloadAllAttachments"]').first
-
-                            if download_all_btn.count() == 0:
-                                # ลองหาใน page หลัก
-                                download_all_btn = page.locator('input#download_all_button[value="Download All"]').first
+                            download_all_btn = selectors.find("download_all_button", page, frame)
 
-                            if download_all_btn.count() > 0:
+                            if download_all_btn is not None:
                                 # สร้างโฟลเดอร์ Attachment
                                 attachment_folder = folder / "Attachment"
                                 attachment_folder.mkdir(parents=True, exist_ok=True)
@@ -510,6 +528,9 @@ def main():
                 frame.wait_for_selector("table.list_table, table[role='table'], div[role='grid']", timeout=60_000)
                 page.wait_for_timeout(1000)  # รอให้ตารางโหลดเสร็จ
 
+            if expired:
+                break
+
             # หลังจากประมวลผลทุก row ในหน้านี้แล้ว ตรวจสอบว่ามีปุ่ม Next Page หรือไม่
             print(f"\nCompleted page {page_number}. Checking for next page...")
 
@@ -521,26 +542,49 @@ def main():
                 pass
 
             # ใช้ JavaScript หาและ click ปุ่ม Next เพราะ Playwright click อาจถูกบัง
+            # รอตาราง fail ชั่วคราว (instance ช้า) -> ลองซ้ำแบบ backoff ก่อนยอมจบ run
+            # การคลิกไม่ลองซ้ำตรง ๆ: evaluate อาจ fail หลัง btn.click() ไปแล้ว (navigation ทำลาย execution context)
+            # คลิกซ้ำจะข้ามไปอีกหน้า - ดูแถวแรกก่อนว่าหน้าเปลี่ยนหรือยัง
             try:
-                # ลอง click ด้วย JavaScript โดยตรง (หลีกเลี่ยงปัญหา element ถูกบัง)
-                result = frame.evaluate("""
+                # จำเลข change แถวแรกไว้ (อ่านอย่างเดียว ลองซ้ำได้)
+                previous = retry_call(lambda: (page.frame(name="gsft_main") or page).evaluate("""
                     () => {
-                        // หาปุ่ม Next โดยใช้ name attribute
-                        const btn = document.querySelector('button[name="vcr_next"]');
-                        if (!btn) {
-                            return { found: false, reason: 'button not found' };
-                        }
-
-                        // ตรวจสอบว่า disabled หรือไม่
-                        if (btn.disabled) {
-                            return { found: true, disabled: true };
-                        }
-
-                        // Click ด้วย JavaScript
-                        btn.click();
-                        return { found: true, disabled: false, clicked: true };
+                        const first = document.querySelector('a.linked.formlink');
+                        return first ? first.innerText.trim() : '';
                     }
-                """)
+                """), "List first row")
+
+                for attempt in range(1, CALL_ATTEMPTS + 1):
+                    try:
+                        # ลอง click ด้วย JavaScript โดยตรง (หลีกเลี่ยงปัญหา element ถูกบัง)
+                        result = (page.frame(name="gsft_main") or page).evaluate("""
+                            () => {
+                                // หาปุ่ม Next โดยใช้ name attribute
+                                const btn = document.querySelector('button[name="vcr_next"]');
+                                if (!btn) {
+                                    return { found: false, reason: 'button not found' };
+                                }
+
+                                // ตรวจสอบว่า disabled หรือไม่
+                                if (btn.disabled) {
+                                    return { found: true, disabled: true };
+                                }
+
+                                // Click ด้วย JavaScript
+                                btn.click();
+                                return { found: true, disabled: false, clicked: true };
+                            }
+                        """)
+                        break
+                    except Exception as e:
+                        if list_page_changed(page, previous):
+                            # คลิกไปแล้ว หน้าถัดไปโหลดมาแล้ว
+                            result = {"found": True, "disabled": False, "clicked": True}
+                            break
+                        if attempt == CALL_ATTEMPTS:
+                            raise
+                        print(f"[WARN] vcr_next failed ({e}) and the list did not change - "
+                              f"clicking again ({attempt}/{CALL_ATTEMPTS - 1})")
 
                 print(f"Next Page button check: {result}")
 
@@ -557,7 +601,7 @@ def main():
                     page.wait_for_timeout(3000)
 
                     # รอให้ตารางมา
-                    frame.wait_for_selector("table.list_table, table[role='table'], div[role='grid']", timeout=60_000)
+                    frame = retry_call(lambda: wait_list_table(page), "List table after vcr_next")
                     page.wait_for_timeout(1000)
 
                     page_number += 1
@@ -573,5 +617,10 @@ def main():
         print(f"\n===== Completed! Processed {page_number} page(s) =====")
         browser.close()
 
+    selectors.save()
+    print("\n===== UI selectors (learned order) =====")
+    for line in selectors.summary():
+        print(line)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
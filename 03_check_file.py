@@ -17,6 +17,16 @@ from datetime import datetime
 OUTPUT_DIR = Path("output")
 REPORT_FILE = Path("file_check_report.csv")
 
+# ไฟล์ที่ยังดาวน์โหลดไม่เสร็จ (02_export_changes.py เขียนลง .part แล้วค่อย rename)
+PARTIAL_SUFFIXES = (".part", ".part.json")
+
+
+def finished_files(folder: Path) -> list:
+    """ไฟล์ในโฟลเดอร์ที่ดาวน์โหลดเสร็จแล้ว (ไม่นับ .part)"""
+    if not folder.exists():
+        return []
+    return [f for f in folder.iterdir() if f.is_file() and not f.name.endswith(PARTIAL_SUFFIXES)]
+
 
 def check_change_folder(change_folder: Path) -> dict:
     """
@@ -44,36 +54,33 @@ def check_change_folder(change_folder: Path) -> dict:
         result['notes'].append(f"PDF: {pdf_files[0].name}")
 
     # ตรวจสอบ Attachments
-    attachment_folder = change_folder / "Attachment"
-    if attachment_folder.exists():
-        attachment_files = list(attachment_folder.glob("*"))
-        if attachment_files:
-            result['attachments'] = 'Yes'
-            result['notes'].append(f"Attachments: {len(attachment_files)} file(s)")
+    attachment_files = finished_files(change_folder / "Attachment")
+    if attachment_files:
+        result['attachments'] = 'Yes'
+        result['notes'].append(f"Attachments: {len(attachment_files)} file(s)")
 
     # ตรวจสอบ UAT Signoff
-    uat_folder = change_folder / "UAT Signoff"
-    if uat_folder.exists():
-        uat_files = list(uat_folder.glob("*"))
-        if uat_files:
-            result['uat_signoff'] = 'Yes'
-            result['notes'].append(f"UAT: {len(uat_files)} file(s)")
+    uat_files = finished_files(change_folder / "UAT Signoff")
+    if uat_files:
+        result['uat_signoff'] = 'Yes'
+        result['notes'].append(f"UAT: {len(uat_files)} file(s)")
 
     # ตรวจสอบ AppScan
-    appscan_folder = change_folder / "AppScan"
-    if appscan_folder.exists():
-        appscan_files = list(appscan_folder.glob("*"))
-        if appscan_files:
-            result['appscan'] = 'Yes'
-            result['notes'].append(f"AppScan: {len(appscan_files)} file(s)")
+    appscan_files = finished_files(change_folder / "AppScan")
+    if appscan_files:
+        result['appscan'] = 'Yes'
+        result['notes'].append(f"AppScan: {len(appscan_files)} file(s)")
 
     # ตรวจสอบ CRFile
-    crfile_folder = change_folder / "CRFile"
-    if crfile_folder.exists():
-        crfile_files = list(crfile_folder.glob("*"))
-        if crfile_files:
-            result['crfile'] = 'Yes'
-            result['notes'].append(f"CRFile: {len(crfile_files)} file(s)")
+    crfile_files = finished_files(change_folder / "CRFile")
+    if crfile_files:
+        result['crfile'] = 'Yes'
+        result['notes'].append(f"CRFile: {len(crfile_files)} file(s)")
+
+    # ไฟล์ที่ค้างอยู่ระหว่างดาวน์โหลด (run ถูกหยุดกลางคัน) ไม่นับเป็น Yes แต่แจ้งไว้
+    partial = list(change_folder.rglob("*.part"))
+    if partial:
+        result['notes'].append(f"Incomplete: {len(partial)} .part file(s)")
 
     # รวม notes
     result['notes'] = '; '.join(result['notes']) if result['notes'] else '-'
@@ -0,0 +1,219 @@
+"""
+On-disk cache ของ static asset (js / css / font / รูป) ของ ServiceNow UI ข้าม run และข้าม context
+
+ทุก run และทุก context โหลด bundle เดิม (js_includes_*.jsx, css_includes_*.cssx, /uxasset/...) ซ้ำ
+cache นี้เป็น route handler บน BrowserContext:
+  - URL ที่มี version (?v=..., /uxasset/externals/...) ถือว่า immutable -> ตอบจาก disk ทันที
+  - URL อื่น -> revalidate ทุกครั้ง (If-None-Match จาก ETag / If-Modified-Since จาก Last-Modified) ถ้าได้ 304 ตอบจาก disk
+    (ไม่มี validator ทั้งสองอย่างและ URL ไม่มี version -> ไม่เก็บ เพราะ revalidate ไม่ได้หลัง upgrade instance)
+  - miss -> route.fetch() แล้วเก็บลง disk (ไม่เก็บ response ที่มี Set-Cookie / no-store)
+จำกัดขนาดรวมด้วย LRU (ใช้ mtime ของไฟล์เป็นเวลาที่ใช้ล่าสุด)
+
+ต้อง install ก่อน net_filter เพื่อให้ filter ตัดสินใจก่อนแล้ว fallback มาที่ cache
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+ASSET_CACHE_DIR = Path("asset_cache")
+DEFAULT_MAX_MB = 256
+MAX_ENTRY_BYTES = 20 * 1024 * 1024
+
+# request ที่ส่งเข้า handler (ที่เหลือไม่ผ่าน Python เลย)
+ASSET_URL = re.compile(r"\.(jsx?|cssx?|woff2?|ttf|eot|png|gif|svg|ico)(\?|$)|/uxasset/|/scripts/|/styles/",
+                       re.IGNORECASE)
+# URL ที่ version อยู่ใน URL แล้ว - เนื้อหาไม่เปลี่ยน
+IMMUTABLE_URL = re.compile(r"[?&](v|sysparm_substitute|ver|version)=|/uxasset/externals/", re.IGNORECASE)
+CACHEABLE_TYPES = {"script", "stylesheet", "font", "image"}
+KEEP_HEADERS = ("content-type", "etag", "last-modified", "cache-control")
+
+
+class AssetCache:
+    """URL/ETag keyed, size-bounded LRU cache shared by every context of a run"""
+
+    def __init__(self, directory: Path = ASSET_CACHE_DIR, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> size
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evicted = 0
+        self.bytes_served = 0
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for body in self.directory.glob("*.body"):
+                if body.with_suffix(".json").exists():
+                    self._entries[body.stem] = body.stat().st_size
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # ---------- storage ----------
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str):
+        return self.directory / f"{key}.body", self.directory / f"{key}.json"
+
+    def lookup(self, url: str):
+        """(meta, body) of a cached URL, or None"""
+        key = self.key(url)
+        with self._lock:
+            if key not in self._entries:
+                return None
+        body_path, meta_path = self._paths(key)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            body = body_path.read_bytes()
+            os.utime(body_path)  # LRU: ใช้ล่าสุด
+        except (OSError, ValueError):
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        if meta.get("url") != url:
+            return None
+        return meta, body
+
+    @staticmethod
+    def conditional_headers(headers: dict) -> dict:
+        """If-None-Match / If-Modified-Since from a cached response's validators ({} if it has none)"""
+        conditional = {}
+        if headers.get("etag"):
+            conditional["if-none-match"] = headers["etag"]
+        if headers.get("last-modified"):
+            conditional["if-modified-since"] = headers["last-modified"]
+        return conditional
+
+    def store(self, url: str, status: int, headers: dict, body: bytes):
+        if status != 200 or len(body) > MAX_ENTRY_BYTES or "set-cookie" in headers:
+            return
+        if not IMMUTABLE_URL.search(url) and not self.conditional_headers(headers):
+            return
+        if "no-store" in headers.get("cache-control", "") or "private" in headers.get("cache-control", ""):
+            return
+        key = self.key(url)
+        body_path, meta_path = self._paths(key)
+        meta = {"url": url, "stored": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "headers": {k: headers[k] for k in KEEP_HEADERS if k in headers}}
+        tmp = body_path.with_suffix(f".tmp{threading.get_ident()}")
+        tmp.write_bytes(body)
+        os.replace(tmp, body_path)
+        meta_path.write_text(json.dumps(meta), encoding="utf-8")
+        with self._lock:
+            self._entries[key] = len(body)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            total = sum(self._entries.values())
+            if total <= self.max_bytes:
+                return
+            keys = list(self._entries)
+        # เก่าสุด (mtime น้อยสุด) ออกก่อน
+        by_age = sorted(keys, key=lambda k: self._mtime(k))
+        for key in by_age:
+            if total <= self.max_bytes:
+                break
+            with self._lock:
+                size = self._entries.pop(key, 0)
+                self.evicted += 1
+            for path in self._paths(key):
+                path.unlink(missing_ok=True)
+            total -= size
+
+    def _mtime(self, key: str) -> float:
+        try:
+            return self._paths(key)[0].stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def _served(self, counter: str, size: int):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.bytes_served += size
+
+    def _cacheable(self, request) -> bool:
+        return request.method == "GET" and request.resource_type in CACHEABLE_TYPES
+
+    # ---------- route handlers ----------
+    def handle(self, route):
+        """Sync route handler"""
+        request = route.request
+        if not self._cacheable(request):
+            route.fallback()
+            return
+        url = request.url
+        cached = self.lookup(url)
+        conditional = self.conditional_headers(cached[0]["headers"]) if cached is not None else {}
+        if cached is not None and IMMUTABLE_URL.search(url):
+            meta, body = cached
+            self._served("hits", len(body))
+            route.fulfill(status=200, headers=meta["headers"], body=body)
+            return
+        if conditional:
+            meta, body = cached
+            response = route.fetch(headers={**request.headers, **conditional})
+            if response.status == 304:
+                self._served("revalidated", len(body))
+                route.fulfill(status=200, headers=meta["headers"], body=body)
+                return
+        else:
+            response = route.fetch()
+        with self._lock:
+            self.misses += 1
+        body = response.body()
+        self.store(url, response.status, response.headers, body)
+        route.fulfill(response=response, body=body)
+
+    async def handle_async(self, route):
+        """async_playwright route handler (same logic as handle)"""
+        request = route.request
+        if not self._cacheable(request):
+            await route.fallback()
+            return
+        url = request.url
+        cached = self.lookup(url)
+        conditional = self.conditional_headers(cached[0]["headers"]) if cached is not None else {}
+        if cached is not None and IMMUTABLE_URL.search(url):
+            meta, body = cached
+            self._served("hits", len(body))
+            await route.fulfill(status=200, headers=meta["headers"], body=body)
+            return
+        if conditional:
+            meta, body = cached
+            response = await route.fetch(headers={**request.headers, **conditional})
+            if response.status == 304:
+                self._served("revalidated", len(body))
+                await route.fulfill(status=200, headers=meta["headers"], body=body)
+                return
+        else:
+            response = await route.fetch()
+        with self._lock:
+            self.misses += 1
+        body = await response.body()
+        self.store(url, response.status, response.headers, body)
+        await route.fulfill(response=response, body=body)
+
+    def install(self, context):
+        if self.enabled:
+            context.route(ASSET_URL, self.handle)
+
+    async def install_async(self, context):
+        if self.enabled:
+            await context.route(ASSET_URL, self.handle_async)
+
+    def summary(self) -> list:
+        with self._lock:
+            entries, size = len(self._entries), sum(self._entries.values())
+        return [f"  hits {self.hits}, revalidated (304) {self.revalidated}, misses {self.misses}, "
+                f"evicted {self.evicted}",
+                f"  {self.bytes_served:,} bytes served from {self.directory} "
+                f"({entries} entries, {size:,} / {self.max_bytes:,} bytes)"]
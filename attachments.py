@@ -0,0 +1,125 @@
+"""
+Attachment helpers shared by the export scripts
+"""
+import os
+import re
+import shutil
+import zipfile
+from pathlib import Path
+
+from download_engine import part_path
+
+
+def safe_name(s: str) -> str:
+    s = s.strip()
+    s = re.sub(r'[\\/:*?"<>|]+', "_", s)
+    return s[:150]
+
+
+def classify_attachment(filename: str) -> str:
+    """Pick the output subfolder for a Supporting Documents file from its name"""
+    filename_upper = filename.upper()
+    filename_lower = filename.lower()
+
+    if 'UAT' in filename_upper or 'SIGNOFF' in filename_upper:
+        return 'UAT Signoff'
+    elif 'APP SCAN' in filename_upper or 'APPSCAN' in filename_upper or 'app scan' in filename_lower:
+        return 'AppScan'
+    elif filename.startswith('RE') or 'SDR' in filename_upper or 'FORM' in filename_upper:
+        return 'CRFile'
+    else:
+        return 'Supporting Documents'
+
+
+# ---------- ไฟล์แนบชุดเดียวต่อ record ----------
+# ทุก attachment ถูกโอนครั้งเดียวเข้า <CHG>/Attachment/ (มุม "all attachments")
+# โฟลเดอร์ UAT Signoff / AppScan / CRFile / Supporting Documents สร้างจากไฟล์ชุดนั้นด้วย hardlink (หรือ copy)
+ATTACHMENT_DIR = "Attachment"
+ALL_ATTACHMENTS_ZIP = "attachments_all.zip"  # ไฟล์จากปุ่ม Download All (--attachments ui)
+
+
+def duplicate_name(name: str, tag) -> str:
+    """name with a tag telling same-named attachments apart, e.g. report (1a2b3c4d).pdf"""
+    stem, suffix = os.path.splitext(name)
+    return f"{stem} ({tag}){suffix}"
+
+
+def assign_names(attachments) -> list:
+    """Give each attachment a file name ("name") unique within the record.
+
+    ServiceNow allows several attachments with the same name on one record, and different names can map to
+    the same safe_name - those would be written to the same .part in parallel. Every attachment of such a
+    group gets its sys_id prefix (or a counter without sys_id): "report (1a2b3c4d).pdf".
+    """
+    groups = {}
+    for attachment in attachments:
+        groups.setdefault(safe_name(attachment["filename"]).lower(), []).append(attachment)
+    for group in groups.values():
+        for index, attachment in enumerate(group, 1):
+            name = safe_name(attachment["filename"])
+            if len(group) > 1:
+                name = duplicate_name(name, (attachment.get("sys_id") or "")[:8] or index)
+            attachment["name"] = name
+    return attachments
+
+
+def store_path(folder: Path, name: str) -> Path:
+    """Path of an attachment in the record's shared Attachment/ folder (name: assign_names' "name")"""
+    return folder / ATTACHMENT_DIR / safe_name(name)
+
+
+def category_path(folder: Path, filename: str, name: str = None) -> Path:
+    """Category folder from the original file name; the file itself is called name (default safe_name(filename))"""
+    return folder / classify_attachment(filename) / safe_name(name or filename)
+
+
+def link_or_copy(src: Path, dst: Path) -> Path:
+    """Hardlink src to dst (copy when the filesystem does not support links). Returns dst."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        if dst.samefile(src):
+            return dst
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        part = part_path(dst)
+        shutil.copyfile(src, part)
+        os.replace(part, dst)
+    return dst
+
+
+def extract_zip(zip_path: Path, dest: Path, attachments=()) -> list:
+    """Stream every member of zip_path into dest (flat, safe names). Returns the extracted paths.
+
+    attachments: the form's attachments with assign_names' "name" - a zip member is written under the name
+    of the attachment it belongs to, so same-named attachments get the same files as a direct download.
+    """
+    dest.mkdir(parents=True, exist_ok=True)
+    expected = {}
+    for attachment in attachments:
+        expected.setdefault(safe_name(attachment["filename"]).lower(), []).append(attachment)
+    extracted = []
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            name = safe_name(Path(info.filename).name)
+            candidates = expected.get(name.lower())
+            if candidates:
+                # ชื่อซ้ำใน record: zip ไม่มี sys_id - จับคู่ด้วยขนาดที่ form แสดง (ใกล้สุด) แล้วตามลำดับ
+                match = min(candidates, key=lambda a: abs((a.get("size") or info.file_size) - info.file_size))
+                candidates.remove(match)
+                name = match["name"]
+            target = dest / name
+            count = 1
+            while target in extracted:
+                # ชื่อซ้ำใน zip ที่ form ไม่ได้บอก - ไม่เขียนทับไฟล์ก่อนหน้า
+                count += 1
+                target = dest / duplicate_name(name, count)
+            part = part_path(target)
+            with zf.open(info) as src, open(part, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(part, target)
+            extracted.append(target)
+    return extracted
@@ -0,0 +1,161 @@
+"""
+ตรวจ session หมดอายุระหว่าง export และ login ใหม่โดยไม่ต้องเริ่ม run ใหม่
+
+SSO session ใน state.json หมดอายุกลาง run ยาว ๆ - หลังจากนั้นทุก record จะได้หน้า login / SAML แทน form
+สัญญาณที่ใช้:
+  - URL ของหน้าเป็นหน้า login / SAML / IdP (LOGIN_URL)
+  - หน้ามี form login ของ ServiceNow (LOGIN_FORM_SELECTOR)
+  - HttpDownloader ได้ 401 หรือถูก redirect ไปหน้า login (downloader.expired)
+
+เมื่อเจอ worker ที่เจอก่อนเป็นคน refresh state (worker อื่นหยุดรอที่ wait_ready ก่อนเริ่ม record ถัดไป):
+  - login: เปิด 01_login_save_state.py ให้ทำ SSO + MFA ใหม่ (ต้องมีหน้าจอ)
+  - wait:  รอจนไฟล์ state ถูกเขียนใหม่ (เช่นรัน 01_login_save_state.py จากอีก terminal แล้ว copy มา)
+  - off:   ไม่ login ใหม่ - หยุด run (record ที่เหลือยัง pending ใน manifest)
+worker ที่เจอทีหลังแต่ state ถูก refresh ไปแล้ว (mtime ใหม่กว่าตอนเปิด context) แค่โหลด state ใหม่
+"""
+import re
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import snow_api
+
+LOGIN_SCRIPT = Path(__file__).with_name("01_login_save_state.py")
+REAUTH_MODES = ("login", "wait", "off")
+REAUTH_TIMEOUT_S = 15 * 60  # เวลาให้ทำ MFA / รอไฟล์ state ใหม่
+WAIT_POLL_S = 5
+MAX_REAUTH_PER_RECORD = 2
+
+LOGIN_URL = re.compile(r"/login\.do|/login_with_sso|/saml|/sso[/?]|/external_logout|/adfs/|"
+                       r"login\.microsoftonline\.com|\.okta\.com|/auth/realms/", re.IGNORECASE)
+LOGIN_FORM_SELECTOR = "form#loginPage, form[action*='login.do'], input#user_password, form#login"
+
+
+class SessionExpired(Exception):
+    """The saved login session no longer authenticates (login page, SAML redirect or HTTP 401)"""
+
+
+def is_login_url(url: str) -> bool:
+    return bool(LOGIN_URL.search(url or ""))
+
+
+def state_mtime(path) -> float:
+    try:
+        return Path(path).stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+def page_expired(page) -> bool:
+    """True if page shows a login / SSO page instead of ServiceNow content"""
+    if is_login_url(page.url):
+        return True
+    try:
+        return page.locator(LOGIN_FORM_SELECTOR).count() > 0
+    except Exception:
+        return False  # หน้ากำลังเปลี่ยน - ให้ wait ตามปกติตัดสิน
+
+
+async def page_expired_async(page) -> bool:
+    if is_login_url(page.url):
+        return True
+    try:
+        return await page.locator(LOGIN_FORM_SELECTOR).count() > 0
+    except Exception:
+        return False
+
+
+def session_expired(page, downloader=None) -> bool:
+    return (downloader is not None and downloader.expired) or page_expired(page)
+
+
+def check_page(page):
+    """Raise SessionExpired if page landed on the login / SSO page"""
+    if page_expired(page):
+        raise SessionExpired(f"redirected to login page ({page.url})")
+
+
+def preflight(page, base: str) -> bool:
+    """Cheap validity check of the context's saved state: load a one-row list and look for g_ck"""
+    try:
+        token = snow_api.fetch_user_token(page, base)
+    except Exception as e:
+        print(f"[WARN] Pre-flight request failed: {e}")
+        return False
+    return bool(token) and not page_expired(page)
+
+
+class Reauthenticator:
+    """Refreshes expired session states one at a time and holds the other workers until it is done"""
+
+    def __init__(self, mode: str = "login", timeout_s: float = REAUTH_TIMEOUT_S):
+        self.mode = mode
+        self.timeout_s = timeout_s
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._refreshing = 0
+        self.refreshes = 0
+        self.reloads = 0
+        self.failures = 0
+
+    def wait_ready(self):
+        """Block while a re-login is in progress (called before each record)"""
+        with self._cond:
+            while self._refreshing:
+                self._cond.wait()
+
+    def refresh(self, name: str, state, loaded_mtime: float, label: str = "") -> bool:
+        """Make state valid again. loaded_mtime is the state file's mtime when the caller's context was
+        created - a newer file means another worker already refreshed it. Returns False if re-login failed."""
+        with self._cond:
+            self._refreshing += 1
+        try:
+            with self._lock:
+                if state_mtime(state) > loaded_mtime:
+                    print(f"[INFO] {label}Session {name}: reloading refreshed state {state}")
+                    self.reloads += 1
+                    return True
+                if self.mode == "off":
+                    self.failures += 1
+                    print(f"[ERROR] {label}Session {name} expired (--reauth off)")
+                    return False
+                print(f"[WARN] {label}Session {name} expired - pausing workers to re-authenticate ({self.mode})")
+                ok = self._login(name, state) if self.mode == "login" else self._wait_for(state, loaded_mtime)
+                if ok and state_mtime(state) > loaded_mtime:
+                    self.refreshes += 1
+                    print(f"[INFO] Session {name} refreshed - resuming")
+                    return True
+                self.failures += 1
+                print(f"[ERROR] Session {name} could not be re-authenticated")
+                return False
+        finally:
+            with self._cond:
+                self._refreshing -= 1
+                self._cond.notify_all()
+
+    def _login(self, name: str, state) -> bool:
+        print(f"[Action Required] Log in again for session '{name}' in the browser window that opens")
+        try:
+            result = subprocess.run([sys.executable, str(LOGIN_SCRIPT), "--state", str(state)],
+                                    timeout=self.timeout_s)
+            return result.returncode == 0
+        except Exception as e:
+            print(f"[WARN] {LOGIN_SCRIPT.name} failed: {e}")
+            return False
+
+    def _wait_for(self, state, loaded_mtime: float) -> bool:
+        print(f"[Action Required] Refresh {state} (e.g. python3 {LOGIN_SCRIPT.name} --state {state}) - "
+              f"waiting up to {self.timeout_s / 60:.0f} min")
+        deadline = time.monotonic() + self.timeout_s
+        while time.monotonic() < deadline:
+            if state_mtime(state) > loaded_mtime:
+                time.sleep(1)  # ให้เขียนไฟล์เสร็จก่อน
+                return True
+            time.sleep(WAIT_POLL_S)
+        return False
+
+    def summary(self) -> list:
+        return [f"  mode {self.mode}: {self.refreshes} re-login(s), {self.reloads} reload(s), "
+                f"{self.failures} failure(s)"]
@@ -0,0 +1,114 @@
+"""
+Benchmark 02_export_changes.py กับ mock_servicenow.py (ไม่ต้องใช้ instance จริง / SSO)
+
+เปิด mock server ใน process นี้ รัน exporter ใน working directory ชั่วคราว
+(manifest.db, metrics/, output/ แยกจากของจริง) แล้วรายงาน records/min และ bytes/s
+
+การใช้งาน:
+    python bench_export.py --records 100 --latency-ms 50
+    python bench_export.py --records 200 -- --workers 4 --headless
+    python bench_export.py --json bench_results.jsonl -- --engine async --workers 2
+
+argument หลัง -- ส่งต่อให้ 02_export_changes.py (ค่าเริ่มต้น: --headless)
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from manifest import MANIFEST_DB, Manifest
+from mock_servicenow import MockConfig, MockServiceNow
+
+EXPORTER = Path(__file__).resolve().parent / "02_export_changes.py"
+
+
+def run_benchmark(config: MockConfig, exporter_args: list, workdir: Path, latency_ms: int = 0) -> dict:
+    """Run the exporter once against a fresh mock instance. Returns the result row."""
+    server = MockServiceNow(config).start()
+    try:
+        state = workdir / "state.json"
+        state.write_text(json.dumps(server.storage_state()), encoding="utf-8")
+        env = dict(os.environ, SNOW_BASE=server.base, SNOW_STATE=str(state), SNOW_OUT=str(workdir / "output"))
+
+        command = [sys.executable, str(EXPORTER), *exporter_args]
+        print(f"[BENCH] {' '.join(command)}  (mock: {server.base}, {config.records} changes)")
+        started = time.perf_counter()
+        completed = subprocess.run(command, cwd=workdir, env=env)
+        elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+
+    manifest = Manifest(workdir / MANIFEST_DB)
+    try:
+        records = len(manifest.completed_numbers())
+        total_bytes = manifest.total_bytes()
+    finally:
+        manifest.close()
+
+    return {
+        "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "args": exporter_args,
+        "records": records,
+        "expected": config.records,
+        "elapsed_s": round(elapsed, 2),
+        "records_per_min": round(records / (elapsed / 60), 2) if elapsed else 0,
+        "bytes": total_bytes,
+        "bytes_per_s": round(total_bytes / elapsed) if elapsed else 0,
+        "exit_code": completed.returncode,
+        "latency_ms": latency_ms,
+        "server": {kind: {"requests": count, "bytes": size} for kind, (count, size) in server.stats.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark 02_export_changes.py against mock_servicenow.py",
+                                     epilog="arguments after -- are passed to 02_export_changes.py")
+    parser.add_argument("--records", type=int, default=50, help="number of mock change requests (default: 50)")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--attachments", type=int, default=3, help="attachments per change (default: 3)")
+    parser.add_argument("--latency-ms", type=int, default=0, help="server latency per page / API call")
+    parser.add_argument("--pdf-ms", type=int, default=0, help="PDF generation time")
+    parser.add_argument("--pdf-kb", type=int, default=200)
+    parser.add_argument("--attachment-kb", type=int, default=500)
+    parser.add_argument("--asset-kb", type=int, default=300)
+    parser.add_argument("--json", type=Path, metavar="PATH", help="append the result as one JSON line (for CI)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    args, exporter_args = parser.parse_known_args()
+    if exporter_args and exporter_args[0] == "--":
+        exporter_args = exporter_args[1:]
+    exporter_args = exporter_args or ["--headless"]
+
+    config = MockConfig(args.records, args.page_size, args.attachments, args.latency_ms, args.pdf_ms,
+                        args.pdf_kb, args.attachment_kb, args.asset_kb)
+    workdir = Path(tempfile.mkdtemp(prefix="snow-bench-"))
+    try:
+        result = run_benchmark(config, exporter_args, workdir, args.latency_ms)
+    finally:
+        if args.keep:
+            print(f"[BENCH] Working directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\n===== Benchmark =====")
+    print(f"  records      {result['records']}/{result['expected']} in {result['elapsed_s']}s")
+    print(f"  throughput   {result['records_per_min']} records/min, {result['bytes_per_s']:,} bytes/s")
+    print(f"  exit code    {result['exit_code']}")
+    print("  server requests:")
+    for kind, row in sorted(result["server"].items()):
+        print(f"    {kind:<22} {row['requests']:>7} req  {row['bytes']:>15,} bytes")
+
+    if args.json:
+        with open(args.json, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+
+    # CI: fail ถ้า exporter error หรือ export ไม่ครบ
+    sys.exit(0 if result["exit_code"] == 0 and result["records"] == result["expected"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+ปรับจำนวน record ที่ทำพร้อมกันตาม latency / error ของ instance แบบ AIMD (additive increase, multiplicative decrease)
+
+จำนวน worker แบบ fix เดาไม่ถูก: น้อยไปเสียเวลา มากไป PRD ช้าสำหรับ user คนอื่น (กลางวันใช้ instance ร่วมกับ business)
+controller ดู latency ของสัญญาณที่ server ต้องทำงานหนัก แล้วปรับ limit ของ record ที่อยู่ระหว่างทำ:
+  - form: wait.form_ready (GlideForm พร้อม)   - pdf: stage pdf (server render PDF)
+ทุก WINDOW ตัวอย่าง (นับตั้งแต่ปรับครั้งก่อน):
+  - p90 ของสัญญาณไหนเกิน target หรือ error rate >= ERROR_THRESHOLD -> limit x DECREASE (ไม่ต่ำกว่า min)
+  - ทุกสัญญาณต่ำกว่า target และช่วงนั้นใช้ slot เต็ม limit -> limit + 1 (ไม่เกิน --workers)
+worker / page ที่เกิน limit รออยู่ที่ slot() ก่อนเริ่ม record ถัดไป
+ทุกครั้งที่ limit เปลี่ยนเขียน event "concurrency" ลง metrics/run-*.jsonl
+"""
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import percentile
+
+DEFAULT_TARGETS_MS = {"form": 5_000, "pdf": 15_000}
+SIGNALS = {"wait.form_ready": "form", "pdf": "pdf"}  # metrics stage -> สัญญาณ
+WINDOW = 10
+ERROR_THRESHOLD = 0.2
+INCREASE = 1
+DECREASE = 0.5
+POLL_S = 0.2  # async slot: ความถี่ที่เช็ค limit ใหม่
+
+
+class AimdController:
+    """Adaptive limit on records in flight, fed by metrics.observe through Metrics.listeners"""
+
+    def __init__(self, max_limit: int, start: int = 1, min_limit: int = 1, targets_ms: dict = None,
+                 window: int = WINDOW, metrics=None):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = max(self.min_limit, min(start, self.max_limit))
+        self.targets_ms = dict(DEFAULT_TARGETS_MS, **(targets_ms or {}))
+        self.window = window
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._samples = {signal: [] for signal in self.targets_ms}  # signal -> [(ms, ok)] ตั้งแต่ปรับครั้งก่อน
+        self.active = 0
+        self._peak = 0  # active สูงสุดตั้งแต่ปรับครั้งก่อน
+        self.history = []  # [(seconds since start, old, new, reason)]
+        self.started = time.monotonic()
+
+    # ---------- slots ----------
+    def acquire(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self._take()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def _take(self):
+        self.active += 1
+        self._peak = max(self._peak, self.active)
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the limit slots for a record (blocks while the limit is reached)"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """slot() for the asyncio engine - polls instead of blocking the event loop"""
+        while True:
+            with self._cond:
+                if self.active < self.limit:
+                    self._take()
+                    break
+            await asyncio.sleep(POLL_S)
+        try:
+            yield
+        finally:
+            self.release()
+
+    # ---------- control loop ----------
+    def observe(self, stage: str, ms: float, ok: bool = True):
+        """Metrics listener: feed a stage sample, adjust the limit once a window of samples is in"""
+        signal = SIGNALS.get(stage)
+        if signal is None:
+            return
+        with self._cond:
+            self._samples[signal].append((ms, ok))
+            if sum(len(samples) for samples in self._samples.values()) >= self.window:
+                self._adjust()
+
+    def _adjust(self):
+        # เรียกขณะถือ _cond
+        over, stats = [], []
+        errors = total = 0
+        for signal, samples in self._samples.items():
+            if not samples:
+                continue
+            p90 = percentile(sorted(ms for ms, _ in samples), 0.9)
+            stats.append(f"{signal} p90 {p90:.0f}ms")
+            if p90 > self.targets_ms[signal]:
+                over.append(f"{signal} p90 {p90:.0f}ms > {self.targets_ms[signal]}ms")
+            errors += sum(not ok for _, ok in samples)
+            total += len(samples)
+        error_rate = errors / total if total else 0.0
+
+        old = self.limit
+        if error_rate >= ERROR_THRESHOLD:
+            self.limit = max(self.min_limit, int(self.limit * DECREASE))
+            reason = f"error rate {error_rate:.0%}"
+        elif over:
+            self.limit = max(self.min_limit, int(self.limit * DECREASE))
+            reason = ", ".join(over)
+        elif self._peak >= self.limit:
+            self.limit = min(self.max_limit, self.limit + INCREASE)
+            reason = ", ".join(stats) + " under target"
+        else:
+            reason = ""  # ไม่ได้ใช้ slot เต็ม - latency ต่ำไม่ได้บอกว่ารับเพิ่มได้
+
+        for samples in self._samples.values():
+            samples.clear()
+        self._peak = self.active
+        if self.limit == old:
+            return
+        self.history.append((time.monotonic() - self.started, old, self.limit, reason))
+        print(f"[INFO] Concurrency {old} -> {self.limit}: {reason}")
+        if self.metrics is not None:
+            self.metrics.event("concurrency", limit=self.limit, previous=old, reason=reason,
+                               error_rate=round(error_rate, 3))
+        self._cond.notify_all()
+
+    def summary(self) -> list:
+        lines = [f"  limit {self.limit} (range {self.min_limit}-{self.max_limit}), "
+                 f"{len(self.history)} change(s), targets "
+                 + ", ".join(f"{signal} {ms}ms" for signal, ms in self.targets_ms.items())]
+        for elapsed, old, new, reason in self.history[-10:]:
+            lines.append(f"  {elapsed:>7.0f}s  {old} -> {new}  {reason}")
+        return lines
@@ -0,0 +1,86 @@
+"""
+อ่านข้อมูลจาก DOM ด้วย evaluate ครั้งเดียวต่อหน้า แทน locator / inner_text ทีละ element
+
+  - list_rows(frame): ทุกแถวในหน้า list -> [{number, sys_id, href}]
+  - form_snapshot(frame): record ที่เปิดอยู่ -> sys_id, number, attachment ทั้งหมด (sys_id, href, ชื่อ, ขนาด),
+    มีแท็บ Supporting Documents / ปุ่ม Manage Attachments หรือไม่
+
+stage ดาวน์โหลดทำงานจากข้อมูลนี้ ไม่ต้องถาม browser ซ้ำทีละ row / ทีละไฟล์
+"""
+from attachments import assign_names
+
+LIST_ROW_SELECTOR = "table.list_table tbody tr, table[role='table'] tbody tr, div[role='row']"
+
+LIST_ROWS_JS = """
+    (rowSelector) => Array.from(document.querySelectorAll(rowSelector))
+        .map(row => row.querySelector('a.linked.formlink'))
+        .filter(a => a)
+        .map(a => {
+            const m = (a.getAttribute('href') || '').match(/sys_id=([0-9a-f]{32})/);
+            return { number: a.innerText.trim(), sys_id: m ? m[1] : null, href: a.href };
+        })
+"""
+
+FORM_SNAPSHOT_JS = """
+    () => {
+        const units = { bytes: 1, b: 1, kb: 1024, mb: 1048576, gb: 1073741824 };
+        const seen = new Set();
+        const attachments = [];
+        for (const a of document.querySelectorAll('a.attachment[href*="sys_attachment.do"]')) {
+            if (seen.has(a.href)) continue;
+            seen.add(a.href);
+            const id = (a.getAttribute('href') || '').match(/sys_id=([0-9a-f]{32})/);
+            // ขนาดไฟล์แสดงข้าง link เช่น "(1.2 MB)" (ถ้ามี)
+            const holder = a.closest('li, tr') || a.parentElement;
+            const size = ((holder && holder.innerText) || '').match(/\\(([\\d.,]+)\\s*(bytes|B|KB|MB|GB)\\)/i);
+            attachments.push({
+                sys_id: id ? id[1] : null,
+                href: a.href,
+                filename: (a.innerText || '').trim(),
+                size: size ? Math.round(parseFloat(size[1].replace(/,/g, '')) * units[size[2].toLowerCase()]) : null,
+            });
+        }
+        const form = window.g_form;
+        return {
+            sys_id: (form && form.getUniqueValue()) || null,
+            number: (form && form.getValue && form.getValue('number')) || null,
+            attachments: attachments,
+            supporting_docs_tab: Array.from(document.querySelectorAll('span.tab_caption_text'))
+                .some(s => s.innerText.includes('Supporting Documents')),
+            paperclip: !!document.querySelector(
+                'button#header_add_attachment, button.icon-paperclip[aria-label="Manage Attachments"]'),
+        };
+    }
+"""
+
+EMPTY_SNAPSHOT = {"sys_id": None, "number": None, "attachments": [], "supporting_docs_tab": False,
+                  "paperclip": False}
+
+
+def list_rows(frame) -> list:
+    """[{number, sys_id, href}] of every row on the current list page"""
+    return frame.evaluate(LIST_ROWS_JS, LIST_ROW_SELECTOR)
+
+
+def form_snapshot(frame) -> dict:
+    """Everything the export stages need from an opened form (EMPTY_SNAPSHOT if the page can't be read)"""
+    try:
+        return frame.evaluate(FORM_SNAPSHOT_JS)
+    except Exception as e:
+        print(f"[WARN] Could not read form: {e}")
+        return dict(EMPTY_SNAPSHOT)
+
+
+async def form_snapshot_async(page) -> dict:
+    try:
+        return await page.evaluate(FORM_SNAPSHOT_JS)
+    except Exception as e:
+        print(f"[WARN] Could not read form: {e}")
+        return dict(EMPTY_SNAPSHOT)
+
+
+def downloadable(attachments) -> list:
+    """Attachments with a file name, largest first (long transfers start first in the pool),
+    each with a unique target file name in "name" (attachments.assign_names)"""
+    files = assign_names([a for a in attachments if a["filename"]])
+    return sorted(files, key=lambda a: a.get("size") or 0, reverse=True)
@@ -0,0 +1,386 @@
+"""
+Direct HTTP download engine สำหรับไฟล์แนบ (sys_attachment.do) และ export endpoints
+
+ใช้ cookies จาก BrowserContext (state.json) ยิง request ตรงด้วย http.client
+แต่ละ thread ใน pool มี keep-alive connection ของตัวเอง และเขียนไฟล์ลง disk ทีละ chunk
+ทำให้ดาวน์โหลดหลายไฟล์ของ record เดียวกันซ้อนกันได้ โดยไม่ต้องรอ browser download event
+
+ไฟล์ถูกเขียนลง <ชื่อไฟล์>.part แล้วค่อย rename เป็นชื่อจริงเมื่อครบ (ไฟล์ที่มีชื่อจริงอยู่ = สมบูรณ์เสมอ)
+  - .part ที่ค้างจาก run ก่อนจะโหลดต่อด้วย Range: bytes=<ขนาดเดิม>- + If-Range (ETag / Last-Modified ที่จดไว้ใน
+    <ชื่อไฟล์>.part.json) แทนการเริ่มใหม่ - ไม่มี validator หรือ server ตอบ 200 (ไฟล์เปลี่ยน) -> ทิ้ง .part เริ่มจาก byte 0
+  - ขนาดไฟล์ที่ได้ต้องตรงกับ total ของ Content-Range / Content-Length ก่อน rename
+  - ไฟล์ใหญ่ (>= RANGED_MIN_BYTES) ที่ server รองรับ Range แบ่งเป็นช่วงละ SEGMENT_BYTES
+    โหลดพร้อมกันหลาย connection เขียนลงตำแหน่งของตัวเองใน .part
+    ช่วงที่เสร็จแล้วจดไว้ใน <ชื่อไฟล์>.part.json เพื่อ resume เฉพาะช่วงที่ยังขาด (ต้องมี validator เหมือนกัน
+    ไม่มี -> ทิ้ง .part) ทุกช่วงส่ง If-Range และ total ใน Content-Range ต้องตรงกับที่จดไว้
+    ไม่ตรง / server ตอบ 200 (ไฟล์เปลี่ยน) -> ทิ้ง .part ทั้งไฟล์ ไม่ต่อ byte เก่ากับใหม่
+PDF (expect_prefix) render ใหม่ทุกครั้ง จึงไม่ resume / ไม่แบ่งช่วง
+"""
+import http.client
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from auth import is_login_url
+from retry import THROTTLE_STATUSES
+
+CHUNK_SIZE = 256 * 1024
+MAX_REDIRECTS = 5
+DEFAULT_CONCURRENCY = 4
+
+PART_SUFFIX = ".part"
+PART_STATE_SUFFIX = ".part.json"
+RANGED_MIN_BYTES = 32 * 1024 * 1024
+SEGMENT_BYTES = 16 * 1024 * 1024
+RANGE_CONNECTIONS = 4  # connection ต่อไฟล์ใหญ่หนึ่งไฟล์
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    """Raised when a direct HTTP download fails"""
+
+    def __init__(self, url: str, message: str, status: int = 0, expired: bool = False):
+        self.url = url
+        self.status = status
+        self.expired = expired  # session หมดอายุ (401 / หน้า login) - ไม่ใช่ปัญหาของไฟล์นี้
+        super().__init__(f"{message} ({url})")
+
+
+class StaleRangeError(DownloadError):
+    """A range of a .part came from a different version of the file than the rest of it"""
+
+
+def part_path(target: Path) -> Path:
+    """Temporary file a download is written to before the atomic rename"""
+    return target.with_name(target.name + PART_SUFFIX)
+
+
+def content_range(response):
+    """(start, end, total) from a 206 response's Content-Range (total None if unknown), or None"""
+    match = CONTENT_RANGE.fullmatch(response.getheader("Content-Range", "").strip())
+    if response.status != 206 or not match:
+        return None
+    start, end, total = match.groups()
+    return int(start), int(end), None if total == "*" else int(total)
+
+
+class HttpDownloader:
+    """Bounded-concurrency HTTP client that reuses one keep-alive connection per pool thread"""
+
+    def __init__(self, cookies: list, max_workers: int = DEFAULT_CONCURRENCY,
+                 user_token=None, timeout: float = 300, range_connections: int = RANGE_CONNECTIONS):
+        self.timeout = timeout
+        self.user_token = user_token
+        self.range_connections = range_connections
+        self._cookie_header = ""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dl")
+        # ช่วงของไฟล์ใหญ่ใช้ pool แยก (thread ใน _pool รอช่วงเหล่านี้อยู่ ใช้ pool เดียวกันจะ deadlock)
+        self._segment_pool = ThreadPoolExecutor(max_workers=max(1, range_connections * max_workers),
+                                                thread_name_prefix="dl-range")
+        self.resumed = 0
+        self.ranged = 0
+        self.expired = False  # เคยเจอ 401 / หน้า login ตั้งแต่ตั้ง cookies ล่าสุด
+        self.listeners = []  # callables(url, bytes, elapsed_ms, ok) - เรียกหลังทุก transfer
+        self.throttle_listeners = []  # callables(status, retry_after_s) - server ตอบ 429 / 503
+        self.set_cookies(cookies)
+
+    @classmethod
+    def from_context(cls, context, base: str, **kwargs):
+        """Build a downloader from the cookies currently held by a BrowserContext"""
+        return cls(context.cookies(base), **kwargs)
+
+    def set_cookies(self, cookies: list):
+        self._cookie_header = "; ".join(f"{c['name']}={c['value']}" for c in cookies)
+        self.expired = False
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self._segment_pool.shutdown(wait=True)
+
+    def _connection(self, scheme: str, netloc: str):
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        key = (scheme, netloc)
+        if key not in conns:
+            conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conns[key] = conn_cls(netloc, timeout=self.timeout)
+        return conns[key]
+
+    def _drop_connection(self, scheme: str, netloc: str):
+        conn = getattr(self._local, "conns", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _request(self, url: str, headers: dict, retry: bool = True):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        send_headers = {"Cookie": self._cookie_header, "Accept": "*/*"}
+        if self.user_token:
+            send_headers["X-UserToken"] = self.user_token
+        send_headers.update(headers)
+
+        conn = self._connection(parts.scheme, parts.netloc)
+        try:
+            conn.request("GET", path, headers=send_headers)
+            return conn.getresponse()
+        except (http.client.HTTPException, ConnectionError, OSError):
+            # keep-alive connection อาจถูก server ปิดไปแล้ว ลองใหม่ด้วย connection ใหม่ 1 ครั้ง
+            self._drop_connection(parts.scheme, parts.netloc)
+            if not retry:
+                raise
+            return self._request(url, headers, retry=False)
+
+    def fetch(self, url: str, target: Path, headers=None, expect_prefix: bytes = b"") -> int:
+        """Download url to target (via target.part + rename). Returns the size of the finished file.
+
+        expect_prefix: magic bytes the body must start with (e.g. b"%PDF"), checked before writing
+        """
+        start = time.perf_counter()
+        written, ok = 0, False
+        try:
+            written = self._fetch(url, target, headers or {}, expect_prefix)
+            ok = True
+            return written
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            for listener in self.listeners:
+                listener(url, written, elapsed, ok)
+
+    def _open(self, url: str, headers: dict):
+        """GET url following redirects on the same host. Returns (response, final url); raises DownloadError on errors.
+
+        A redirect to another host (SSO / IdP) is not followed - Cookie / X-UserToken belong to the instance only.
+        """
+        netloc = urlsplit(url).netloc
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request(url, headers)
+            if response.status in (301, 302, 303, 307, 308):
+                location = urljoin(url, response.getheader("Location", ""))
+                response.read()
+                if urlsplit(location).netloc != netloc:
+                    self.expired = True
+                    raise DownloadError(url, f"redirected to {urlsplit(location).netloc} - session expired",
+                                        response.status, expired=True)
+                url = location
+                continue
+            break
+        else:
+            raise DownloadError(url, "too many redirects")
+
+        if response.status == 401:
+            response.read()
+            self.expired = True
+            raise DownloadError(url, "HTTP 401 - session expired", response.status, expired=True)
+        if response.status >= 400:
+            response.read()
+            if response.status in THROTTLE_STATUSES:
+                retry_after = response.getheader("Retry-After", "")
+                for listener in self.throttle_listeners:
+                    listener(response.status, float(retry_after) if retry_after.isdigit() else 0)
+            raise DownloadError(url, f"HTTP {response.status} {response.reason}", response.status)
+
+        content_type = response.getheader("Content-Type", "")
+        if "text/html" in content_type and is_login_url(url):
+            response.read()
+            self.expired = True
+            raise DownloadError(url, "redirected to login page - session expired", response.status, expired=True)
+        return response, url
+
+    def _abandon(self, url: str, response):
+        """Close a response that will not be read to the end (its connection can't be reused)"""
+        response.close()
+        parts = urlsplit(url)
+        self._drop_connection(parts.scheme, parts.netloc)
+
+    def _fetch(self, url: str, target: Path, headers: dict, expect_prefix: bytes) -> int:
+        part = part_path(target)
+        state_path = target.with_name(target.name + PART_STATE_SUFFIX)
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        resumable = not expect_prefix
+        validator = None
+        if not resumable:
+            part.unlink(missing_ok=True)
+        elif state_path.exists():
+            try:
+                state = json.loads(state_path.read_text(encoding="utf-8"))
+                validator = state.get("validator")
+                if not state.get("stream") and validator:
+                    # ค้างจากการโหลดแบบแบ่งช่วง - โหลดต่อเฉพาะช่วงที่ขาด
+                    return self._fetch_ranged(state["url"], headers, target, state)
+            except (ValueError, KeyError, DownloadError) as e:
+                print(f"[WARN] Could not resume {target.name} ({e}) - starting over")
+                state_path.unlink(missing_ok=True)
+                part.unlink(missing_ok=True)
+
+        if part.exists() and not validator:
+            # .part ที่ไม่รู้ว่ามาจากไฟล์ version ไหน ต่อท้ายไม่ได้ - เริ่มจาก byte 0
+            part.unlink()
+            state_path.unlink(missing_ok=True)
+        offset = part.stat().st_size if resumable and part.exists() else 0
+        request_headers = dict(headers)
+        if resumable:
+            # bytes=0- ถามขนาดไฟล์ / การรองรับ Range ไปในตัว
+            request_headers["Range"] = f"bytes={offset}-"
+            if offset:
+                # ไฟล์บน server เปลี่ยนไปแล้ว -> server ตอบ 200 ทั้งไฟล์แทน 206
+                request_headers["If-Range"] = validator
+        try:
+            response, url = self._open(url, request_headers)
+        except DownloadError as e:
+            if e.status != 416 or not offset:
+                raise
+            # .part ยาวเท่า / เกินไฟล์จริง - เริ่มใหม่
+            part.unlink()
+            offset = 0
+            request_headers["Range"] = "bytes=0-"
+            request_headers.pop("If-Range", None)
+            response, url = self._open(url, request_headers)
+
+        first = response.read(CHUNK_SIZE)
+        if expect_prefix and not first.startswith(expect_prefix):
+            response.read()
+            raise DownloadError(url, f"unexpected content ({response.getheader('Content-Type') or 'no content type'})",
+                                response.status)
+
+        span = content_range(response)
+        new_validator = response.getheader("ETag") or response.getheader("Last-Modified")
+        if span and span[0] == 0 and span[2] and span[2] >= RANGED_MIN_BYTES and self.range_connections > 1:
+            self._abandon(url, response)
+            state = {"url": url, "total": span[2], "done": [], "validator": new_validator}
+            return self._fetch_ranged(url, headers, target, state)
+
+        if span and span[0] == offset and offset:
+            mode = "ab"
+            with self._lock:
+                self.resumed += 1
+        else:
+            # server ไม่รองรับ Range หรือไฟล์เปลี่ยน (200) -> เริ่มใหม่ทั้งไฟล์
+            if offset:
+                print(f"[INFO] {target.name}: server sent the whole file - discarding the old .part")
+            mode, offset = "wb", 0
+        if span and span[2]:
+            total = span[2]
+        else:
+            length = response.getheader("Content-Length")
+            total = offset + int(length) if length and length.isdigit() else None
+
+        if resumable:
+            if new_validator:
+                # จด validator ไว้ข้าง .part - ครั้งหน้าโหลดต่อด้วย If-Range
+                state_path.write_text(json.dumps({"url": url, "stream": True, "validator": new_validator,
+                                                  "total": total}), encoding="utf-8")
+            else:
+                state_path.unlink(missing_ok=True)
+
+        with open(part, mode) as f:
+            chunk = first
+            while chunk:
+                f.write(chunk)
+                chunk = response.read(CHUNK_SIZE)
+        size = part.stat().st_size
+        if total is not None and size != total:
+            if size > total or not resumable:
+                part.unlink()
+                state_path.unlink(missing_ok=True)
+            # สั้นกว่า: .part + validator คงไว้ โหลดต่อครั้งหน้า
+            raise DownloadError(url, f"got {size:,} of {total:,} bytes", response.status)
+        os.replace(part, target)
+        state_path.unlink(missing_ok=True)
+        return size
+
+    def _fetch_ranged(self, url: str, headers: dict, target: Path, state: dict) -> int:
+        """Download the missing SEGMENT_BYTES ranges of a large file in parallel, then rename into place"""
+        part = part_path(target)
+        state_path = target.with_name(target.name + PART_STATE_SUFFIX)
+        total = state["total"]
+        segments = [(start, min(start + SEGMENT_BYTES, total) - 1) for start in range(0, total, SEGMENT_BYTES)]
+        done = set(state["done"]) if part.exists() else set()
+        with self._lock:
+            self.ranged += 1
+            if done:
+                self.resumed += 1
+
+        with open(part, "r+b" if part.exists() else "wb") as f:
+            f.truncate(total)
+
+        def save_state():
+            state["done"] = sorted(done)
+            state_path.write_text(json.dumps(state), encoding="utf-8")
+
+        save_state()
+        pending = [(index, start, end) for index, (start, end) in enumerate(segments) if index not in done]
+        futures = [(index, self._segment_pool.submit(self._fetch_segment, url, headers, part,
+                                                     state.get("validator"), total, start, end))
+                   for index, start, end in pending]
+        errors = []
+        for index, future in futures:
+            try:
+                future.result()
+                done.add(index)
+                save_state()
+            except Exception as e:
+                errors.append(e)
+        stale = [e for e in errors if isinstance(e, StaleRangeError)]
+        if stale:
+            # byte ในไฟล์มาจากคนละ version - ต่อไม่ได้ เริ่มใหม่ครั้งหน้า
+            print(f"[INFO] {target.name}: file changed on the server - discarding the old .part")
+            part.unlink(missing_ok=True)
+            state_path.unlink(missing_ok=True)
+            raise stale[0]
+        if errors:
+            # .part + .part.json คงไว้ - ครั้งหน้าโหลดต่อเฉพาะช่วงที่ยังขาด
+            raise errors[0]
+
+        os.replace(part, target)
+        state_path.unlink(missing_ok=True)
+        return total
+
+    def _fetch_segment(self, url: str, headers: dict, part: Path, validator, total: int, start: int, end: int):
+        request_headers = dict(headers, Range=f"bytes={start}-{end}")
+        if validator:
+            # ไฟล์เปลี่ยนระหว่างโหลด -> server ตอบ 200 ทั้งไฟล์แทน 206
+            request_headers["If-Range"] = validator
+        response, url = self._open(url, request_headers)
+        span = content_range(response)
+        if validator and response.status == 200:
+            self._abandon(url, response)
+            raise StaleRangeError(url, f"range {start}-{end}: validator no longer matches (HTTP 200)", 200)
+        if span and span[2] != total:
+            self._abandon(url, response)
+            raise StaleRangeError(url, f"range {start}-{end}: file is now {span[2]} bytes, not {total}",
+                                  response.status)
+        if not span or span[0] != start:
+            self._abandon(url, response)
+            raise DownloadError(url, f"range {start}-{end} not honoured (HTTP {response.status})", response.status)
+
+        position = start
+        with open(part, "r+b") as f:
+            f.seek(start)
+            while position <= end:
+                chunk = response.read(min(CHUNK_SIZE, end + 1 - position))
+                if not chunk:
+                    break
+                f.write(chunk)
+                position += len(chunk)
+        if position != end + 1:
+            self._abandon(url, response)
+            raise DownloadError(url, f"range {start}-{end} ended at {position}", response.status)
+
+    def summary(self) -> list:
+        return [f"  {self.ranged} file(s) downloaded in ranges, {self.resumed} resumed from a .part file"]
+
+    def submit(self, url: str, target: Path, headers=None, expect_prefix: bytes = b""):
+        """Queue a download on the pool. Returns a Future resolving to the byte count."""
+        return self._pool.submit(self.fetch, url, target, headers, expect_prefix)
@@ -0,0 +1,488 @@
+"""
+Asyncio export engine (async_playwright) สำหรับ 02_export_changes.py --engine async
+
+Pipeline แยกเป็น stage ต่อกันด้วย asyncio.Queue แบบมีขนาดจำกัด:
+
+    enumerate (Table API) -> open record (page pool) -> PDF export  \\
+                                                     -> attachments  -> bookkeeping
+
+browser เดียว, หลาย context (--workers) x หลาย page (--pages-per-context)
+page ถูกใช้แค่ตอนเปิด form เพื่ออ่าน sys_id + attachment links จากนั้นคืน page ทันที
+ส่วน PDF / ไฟล์แนบ ดาวน์โหลดผ่าน HttpDownloader ใน thread pool จึงมีหลาย record อยู่ใน pipeline พร้อมกัน
+"""
+import asyncio
+import contextlib
+import json
+import time
+from pathlib import Path
+
+from playwright.async_api import async_playwright
+
+import auth
+import snow_api
+from attachments import ATTACHMENT_DIR, category_path, classify_attachment, link_or_copy, store_path
+from dom_extract import downloadable, form_snapshot_async
+from download_engine import HttpDownloader
+from manifest import STATUS_DONE
+from waits import GLIDE_FORM_READY_JS, Waiter
+
+QUEUE_SIZE = 50
+
+
+class RecordJob:
+    """One change request moving through the pipeline"""
+
+    def __init__(self, item: dict, folder, pending):
+        self.item = item
+        self.number = item["number"]
+        self.sys_id = item.get("sys_id")
+        self.folder = folder
+        self.links = []
+        self.pending = set(pending)
+        self.stored = set()  # ไฟล์ใน Attachment/ ที่โอนแล้วใน run นี้ (แต่ละไฟล์โอนครั้งเดียว)
+        self.failed = []
+        self.started = time.perf_counter()
+        self.timings = {}  # stage -> perf_counter ตอนเริ่มโอนจริง (หลังได้ slot)
+        self.downloader = None  # HttpDownloader ของ session ที่เปิด record นี้
+        self.probe = None       # token จาก CircuitBreaker.wait() ถ้า record นี้เป็น probe ของ half-open
+        self.context = None     # BrowserContext ที่เปิด record นี้ (login ใหม่เมื่อ download เจอ session หมดอายุ)
+
+
+class AsyncExporter:
+    def __init__(self, args, downloaded: set, *, base: str, state: str, record_folder, manifest, query="",
+                 metrics=None, net_filter=None, asset_cache=None, memory=None, session_pool=None, reauth=None,
+                 retries=None, breaker=None, concurrency=None):
+        self.args = args
+        self.downloaded = downloaded
+        self.query = query
+        self.base = base
+        self.state = state
+        self.record_folder = record_folder
+        self.manifest = manifest
+        self.metrics = metrics
+        self.net_filter = net_filter
+        self.asset_cache = asset_cache
+        self.memory = memory
+        self.session_pool = session_pool
+        self.reauth = reauth
+        self.retries = retries  # retry.RetryQueue - record ที่ fail ลองใหม่ตอนท้าย run
+        self.breaker = breaker  # retry.CircuitBreaker - พักทุก page เมื่อ error พุ่ง
+        # concurrency.AimdController - จำกัดจำนวน form load + PDF render ที่ยิงพร้อมกัน (None = ทุก page)
+        self.concurrency = concurrency
+        self.waiter = Waiter()
+        if metrics is not None:
+            self.waiter.listeners.append(
+                lambda stage, elapsed_ms, ok: metrics.observe(f"wait.{stage}", elapsed_ms, ok))
+
+        self.record_q = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.pdf_q = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.attach_q = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.done_q = asyncio.Queue()
+
+        self.queued = 0
+        self.completed = 0
+        self.logins = {}       # context -> session (sessions.Session) หรือ None
+        self.downloaders = {}  # ชื่อ session -> HttpDownloader (cookies ของ session นั้น)
+        self.state_mtimes = {}  # context -> mtime ของไฟล์ state ตอนโหลด cookies เข้า context
+        self.expired = None     # SessionExpired ที่ login ใหม่ไม่สำเร็จ - record ที่เหลือข้ามไป (ยัง pending)
+        self.reauth_locks = {}  # context -> asyncio.Lock (download หลายตัวเจอ session หมดอายุพร้อมกัน login ครั้งเดียว)
+
+    def url(self, path: str) -> str:
+        return snow_api.api_url(self.base, path)
+
+    # ---------- stage 1: enumeration ----------
+    async def enumerate(self, page):
+        request = page.context.request
+        user_token = None
+        seen = set()
+        while True:
+            try:
+                async for record in snow_api.aiter_change_requests(request, self.base, self.query,
+                                                                user_token=user_token):
+                    number = record.get("number", "").strip()
+                    if not number or number in self.downloaded or number in seen:
+                        continue
+                    seen.add(number)
+                    await self.record_q.put(record)  # block เมื่อ queue เต็ม (backpressure)
+                    self.queued += 1
+                print(f"[ASYNC] Enumeration done: {self.queued} pending change(s)")
+                return
+            except snow_api.ApiError as e:
+                if e.status in (401, 403) and user_token is None:
+                    user_token = await snow_api.fetch_user_token_async(page, self.base)
+                    if user_token:
+                        continue
+                # ไม่มี fallback ไปหน้า list UI แบบ engine sync - record ที่เข้า queue แล้วทำต่อจนจบ
+                print(f"[ERROR] Table API enumeration failed ({e}) after {self.queued} change(s) - the async engine "
+                      f"has no list UI fallback; rerun with --engine sync to page the list")
+                return
+
+    # ---------- stage 2: open record ----------
+    async def open_form(self, page, name: str, job: RecordJob, url: str):
+        """goto the record's form; re-authenticate and reload it if the session expired"""
+        for attempt in range(auth.MAX_REAUTH_PER_RECORD + 1):
+            if self.reauth is not None:
+                await asyncio.to_thread(self.reauth.wait_ready)
+            await page.goto(url, wait_until="domcontentloaded")
+
+            start = time.perf_counter()
+            try:
+                await page.wait_for_function(GLIDE_FORM_READY_JS,
+                                             timeout=self.waiter.budget("form_ready"))
+                self.waiter.record("form_ready", start, True)
+                return
+            except Exception:
+                self.waiter.record("form_ready", start, False)
+            if not await auth.page_expired_async(page):
+                print(f"[WARN] [{name}] {job.number}: form not ready, continuing")
+                return
+            if self.reauth is None or attempt == auth.MAX_REAUTH_PER_RECORD:
+                raise auth.SessionExpired(f"redirected to login page ({page.url})")
+            print(f"[WARN] [{name}] {job.number}: redirected to login page")
+            await self.reauthenticate(page.context, name)
+
+    async def reauthenticate(self, context, name: str):
+        """Refresh the context's expired login and load the new cookies into the same context
+        (its other pages keep their place)"""
+        login = self.logins.get(context)
+        session, path = (login.name, login.path) if login else ("default", Path(self.state))
+        if not await asyncio.to_thread(self.reauth.refresh, session, path, self.state_mtimes[context],
+                                       f"[{name}] "):
+            raise auth.SessionExpired(f"session {session} expired and could not be re-authenticated")
+        await context.clear_cookies()
+        await context.add_cookies(json.loads(path.read_text()).get("cookies", []))
+        self.state_mtimes[context] = auth.state_mtime(path)
+        self.downloaders[login.name if login else None].set_cookies(await context.cookies(self.base))
+        if self.metrics is not None:
+            self.metrics.event("reauth", session=session)
+
+    async def open_records(self, page, name: str):
+        opened = 0  # record ที่ page นี้เปิดตั้งแต่ recycle ครั้งก่อน
+        while True:
+            item = await self.record_q.get()
+            if self.expired is not None:
+                # login ใหม่ไม่ได้ - ระบาย queue ให้ pipeline จบ record ที่เหลือยัง pending ใน manifest
+                self.record_q.task_done()
+                continue
+            probe = None
+            try:
+                if self.breaker is not None:
+                    probe = await asyncio.to_thread(self.breaker.wait)
+                number = item["number"]
+                job = RecordJob(item, self.record_folder(number), self.manifest.pending_artifacts(number))
+                job.probe = probe
+                job.folder.mkdir(parents=True, exist_ok=True)
+                self.manifest.upsert_change(number, job.sys_id, item.get(snow_api.CAB_DATE_FIELD),
+                                            item.get("sys_updated_on"))
+                print(f"=== [{name}] {job.number} ===")
+
+                if job.sys_id:
+                    url = self.url(f"/change_request.do?sys_id={job.sys_id}")
+                else:
+                    url = self.url(f"/change_request.do?sysparm_query=number={job.number}")
+                async with self.slot():
+                    await self.open_form(page, name, job, url)
+                    snapshot = await form_snapshot_async(page)
+                job.sys_id = job.sys_id or snapshot["sys_id"]
+                job.links = downloadable(snapshot["attachments"])
+                login = self.logins.get(page.context)
+                job.downloader = self.downloaders[login.name if login else None]
+                job.context = page.context
+                if login is not None:
+                    self.session_pool.report(login, True)
+
+                # page ว่างแล้ว ส่งงานดาวน์โหลดต่อให้ stage ถัดไป (เฉพาะ artifact ที่ยังไม่สำเร็จ)
+                if "pdf" in job.pending:
+                    await self.pdf_q.put(job)
+                if job.pending & {"supporting_docs", "attachments_zip"}:
+                    await self.attach_q.put(job)
+            except auth.SessionExpired as e:
+                print(f"[ERROR] [{name}] {e} - skipping the remaining records; rerun to resume")
+                self.expired = e
+            except Exception as e:
+                print(f"[WARN] [{name}] {item.get('number')} failed to open: {e}")
+                if self.logins.get(page.context) is not None:
+                    self.session_pool.report(self.logins[page.context], False)
+                self.finished(item, [e], probe)
+            finally:
+                self.record_q.task_done()
+
+            opened += 1
+            reason = self.memory.check(opened) if self.memory is not None else None
+            if reason:
+                # page อื่นของ context เดียวกันยังทำงานอยู่ จึง recycle ระดับ page (renderer process ของ page นี้)
+                print(f"[INFO] [{name}] Recycling page after {opened} record(s): {reason}")
+                context = page.context
+                await page.close()
+                page = await context.new_page()
+                opened = 0
+
+    # ---------- download stages: session หมดอายุระหว่างโหลด ----------
+    async def with_reauth(self, job: RecordJob, fetch):
+        """Run a download stage (fetch(job) -> (files, error, expired)). If one of its own transfers failed
+        because the login expired (DownloadError.expired: HTTP 401 / login page), refresh the session and
+        run it again instead of recording a failure. Raises SessionExpired if the session could not be refreshed."""
+        for attempt in range(auth.MAX_REAUTH_PER_RECORD + 1):
+            loaded = self.state_mtimes.get(job.context)
+            files, error, expired = await fetch(job)
+            if not expired:
+                return files, error
+            if self.reauth is None or attempt == auth.MAX_REAUTH_PER_RECORD:
+                raise auth.SessionExpired(f"{job.number}: {error}")
+            print(f"[WARN] {job.number}: session expired during download")
+            async with self.reauth_locks.setdefault(job.context, asyncio.Lock()):
+                # download อื่นของ context เดียวกัน login ใหม่ไปแล้ว -> แค่ลองใหม่
+                if self.state_mtimes.get(job.context) == loaded:
+                    await self.reauthenticate(job.context, job.number)
+
+    async def run_download_stage(self, job: RecordJob, stage: str, fetch):
+        """with_reauth + hand the result to bookkeeping. An expired session that could not be refreshed
+        leaves the artifact pending in the manifest (not failed)."""
+        start = time.perf_counter()
+        try:
+            files, error = await self.with_reauth(job, fetch)
+        except auth.SessionExpired as e:
+            print(f"[ERROR] {e} - skipping the remaining records; rerun to resume")
+            self.expired = e
+            return
+        await self.done_q.put((job, stage, files, error, job.timings.pop(stage, start)))
+
+    # ---------- stage 3: PDF ----------
+    async def export_pdfs(self):
+        while True:
+            job = await self.pdf_q.get()
+            try:
+                await self.run_download_stage(job, "pdf", self._pdf)
+            finally:
+                self.pdf_q.task_done()
+
+    async def _pdf(self, job: RecordJob):
+        # HTTP เท่านั้น - engine async ไม่มี fallback ไปเมนู Export ของ UI (page ถูกคืนหลังอ่าน form แล้ว)
+        target = job.folder / f"{job.folder.name}.pdf"
+        try:
+            if not job.sys_id:
+                raise RuntimeError("sys_id not found")
+            url = self.url(f"/change_request.do?PDF&sys_id={job.sys_id}")
+            async with self.slot():
+                # ไม่นับเวลารอ slot (latency ที่ controller ใช้ตัดสิน)
+                job.timings["pdf"] = time.perf_counter()
+                size = await asyncio.wrap_future(job.downloader.submit(url, target, None, b"%PDF"))
+            print(f"{job.number}: PDF saved ({size:,} bytes)")
+            return [target], None, False
+        except Exception as e:
+            print(f"[WARN] {job.number}: Export PDF failed: {e}")
+            return [], e, getattr(e, "expired", False)
+
+    # ---------- stage 4: attachments ----------
+    async def download_attachments(self):
+        while True:
+            job = await self.attach_q.get()
+            try:
+                if "supporting_docs" in job.pending:
+                    await self.run_download_stage(job, "supporting_docs", self._supporting_docs)
+                if "attachments_zip" in job.pending and self.expired is None:
+                    await self.run_download_stage(job, "attachments_zip", self._attachments_zip)
+            finally:
+                self.attach_q.task_done()
+
+    async def _supporting_docs(self, job: RecordJob):
+        files, errors, expired = [], [], False
+        transfers = []
+        for link in job.links:
+            filename = link["filename"]
+            source = store_path(job.folder, link["name"])
+            transfer = None
+            if source not in job.stored:
+                transfer = asyncio.wrap_future(job.downloader.submit(link["href"], source))
+            transfers.append((filename, source, transfer))
+
+        for filename, source, transfer in transfers:
+            try:
+                if transfer is not None:
+                    await transfer
+                    job.stored.add(source)
+                target = link_or_copy(source, category_path(job.folder, filename, source.name))
+                files.append(target)
+                print(f"{job.number}: ✓ {classify_attachment(filename)} downloaded: {filename}")
+            except Exception as e:
+                print(f"[WARN] {job.number}: Could not download {filename}: {e}")
+                errors.append(f"{filename}: {e}")
+                expired = expired or getattr(e, "expired", False)
+        return files, "; ".join(errors) or None, expired
+
+    async def _attachments_zip(self, job: RecordJob):
+        # Attachment/ ต้องมีทุกไฟล์ของ record: โหลดเฉพาะไฟล์ที่ Supporting Documents ยังไม่ได้โอน
+        # (ไม่ขอ zip ของ Download All ซึ่งมีไฟล์ชุดเดิมซ้ำอีกรอบ)
+        files, errors, expired = [], [], False
+        transfers = []
+        for link in job.links:
+            source = store_path(job.folder, link["name"])
+            if source in job.stored:
+                files.append(source)
+            else:
+                transfers.append((link["filename"], source,
+                                  asyncio.wrap_future(job.downloader.submit(link["href"], source))))
+
+        for filename, source, transfer in transfers:
+            try:
+                await transfer
+                job.stored.add(source)
+                files.append(source)
+            except Exception as e:
+                print(f"[WARN] {job.number}: Could not download {filename}: {e}")
+                errors.append(f"{filename}: {e}")
+                expired = expired or getattr(e, "expired", False)
+        print(f"{job.number}: {len(files)} file(s) in {ATTACHMENT_DIR}/, {len(transfers)} downloaded now")
+        return files, "; ".join(errors) or None, expired
+
+    # ---------- stage 5: bookkeeping ----------
+    async def bookkeeping(self):
+        while True:
+            job, stage, files, error, start = await self.done_q.get()
+            try:
+                duration_ms = (time.perf_counter() - start) * 1000
+                # hash ไฟล์ใหญ่ใน thread เพื่อไม่ block event loop
+                status = await asyncio.to_thread(self.manifest.record_stage, job.number, stage,
+                                                 files, error, duration_ms)
+                job.pending.discard(stage)
+                if status != STATUS_DONE:
+                    job.failed.append(stage)
+                if self.metrics is not None:
+                    self.metrics.observe(stage, duration_ms, status == STATUS_DONE, number=job.number)
+                if not job.pending:
+                    elapsed = time.perf_counter() - job.started
+                    if self.metrics is not None:
+                        self.metrics.observe("record", elapsed * 1000, not job.failed, number=job.number)
+                    self.finished(job.item, job.failed, job.probe)
+                    if job.failed:
+                        print(f"[WARN] {job.number} incomplete: {', '.join(job.failed)}")
+                    else:
+                        self.completed += 1
+                        print(f"✓ {job.number} completed and recorded in manifest ({elapsed:.1f}s)")
+            finally:
+                self.done_q.task_done()
+
+    def slot(self):
+        """Concurrency slot for a form load / PDF render, or a no-op without a controller"""
+        return self.concurrency.async_slot() if self.concurrency is not None else contextlib.nullcontext()
+
+    def finished(self, item: dict, failed: list, probe=None):
+        """Feed the circuit breaker and requeue a failed record for the retry round"""
+        if self.breaker is not None:
+            self.breaker.record(not failed, probe)
+        if self.retries is None:
+            return
+        if not failed:
+            self.retries.succeeded(item["number"])
+        elif not self.retries.add(item, ", ".join(map(str, failed))):
+            print(f"[WARN] {item['number']} will be retried on resume")
+
+    async def drain(self):
+        """Wait until every stage is idle (each queue in pipeline order)"""
+        for q in (self.record_q, self.pdf_q, self.attach_q, self.done_q):
+            await q.join()
+
+    async def retry_failed(self):
+        """End of run: push requeued records through the pipeline again (their pending artifacts only)"""
+        while self.retries is not None and self.expired is None:
+            batch = await asyncio.to_thread(self.retries.next_batch)
+            if not batch:
+                return
+            print(f"\n===== [ASYNC] Retrying {len(batch)} failed change(s) =====")
+            for item in batch:
+                await self.record_q.put(item)
+            await self.drain()
+
+    async def run(self):
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=self.args.headless)
+            contexts = []
+            for _ in range(self.args.workers):
+                login = None
+                if self.session_pool is not None:
+                    login = self.session_pool.acquire(timeout=0)
+                    if login is None:
+                        print(f"[WARN] Sessions allow only {len(contexts)} context(s)")
+                        break
+                context = await browser.new_context(storage_state=login.state if login else self.state,
+                                                    accept_downloads=True)
+                self.logins[context] = login
+                self.state_mtimes[context] = auth.state_mtime(login.state if login else self.state)
+                contexts.append(context)
+            for context in contexts:
+                # cache ก่อน filter (filter ทำงานก่อนแล้ว fallback มาที่ cache)
+                if self.asset_cache is not None:
+                    await self.asset_cache.install_async(context)
+                if self.net_filter is not None:
+                    await self.net_filter.install_async(context)
+            pages = []
+            for i, context in enumerate(contexts):
+                for j in range(self.args.pages_per_context):
+                    pages.append((f"C{i + 1}P{j + 1}", await context.new_page()))
+
+            # downloader ละ session (PDF / ไฟล์แนบวิ่งบน session ที่เปิด record นั้น ไม่กองอยู่ที่ session เดียว)
+            for context, login in self.logins.items():
+                key = login.name if login else None
+                if key in self.downloaders:
+                    continue
+                downloader = HttpDownloader(await context.cookies(self.base),
+                                            max_workers=self.args.download_concurrency,
+                                            range_connections=self.args.range_connections)
+                if self.metrics is not None:
+                    downloader.listeners.append(
+                        lambda url, size, elapsed_ms, ok: self.metrics.observe("http_fetch", elapsed_ms, ok, size,
+                                                                               url=url))
+                if self.breaker is not None:
+                    downloader.throttle_listeners.append(self.breaker.throttled)
+                self.downloaders[key] = downloader
+            started = time.perf_counter()
+
+            tasks = [asyncio.create_task(self.open_records(page, name)) for name, page in pages]
+            tasks += [asyncio.create_task(self.export_pdfs()) for _ in range(len(pages))]
+            tasks += [asyncio.create_task(self.download_attachments())
+                      for _ in range(self.args.download_concurrency)]
+            tasks.append(asyncio.create_task(self.bookkeeping()))
+
+            # enumeration ใช้ page ของตัวเอง (อาจต้องโหลด g_ck)
+            enum_page = await contexts[0].new_page()
+            try:
+                await self.enumerate(enum_page)
+                await self.drain()
+                await self.retry_failed()
+            finally:
+                # รอทุก stage ว่างตามลำดับ แล้วค่อยหยุด task
+                await self.drain()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                for downloader in self.downloaders.values():
+                    downloader.close()
+                for login in self.logins.values():
+                    if login is not None:
+                        self.session_pool.release(login)
+                await browser.close()
+
+            elapsed = time.perf_counter() - started
+            rate = self.completed / (elapsed / 60) if elapsed > 0 else 0
+            print(f"\n===== Completed! {self.completed}/{self.queued} change(s) in {elapsed:.0f}s "
+                  f"({rate:.1f} records/min, {len(pages)} page(s)) =====")
+            print("\n===== Wait times per stage =====")
+            for line in self.waiter.summary():
+                print(line)
+            if self.net_filter is not None and self.net_filter.enabled:
+                print("\n===== Blocked requests =====")
+                for line in self.net_filter.summary():
+                    print(line)
+            if self.asset_cache is not None and self.asset_cache.enabled:
+                print("\n===== Asset cache =====")
+                for line in self.asset_cache.summary():
+                    print(line)
+            print("\n===== Large / resumed downloads =====")
+            for key, downloader in self.downloaders.items():
+                for line in downloader.summary():
+                    print(f"{line} ({key})" if key else line)
+
+
+def run(args, downloaded: set, **kwargs):
+    """Entry point used by 02_export_changes.py --engine async"""
+    asyncio.run(AsyncExporter(args, downloaded, **kwargs).run())
@@ -0,0 +1,226 @@
+"""
+SQLite manifest ของการ export (แทน downloaded.log)
+
+เก็บสถานะแยกต่อ change และต่อ artifact (pdf, supporting_docs, attachments_zip)
+พร้อมขนาดไฟล์, sha256, เวลาที่ใช้ และ error ทำให้ resume แล้วทำซ้ำเฉพาะ artifact ที่ยังไม่สำเร็จ
+ใช้ WAL mode เพื่อให้หลาย worker เขียนได้โดยไม่ block การอ่าน
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+MANIFEST_DB = Path("manifest.db")
+
+# attachments_zip = โฟลเดอร์ Attachment/ ครบทุกไฟล์ของ record
+# (zip ของ Download All ในโหมด UI หรือไฟล์ที่โหลดผ่าน HTTP - ชื่อเดิมคงไว้เพื่อให้ manifest เก่าใช้ต่อได้)
+ARTIFACTS = ("pdf", "supporting_docs", "attachments_zip")
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_IMPORTED = "imported"  # มาจาก downloaded.log เดิม (ไม่มีรายละเอียดไฟล์)
+STATUS_STALE = "stale"        # record / attachment เปลี่ยนหลัง export ต้องดึงใหม่ (--since-last-run)
+COMPLETE_STATUSES = (STATUS_DONE, STATUS_IMPORTED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    number          TEXT PRIMARY KEY,
+    sys_id          TEXT,
+    cab_date        TEXT,
+    sys_updated_on  TEXT,
+    first_seen      TEXT NOT NULL,
+    updated_at      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    number       TEXT NOT NULL,
+    artifact     TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    bytes        INTEGER,
+    sha256       TEXT,
+    files        INTEGER,
+    duration_ms  INTEGER,
+    error        TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 1,
+    updated_at   TEXT NOT NULL,
+    PRIMARY KEY (number, artifact)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key    TEXT PRIMARY KEY,
+    value  TEXT
+);
+"""
+
+
+def now() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def digest_files(paths) -> tuple:
+    """Total size and sha256 of the given files (for several files: sha256 over name + per-file hash)"""
+    paths = sorted(Path(p) for p in paths)
+    total = 0
+    combined = hashlib.sha256()
+    single = None
+    for path in paths:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        total += path.stat().st_size
+        single = h.hexdigest()
+        combined.update(path.name.encode("utf-8") + b"\0" + single.encode("ascii"))
+    if len(paths) == 1:
+        return total, single
+    return total, combined.hexdigest() if paths else None
+
+
+class Manifest:
+    """Thread-safe wrapper around the manifest database (one connection guarded by a lock)"""
+
+    def __init__(self, path: Path = MANIFEST_DB):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ---------- meta ----------
+    def get_meta(self, key: str, default=None):
+        rows = self._execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else default
+
+    def set_meta(self, key: str, value: str):
+        self._execute("INSERT INTO meta(key, value) VALUES(?, ?) "
+                      "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    # ---------- import downloaded.log ----------
+    def import_logs(self, paths) -> int:
+        """Import change numbers from old downloaded.log files once (first run). Returns the number imported."""
+        if self.get_meta("imported_logs"):
+            return 0
+
+        numbers = set()
+        for path in paths:
+            path = Path(path)
+            if not path.exists():
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                numbers.update(line.strip() for line in f if line.strip())
+
+        stamp = now()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for number in numbers:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO changes(number, first_seen, updated_at) VALUES(?, ?, ?)",
+                    (number, stamp, stamp))
+                for artifact in ARTIFACTS:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO artifacts(number, artifact, status, error, updated_at) "
+                        "VALUES(?, ?, ?, ?, ?)",
+                        (number, artifact, STATUS_IMPORTED, "imported from downloaded.log", stamp))
+            self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES('imported_logs', ?)",
+                               (",".join(str(p) for p in paths),))
+            self._conn.execute("COMMIT")
+        return len(numbers)
+
+    # ---------- changes / artifacts ----------
+    def upsert_change(self, number: str, sys_id=None, cab_date=None, sys_updated_on=None):
+        stamp = now()
+        self._execute(
+            "INSERT INTO changes(number, sys_id, cab_date, sys_updated_on, first_seen, updated_at) "
+            "VALUES(?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(number) DO UPDATE SET "
+            "sys_id = COALESCE(excluded.sys_id, sys_id), "
+            "cab_date = COALESCE(excluded.cab_date, cab_date), "
+            "sys_updated_on = COALESCE(excluded.sys_updated_on, sys_updated_on), "
+            "updated_at = excluded.updated_at",
+            (number, sys_id, cab_date, sys_updated_on, stamp, stamp))
+
+    def record(self, number: str, artifact: str, status: str, bytes_=None, sha256=None,
+               files=None, duration_ms=None, error=None):
+        stamp = now()
+        self._execute(
+            "INSERT INTO artifacts(number, artifact, status, bytes, sha256, files, duration_ms, error, updated_at) "
+            "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(number, artifact) DO UPDATE SET "
+            "status = excluded.status, bytes = excluded.bytes, sha256 = excluded.sha256, "
+            "files = excluded.files, duration_ms = excluded.duration_ms, error = excluded.error, "
+            "attempts = attempts + 1, updated_at = excluded.updated_at",
+            (number, artifact, status, bytes_, sha256, files, duration_ms, error, stamp))
+
+    def record_stage(self, number: str, artifact: str, paths, error, duration_ms: float) -> str:
+        """Record a finished stage from the files it wrote and its error (None = success). Returns the status."""
+        paths = [p for p in paths if Path(p).exists()]
+        size, sha256 = digest_files(paths) if paths else (0, None)
+        status = STATUS_FAILED if error else STATUS_DONE
+        self.record(number, artifact, status, size, sha256, len(paths), int(duration_ms),
+                    str(error) if error else None)
+        return status
+
+    def invalidate(self, number: str, artifacts):
+        """Mark artifacts as stale so the next export of this change refreshes them"""
+        stamp = now()
+        for artifact in artifacts:
+            self._execute(
+                "INSERT INTO artifacts(number, artifact, status, attempts, updated_at) VALUES(?, ?, ?, 0, ?) "
+                "ON CONFLICT(number, artifact) DO UPDATE SET status = excluded.status, "
+                "updated_at = excluded.updated_at",
+                (number, artifact, STATUS_STALE, stamp))
+
+    def incomplete_changes(self) -> list:
+        """(number, sys_id) of known changes that still have a failed or stale artifact"""
+        placeholders = ",".join("?" * len(COMPLETE_STATUSES))
+        return self._execute(
+            f"SELECT DISTINCT a.number, c.sys_id FROM artifacts a LEFT JOIN changes c ON c.number = a.number "
+            f"WHERE a.status NOT IN ({placeholders})",
+            COMPLETE_STATUSES)
+
+    def pending_artifacts(self, number: str) -> list:
+        """Artifacts of this change that are not complete yet (all of them for an unknown change)"""
+        rows = self._execute("SELECT artifact, status FROM artifacts WHERE number = ?", (number,))
+        complete = {artifact for artifact, status in rows if status in COMPLETE_STATUSES}
+        return [a for a in ARTIFACTS if a not in complete]
+
+    def completed_numbers(self) -> set:
+        """Changes whose every artifact is complete"""
+        placeholders = ",".join("?" * len(COMPLETE_STATUSES))
+        rows = self._execute(
+            f"SELECT number FROM artifacts WHERE status IN ({placeholders}) "
+            f"GROUP BY number HAVING COUNT(DISTINCT artifact) = ?",
+            (*COMPLETE_STATUSES, len(ARTIFACTS)))
+        return {row[0] for row in rows}
+
+    def pending_among(self, numbers) -> list:
+        """The given numbers (in order) that are not complete yet - one query for a whole list page"""
+        numbers = list(numbers)
+        if not numbers:
+            return []
+        rows = self._execute(
+            f"SELECT number FROM artifacts WHERE number IN ({','.join('?' * len(numbers))}) "
+            f"AND status IN ({','.join('?' * len(COMPLETE_STATUSES))}) "
+            f"GROUP BY number HAVING COUNT(DISTINCT artifact) = ?",
+            (*numbers, *COMPLETE_STATUSES, len(ARTIFACTS)))
+        complete = {row[0] for row in rows}
+        return [n for n in numbers if n not in complete]
+
+    def total_bytes(self) -> int:
+        return self._execute("SELECT COALESCE(SUM(bytes), 0) FROM artifacts")[0][0]
+
+    def summary(self) -> list:
+        """Lines with artifact x status counts and bytes"""
+        rows = self._execute(
+            "SELECT artifact, status, COUNT(*), COALESCE(SUM(bytes), 0) FROM artifacts "
+            "GROUP BY artifact, status ORDER BY artifact, status")
+        return [f"  {artifact:<16} {status:<9} {count:>6}  {total:>15,} bytes"
+                for artifact, status, count, total in rows]
@@ -0,0 +1,153 @@
+"""
+ติดตามหน่วยความจำ (RSS) ของ Python และ Chromium ระหว่าง export และตัดสินใจว่าเมื่อไรควร recycle context
+
+Chromium ที่ Playwright เปิดเป็น process ลูกหลานของ process นี้ (driver -> browser -> renderer / gpu)
+จึงรวม RSS ของทุก process ลูกหลานเป็น "browser RSS" อ่านจาก /proc (Linux) หรือ ps (macOS)
+ถ้ามี psutil ติดตั้งอยู่จะใช้ psutil แทน (ไม่บังคับ)
+
+recycle เมื่อ (อย่างใดอย่างหนึ่ง):
+  - ทำครบ every_records record ตั้งแต่ recycle ครั้งก่อน
+  - browser RSS เกิน limit_mb (ทุก browser ของ run รวมกัน)
+"""
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+try:
+    import psutil
+except ImportError:  # optional
+    psutil = None
+
+DEFAULT_RECYCLE_EVERY = 250
+DEFAULT_LIMIT_MB = 3072
+SAMPLE_EVERY = 5          # sample ทุกกี่ record (อ่าน /proc ทั้งเครื่องใช้เวลาหลาย ms)
+MIN_RECORDS_BETWEEN = 10  # กัน recycle ถี่เกินเมื่อ RSS ยังสูงจาก browser ของ worker อื่น
+CURVE_POINTS = 12
+
+PROC = Path("/proc")
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024 if hasattr(os, "sysconf") else 4
+
+
+def process_table() -> dict:
+    """{pid: (ppid, rss_kb)} of every process on the machine"""
+    if psutil is not None:
+        table = {}
+        for proc in psutil.process_iter(["ppid", "memory_info"]):
+            info = proc.info
+            if info["memory_info"] is not None:
+                table[proc.pid] = (info["ppid"], info["memory_info"].rss // 1024)
+        return table
+
+    if (PROC / "self" / "stat").exists():
+        table = {}
+        for entry in PROC.iterdir():
+            if not entry.name.isdigit():
+                continue
+            try:
+                stat = (entry / "stat").read_text()
+                statm = (entry / "statm").read_text()
+            except OSError:
+                continue  # process จบไประหว่างอ่าน
+            # ชื่อ process ใน (...) อาจมีช่องว่าง ตัดจาก ')' ตัวสุดท้าย
+            ppid = int(stat.rsplit(")", 1)[1].split()[1])
+            table[int(entry.name)] = (ppid, int(statm.split()[1]) * PAGE_KB)
+        return table
+
+    output = subprocess.run(["ps", "-A", "-o", "pid=,ppid=,rss="], capture_output=True, text=True,
+                            timeout=10).stdout
+    table = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and all(p.isdigit() for p in parts):
+            table[int(parts[0])] = (int(parts[1]), int(parts[2]))
+    return table
+
+
+def rss_mb(pid: int = None) -> tuple:
+    """(RSS of pid, summed RSS of all its descendants) in MB - pid defaults to this process"""
+    pid = pid or os.getpid()
+    table = process_table()
+    children = {}
+    for child, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(child)
+
+    total, stack = 0, list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        total += table[child][1]
+        stack.extend(children.get(child, []))
+    own = table.get(pid, (0, 0))[1]
+    return own / 1024, total / 1024
+
+
+class MemoryMonitor:
+    """Samples Python / browser RSS and tells the export loops when to recycle their context"""
+
+    def __init__(self, every_records: int = DEFAULT_RECYCLE_EVERY, limit_mb: int = DEFAULT_LIMIT_MB,
+                 metrics=None):
+        self.every_records = every_records
+        self.limit_mb = limit_mb
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self.samples = []   # (elapsed_s, records, python_mb, browser_mb)
+        self.recycles = {}  # kind (records / memory) -> count
+        self.records = 0
+        self.started = time.perf_counter()
+
+    def sample(self):
+        try:
+            python_mb, browser_mb = rss_mb()
+        except Exception as e:
+            print(f"[WARN] Could not read memory usage: {e}")
+            return None
+        with self._lock:
+            self.samples.append((time.perf_counter() - self.started, self.records, python_mb, browser_mb))
+        if self.metrics is not None:
+            self.metrics.event("memory", records=self.records, python_mb=round(python_mb, 1),
+                               browser_mb=round(browser_mb, 1))
+        return python_mb, browser_mb
+
+    def check(self, records_since_recycle: int):
+        """Count one finished record. Returns the reason to recycle now, or None."""
+        with self._lock:
+            self.records += 1
+            sample_now = self.records % SAMPLE_EVERY == 0
+        if self.every_records and records_since_recycle >= self.every_records:
+            return self._recycled("records", f"{records_since_recycle} records")
+        if not sample_now:
+            return None
+        usage = self.sample()
+        if (usage and self.limit_mb and usage[1] > self.limit_mb
+                and records_since_recycle >= MIN_RECORDS_BETWEEN):
+            return self._recycled("memory", f"browser RSS {usage[1]:.0f} MB > {self.limit_mb} MB")
+        return None
+
+    def _recycled(self, kind: str, reason: str) -> str:
+        with self._lock:
+            self.recycles[kind] = self.recycles.get(kind, 0) + 1
+        if self.metrics is not None:
+            self.metrics.event("context_recycle", reason=reason, records=self.records)
+        return reason
+
+    def summary(self) -> list:
+        with self._lock:
+            samples = list(self.samples)
+            recycles = dict(self.recycles)
+        lines = [f"  recycles: {sum(recycles.values())} "
+                 f"({', '.join(f'{k} {v}' for k, v in sorted(recycles.items())) or 'none'}), "
+                 f"every {self.every_records or '-'} records / browser RSS > {self.limit_mb or '-'} MB"]
+        if not samples:
+            return lines
+        peak = max(samples, key=lambda s: s[3])
+        lines.append(f"  browser RSS peak {peak[3]:,.0f} MB at record {peak[1]}, "
+                     f"python RSS peak {max(s[2] for s in samples):,.0f} MB")
+        # ลดเหลือ CURVE_POINTS จุดเท่า ๆ กันตลอด run
+        points = samples[::max(1, len(samples) // CURVE_POINTS)]
+        if points[-1] is not samples[-1]:
+            points.append(samples[-1])
+        lines.append(f"  {'elapsed':>8} {'records':>8} {'python MB':>10} {'browser MB':>11}")
+        for elapsed, records, python_mb, browser_mb in points:
+            lines.append(f"  {elapsed:>7.0f}s {records:>8} {python_mb:>10,.0f} {browser_mb:>11,.0f}")
+        return lines
@@ -0,0 +1,153 @@
+"""
+Stage-level latency metrics ของการ export
+
+ทุก stage (list load, form ready, PDF, Supporting Documents, แต่ละไฟล์, Download All, go_back, next page)
+ถูกเขียนเป็น 1 บรรทัด JSON ลงไฟล์ metrics/run-*.jsonl และสรุป p50/p95/p99 ตอนจบ run
+และเขียน Prometheus textfile (สำหรับ node_exporter textfile collector) ได้ถ้าระบุ path
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_DIR = Path("metrics")
+PROM_PREFIX = "snow_export"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Metrics:
+    """Thread-safe stage timer. In-memory until start() opens the JSONL file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}  # stage -> [ms]
+        self._errors = {}   # stage -> count
+        self._bytes = {}    # stage -> total bytes
+        self._file = None
+        self.path = None
+        self.prom_path = None
+        self.started = time.time()
+        self.listeners = []  # callables(stage, ms, ok) - เช่น concurrency.AimdController.observe
+
+    def start(self, metrics_dir: Path = METRICS_DIR, prom_path=None):
+        metrics_dir = Path(metrics_dir)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        self.path = metrics_dir / f"run-{time.strftime('%Y%m%d-%H%M%S')}.jsonl"
+        self.prom_path = Path(prom_path) if prom_path else None
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.started = time.time()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self._file:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    def observe(self, stage: str, ms: float, ok: bool = True, bytes_: int = None, **labels):
+        """Record one stage duration"""
+        with self._lock:
+            self._samples.setdefault(stage, []).append(ms)
+            if not ok:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+            if bytes_:
+                self._bytes[stage] = self._bytes.get(stage, 0) + bytes_
+        record = {"ts": round(time.time(), 3), "stage": stage, "ms": round(ms, 1), "ok": ok,
+                  "thread": threading.current_thread().name}
+        if bytes_ is not None:
+            record["bytes"] = bytes_
+        record.update(labels)
+        self._write(record)
+        for listener in self.listeners:
+            listener(stage, ms, ok)
+
+    def event(self, kind: str, **fields):
+        """Record a non-timing event (written to JSONL only)"""
+        record = {"ts": round(time.time(), 3), "event": kind, "thread": threading.current_thread().name}
+        record.update(fields)
+        self._write(record)
+
+    @contextmanager
+    def stage(self, stage: str, **labels):
+        """Time a block; marks the sample as failed if the block raises"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000, ok, **labels)
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return {stage: (sorted(samples), self._errors.get(stage, 0), self._bytes.get(stage, 0))
+                    for stage, samples in self._samples.items()}
+
+    def summary(self) -> list:
+        lines = [f"  {'stage':<22} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'total':>10} {'errors':>6}"]
+        for stage, (samples, errors, _) in sorted(self._snapshot().items()):
+            p50, p95, p99 = (percentile(samples, q) for q in QUANTILES)
+            lines.append(f"  {stage:<22} {len(samples):>6} {p50:>7.0f}ms {p95:>7.0f}ms {p99:>7.0f}ms "
+                         f"{sum(samples) / 1000:>9.0f}s {errors:>6}")
+        return lines
+
+    def write_summary(self):
+        """Append the percentile summary to the JSONL file and write the Prometheus textfile"""
+        snapshot = self._snapshot()
+        for stage, (samples, errors, total_bytes) in sorted(snapshot.items()):
+            record = {"summary": stage, "count": len(samples), "errors": errors,
+                      "sum_ms": round(sum(samples), 1), "bytes": total_bytes}
+            for q in QUANTILES:
+                record[f"p{int(q * 100)}_ms"] = round(percentile(samples, q), 1)
+            self._write(record)
+        if self.prom_path:
+            self.write_prometheus(snapshot)
+
+    def write_prometheus(self, snapshot=None):
+        snapshot = snapshot if snapshot is not None else self._snapshot()
+        lines = [
+            f"# HELP {PROM_PREFIX}_stage_duration_seconds Duration of export stages in the last run",
+            f"# TYPE {PROM_PREFIX}_stage_duration_seconds summary",
+        ]
+        for stage, (samples, _, _) in sorted(snapshot.items()):
+            for q in QUANTILES:
+                lines.append(f'{PROM_PREFIX}_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f'{percentile(samples, q) / 1000:.3f}')
+            lines.append(f'{PROM_PREFIX}_stage_duration_seconds_sum{{stage="{stage}"}} {sum(samples) / 1000:.3f}')
+            lines.append(f'{PROM_PREFIX}_stage_duration_seconds_count{{stage="{stage}"}} {len(samples)}')
+        lines += [
+            f"# HELP {PROM_PREFIX}_stage_errors_total Failed stage executions in the last run",
+            f"# TYPE {PROM_PREFIX}_stage_errors_total counter",
+        ]
+        lines += [f'{PROM_PREFIX}_stage_errors_total{{stage="{stage}"}} {errors}'
+                  for stage, (_, errors, _) in sorted(snapshot.items())]
+        lines += [
+            f"# HELP {PROM_PREFIX}_stage_bytes_total Bytes transferred per stage in the last run",
+            f"# TYPE {PROM_PREFIX}_stage_bytes_total counter",
+        ]
+        lines += [f'{PROM_PREFIX}_stage_bytes_total{{stage="{stage}"}} {total_bytes}'
+                  for stage, (_, _, total_bytes) in sorted(snapshot.items())]
+        lines.append(f"{PROM_PREFIX}_last_run_timestamp_seconds {time.time():.0f}")
+
+        # textfile collector อ่านไฟล์ได้ตลอดเวลา ต้องเขียนไฟล์ชั่วคราวแล้ว rename
+        self.prom_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.prom_path.with_name(self.prom_path.name + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp, self.prom_path)
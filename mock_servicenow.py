@@ -0,0 +1,571 @@
+"""
+Mock ServiceNow instance สำหรับ benchmark / ทดสอบ 02_export_changes.py แบบ offline
+
+จำลองเฉพาะส่วนที่ exporter ใช้:
+  - classic shell (/now/nav/ui/classic/params/target/...) ที่มี iframe gsft_main
+  - change_request_list.do: table.list_table, a.linked.formlink, หัวคอลัมน์ CAB Date, ปุ่ม vcr_next
+  - change_request.do: g_form, Additional actions -> Export -> PDF (ok_button / download_button),
+    แท็บ Supporting Documents (a.attachment), Manage Attachments (download_all_button)
+  - change_request.do?PDF, sys_attachment.do (รองรับ Range / If-Range), download_all_attachments.do
+  - Table API (/api/now/table/change_request) และ Attachment API (/api/now/attachment)
+  - static assets (js/css/รูป/font) ที่มี ETag ให้ network filter / asset cache วัดผลได้
+
+latency และขนาดไฟล์ปรับได้ (MockConfig) ข้อมูลทุกอย่าง deterministic จาก record index
+
+การใช้งาน:
+    python mock_servicenow.py --port 8080 --records 200 --latency-ms 50
+"""
+import argparse
+import hashlib
+import html
+import io
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+SESSION_COOKIE = "JSESSIONID"
+SESSION_VALUE = "mock-session"
+USER_TOKEN = "mock-g-ck-token"
+
+BASE_DATE = datetime(2025, 1, 1, 8, 0, 0)
+ATTACHMENT_NAMES = ("UAT Signoff.pdf", "AppScan Report.pdf", "SDR Form.docx", "Design.xlsx", "Runbook.txt")
+ASSETS = {
+    # path -> (content type, kind)
+    "/scripts/js_includes_doctype.jsx": ("application/javascript", "script"),
+    "/styles/css_includes_doctype.cssx": ("text/css", "stylesheet"),
+    "/images/logos/logo_service-now.png": ("image/png", "image"),
+    "/fonts/source-sans-pro/SourceSansPro-Regular.woff2": ("font/woff2", "font"),
+}
+ASSET_VERSION = "1700000000000"
+CHUNK_SIZE = 64 * 1024
+
+
+class MockConfig:
+    """Size and latency knobs of the mock instance"""
+
+    def __init__(self, records: int = 100, page_size: int = 20, attachments_per_record: int = 3,
+                 latency_ms: int = 0, pdf_ms: int = 0, pdf_kb: int = 200, attachment_kb: int = 500,
+                 asset_kb: int = 300, require_session: bool = True):
+        self.records = records
+        self.page_size = page_size
+        self.attachments_per_record = attachments_per_record
+        self.latency_ms = latency_ms
+        self.pdf_ms = pdf_ms
+        self.pdf_kb = pdf_kb
+        self.attachment_kb = attachment_kb
+        self.asset_kb = asset_kb
+        self.require_session = require_session
+
+
+def make_sys_id(*parts) -> str:
+    return hashlib.md5(":".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def timestamp(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def filler_block(seed: str) -> bytes:
+    return (hashlib.sha256(seed.encode("utf-8")).hexdigest().encode("ascii") * (CHUNK_SIZE // 64 + 1))[:CHUNK_SIZE]
+
+
+def filler(size: int, prefix: bytes = b"", seed: str = ""):
+    """Yield size bytes (prefix + deterministic filler) in chunks"""
+    block = filler_block(seed)
+    remaining = size
+    if prefix:
+        yield prefix[:remaining]
+        remaining -= min(len(prefix), remaining)
+    while remaining > 0:
+        chunk = block[:remaining]
+        yield chunk
+        remaining -= len(chunk)
+
+
+def filler_range(seed: str, start: int, end: int):
+    """Bytes start..end (inclusive) of filler(size, seed=seed) - for Range requests"""
+    block = filler_block(seed)
+    position = start
+    while position <= end:
+        offset = position % CHUNK_SIZE
+        chunk = block[offset:offset + min(CHUNK_SIZE - offset, end + 1 - position)]
+        yield chunk
+        position += len(chunk)
+
+
+class MockData:
+    """Deterministic change_request + sys_attachment rows"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.changes = []
+        self.attachments = []
+        for i in range(config.records):
+            number = f"CHG{i + 1:07d}"
+            created = BASE_DATE + timedelta(hours=i)
+            change = {
+                "number": number,
+                "sys_id": make_sys_id("change_request", number),
+                # CAB date เพิ่มตาม number ทำให้การเรียง CAB Date (ใหม่ก่อน) เปลี่ยนแถวแรกของ list
+                "cab_date": (BASE_DATE + timedelta(days=i)).strftime("%Y-%m-%d"),
+                "sys_created_on": timestamp(created),
+                "sys_updated_on": timestamp(created + timedelta(minutes=30)),
+            }
+            self.changes.append(change)
+            for j in range(config.attachments_per_record):
+                name = ATTACHMENT_NAMES[(i + j) % len(ATTACHMENT_NAMES)]
+                self.attachments.append({
+                    "sys_id": make_sys_id("sys_attachment", number, j),
+                    "file_name": f"{number} {name}",
+                    "size_bytes": str(config.attachment_kb * 1024),
+                    "table_name": "change_request",
+                    "table_sys_id": change["sys_id"],
+                    "sys_created_on": timestamp(created + timedelta(minutes=j)),
+                })
+        self.by_sys_id = {c["sys_id"]: c for c in self.changes}
+        self.by_number = {c["number"]: c for c in self.changes}
+        self.attachment_by_sys_id = {a["sys_id"]: a for a in self.attachments}
+
+    def attachments_of(self, change_sys_id: str) -> list:
+        return [a for a in self.attachments if a["table_sys_id"] == change_sys_id]
+
+
+# ---------- encoded query ----------
+OPERATORS = ("NOT IN", "IN", ">=", "<=", "!=", ">", "<", "=")
+DATE_GENERATE = re.compile(r"javascript:gs\.dateGenerate\('([^']*)','([^']*)'\)")
+
+
+def parse_condition(term: str):
+    """'field>=value' -> (field, op, value)"""
+    for op in OPERATORS:
+        index = term.find(op)
+        if index > 0 and re.fullmatch(r"[a-z_.]+", term[:index]):
+            value = term[index + len(op):]
+            match = DATE_GENERATE.fullmatch(value)
+            if match:
+                value = f"{match.group(1)} {match.group(2)}"
+            return term[:index], op, value
+    return None
+
+
+def matches(record: dict, condition) -> bool:
+    field, op, value = condition
+    actual = str(record.get(field, ""))
+    if op in ("IN", "NOT IN"):
+        found = actual in value.split(",")
+        return found if op == "IN" else not found
+    return {
+        "=": actual == value, "!=": actual != value,
+        ">=": actual >= value, "<=": actual <= value,
+        ">": actual > value, "<": actual < value,
+    }[op]
+
+
+def apply_query(records: list, query: str) -> list:
+    """Filter and order records by a (subset of the) ServiceNow encoded query: AND terms, ^OR, ORDERBY"""
+    groups, order = [], []
+    for term in filter(None, query.split("^")):
+        if term.startswith("ORDERBYDESC"):
+            order.append((term[len("ORDERBYDESC"):], True))
+        elif term.startswith("ORDERBY"):
+            order.append((term[len("ORDERBY"):], False))
+        elif term.startswith("OR") and groups:
+            condition = parse_condition(term[2:])
+            if condition:
+                groups[-1].append(condition)
+        else:
+            condition = parse_condition(term)
+            if condition:
+                groups.append([condition])
+
+    result = [r for r in records if all(any(matches(r, c) for c in group) for group in groups)]
+    for field, descending in reversed(order):
+        result.sort(key=lambda r: str(r.get(field, "")), reverse=descending)
+    return result
+
+
+# ---------- HTML fixtures ----------
+def asset_tags() -> str:
+    return "\n".join([
+        f'<link rel="stylesheet" href="/styles/css_includes_doctype.cssx?v={ASSET_VERSION}">',
+        f'<script src="/scripts/js_includes_doctype.jsx?v={ASSET_VERSION}"></script>',
+        f'<img src="/images/logos/logo_service-now.png?v={ASSET_VERSION}" alt="" width="1" height="1">',
+        "<style>@font-face{font-family:SSP;src:url('/fonts/source-sans-pro/SourceSansPro-Regular.woff2')}"
+        " body{font-family:SSP}</style>",
+        '<script src="/analytics/beacon.js" async></script>',
+    ])
+
+
+def shell_page(target: str) -> str:
+    return f"""<!DOCTYPE html>
+<html><head><title>ServiceNow</title>{asset_tags()}</head>
+<body>
+<div class="polaris-header">mock</div>
+<iframe id="gsft_main" name="gsft_main" src="/{html.escape(target)}" style="width:100%;height:900px"></iframe>
+</body></html>"""
+
+
+def list_page(data: MockData, params: dict) -> str:
+    order = params.get("sysparm_order_desc", "") or ""
+    rows_per_page = int(params.get("sysparm_rows") or data.config.page_size)
+    first_row = max(1, int(params.get("sysparm_first_row") or 1))
+    query = params.get("sysparm_query", "") or ""
+    if order:
+        query = f"{query}^ORDERBYDESC{order}" if query else f"ORDERBYDESC{order}"
+    records = apply_query(data.changes, query)
+    page = records[first_row - 1:first_row - 1 + rows_per_page]
+
+    def list_url(**overrides) -> str:
+        merged = {"sysparm_view": "cab", "sysparm_rows": str(rows_per_page), "sysparm_first_row": str(first_row)}
+        if params.get("sysparm_query"):
+            merged["sysparm_query"] = params["sysparm_query"]
+        if order:
+            merged["sysparm_order_desc"] = order
+        merged.update(overrides)
+        return "/change_request_list.do?" + "&".join(f"{k}={quote(v, safe='')}" for k, v in merged.items())
+
+    rows = "\n".join(
+        f'<tr class="list_row"><td><a class="linked formlink" href="/change_request.do?sys_id={c["sys_id"]}">'
+        f'{c["number"]}</a></td><td>{c["cab_date"]}</td><td>{c["sys_updated_on"]}</td></tr>'
+        for c in page)
+    last_page = first_row - 1 + rows_per_page >= len(records)
+    next_url = list_url(sysparm_first_row=str(first_row + rows_per_page))
+    sort_url = list_url(sysparm_order_desc="cab_date", sysparm_first_row="1")
+    return f"""<!DOCTYPE html>
+<html><head><title>Change Requests</title>{asset_tags()}
+<script>window.g_ck = "{USER_TOKEN}";</script></head>
+<body>
+<table class="list_table" role="table">
+<thead><tr><th><a class="column_head" href="#">Number</a></th>
+<th><a class="column_head" href="{sort_url}">CAB Date</a></th>
+<th><a class="column_head" href="#">Updated</a></th></tr></thead>
+<tbody>
+{rows}
+</tbody></table>
+<div class="list_nav">{first_row} to {first_row - 1 + len(page)} of {len(records)}
+<button name="vcr_next" {"disabled" if last_page else ""}
+ onclick="location.href='{next_url}'">Next page</button></div>
+</body></html>"""
+
+
+def form_page(data: MockData, change: dict, pdf_ms: int) -> str:
+    attachments = data.attachments_of(change["sys_id"])
+    links = "\n".join(
+        f'<li><a class="attachment" href="/sys_attachment.do?sys_id={a["sys_id"]}">{html.escape(a["file_name"])}</a>'
+        f' <span class="attachment_size">({int(a["size_bytes"]) // 1024} KB)</span></li>'
+        for a in attachments)
+    download_all = ('<input type="button" id="download_all_button" value="Download All" '
+                    'onclick="downloadAllAttachments()">') if attachments else ""
+    return f"""<!DOCTYPE html>
+<html><head><title>{change["number"]} | Change Request</title>{asset_tags()}
+<script>
+window.g_ck = "{USER_TOKEN}";
+window.g_form = {{ getUniqueValue: function() {{ return "{change["sys_id"]}"; }},
+                   getValue: function(f) {{ return f === "number" ? "{change["number"]}" : ""; }} }};
+function show(id) {{ document.getElementById(id).style.display = "block"; }}
+function hide(id) {{ document.getElementById(id).style.display = "none"; }}
+function saveUrl(url) {{ const a = document.createElement("a"); a.href = url; a.download = "";
+                         document.body.appendChild(a); a.click(); a.remove(); }}
+function generatePdf() {{ setTimeout(function() {{ show("download_button"); }}, {pdf_ms}); }}
+function downloadAllAttachments() {{ saveUrl("/download_all_attachments.do?sysparm_sys_id={change["sys_id"]}"); }}
+</script></head>
+<body>
+<form id="change_request.do" action="/change_request.do" method="post">
+<button type="button" class="additional-actions-context-menu-button" aria-label="additional actions"
+ onclick="show('context_menu')">...</button>
+<button type="button" id="header_add_attachment" class="icon-paperclip" aria-label="Manage Attachments"
+ onclick="show('attachment_modal')">Attachments</button>
+<input type="text" id="change_request.number" value="{change["number"]}" readonly>
+<input type="text" id="change_request.cab_date" value="{change["cab_date"]}" readonly>
+</form>
+
+<div id="context_menu" style="display:none">
+  <div class="context_item" role="menuitem" data-context-menu-label="Export" item_id="context_exportmenu"
+   onmouseover="show('export_submenu')">Export</div>
+</div>
+<div id="export_submenu" style="display:none">
+  <div class="context_item" role="menuitem" onclick="show('pdf_dialog')">PDF</div>
+</div>
+<div id="pdf_dialog" style="display:none">
+  <button type="button" id="ok_button" onclick="generatePdf()">Export</button>
+  <button type="button" id="download_button" style="display:none"
+   onclick="saveUrl('/change_request.do?PDF&amp;sys_id={change["sys_id"]}')">Download</button>
+</div>
+
+<div class="tabs"><span class="tab_caption_text">Planning</span>
+<span class="tab_caption_text">Supporting Documents</span></div>
+<ul class="supporting_documents">
+{links}
+</ul>
+
+<div id="attachment_modal" style="display:none">
+  {download_all}
+  <button type="button" id="attachment_closemodal" onclick="hide('attachment_modal')">Close</button>
+</div>
+</body></html>"""
+
+
+def attachments_zip(data: MockData, change_sys_id: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+        for a in data.attachments_of(change_sys_id):
+            zf.writestr(a["file_name"], b"".join(filler(int(a["size_bytes"]), seed=a["sys_id"])))
+    return buffer.getvalue()
+
+
+# ---------- server ----------
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockServiceNow/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def data(self) -> MockData:
+        return self.server.data
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.data.config
+
+    def count(self, kind: str, size: int):
+        with self.server.lock:
+            stats = self.server.stats.setdefault(kind, [0, 0])
+            stats[0] += 1
+            stats[1] += size
+
+    def send_body(self, kind: str, body, content_type: str, status: int = 200, headers=None, size=None):
+        """body: bytes, str or an iterable of chunks with a known size"""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if isinstance(body, bytes):
+            size, body = len(body), [body]
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            for chunk in body:
+                self.wfile.write(chunk)
+        self.count(kind, size)
+
+    def redirect(self, location: str):
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.count("redirect", 0)
+
+    def has_session(self) -> bool:
+        cookies = self.headers.get("Cookie", "")
+        return f"{SESSION_COOKIE}={SESSION_VALUE}" in [c.strip() for c in cookies.split(";")]
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = re.sub(r"/+", "/", parts.path)
+        params = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+
+        if path in ASSETS or path.startswith("/analytics/"):
+            return self.serve_asset(path)
+        if path == "/login.do":
+            return self.send_body("login", "<html><body><form id='login'>Login</form></body></html>",
+                                  "text/html; charset=utf-8")
+        if self.config.require_session and not self.has_session():
+            if path.startswith("/api/"):
+                return self.send_body("api", json.dumps({"error": {"message": "User Not Authenticated"}}),
+                                      "application/json", status=401)
+            return self.redirect("/login.do")
+
+        if self.config.latency_ms:
+            time.sleep(self.config.latency_ms / 1000)
+
+        if path.startswith("/now/nav/ui/classic/params/target/"):
+            target = unquote(path[len("/now/nav/ui/classic/params/target/"):])
+            if parts.query:
+                target += "?" + parts.query
+            return self.send_body("shell", shell_page(target), "text/html; charset=utf-8")
+        if path == "/change_request_list.do":
+            return self.send_body("list", list_page(self.data, params), "text/html; charset=utf-8")
+        if path == "/change_request.do":
+            return self.serve_change(params)
+        if path == "/sys_attachment.do":
+            return self.serve_attachment(params.get("sys_id", ""))
+        if path == "/download_all_attachments.do":
+            change = self.data.by_sys_id.get(params.get("sysparm_sys_id", ""))
+            if not change:
+                return self.send_body("not_found", "Not found", "text/plain", status=404)
+            return self.send_body("download_all", attachments_zip(self.data, change["sys_id"]), "application/zip",
+                                  headers={"Content-Disposition": 'attachment; filename="attachments.zip"'})
+        if path == "/api/now/table/change_request":
+            return self.serve_api(self.data.changes, params)
+        if path == "/api/now/attachment":
+            return self.serve_api(self.data.attachments, params)
+        return self.send_body("not_found", "Not found", "text/plain", status=404)
+
+    def serve_change(self, params: dict):
+        sys_id = params.get("sys_id", "")
+        change = self.data.by_sys_id.get(sys_id)
+        if change is None and params.get("sysparm_query", "").startswith("number="):
+            change = self.data.by_number.get(params["sysparm_query"][len("number="):])
+        if change is None:
+            return self.send_body("not_found", "Record not found", "text/html", status=404)
+
+        if "PDF" in params:
+            if self.config.pdf_ms:
+                time.sleep(self.config.pdf_ms / 1000)
+            size = self.config.pdf_kb * 1024
+            return self.send_body("pdf", filler(size, b"%PDF-1.4\n", change["sys_id"]), "application/pdf",
+                                  headers={"Content-Disposition": f'attachment; filename="{change["number"]}.pdf"'},
+                                  size=size)
+        return self.send_body("form", form_page(self.data, change, self.config.pdf_ms), "text/html; charset=utf-8")
+
+    def serve_attachment(self, sys_id: str):
+        attachment = self.data.attachment_by_sys_id.get(sys_id)
+        if attachment is None:
+            return self.send_body("not_found", "Not found", "text/plain", status=404)
+        size = int(attachment["size_bytes"])
+        headers = {"Content-Disposition": f'attachment; filename="{attachment["file_name"]}"',
+                   "Accept-Ranges": "bytes", "ETag": f'"{sys_id}"'}
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and (if_range is None or if_range == headers["ETag"]):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                return self.send_body("attachment_range", b"", "application/octet-stream", status=416,
+                                      headers={"Content-Range": f"bytes */{size}"})
+            return self.send_body("attachment_range", filler_range(sys_id, start, end), "application/octet-stream",
+                                  status=206, size=end - start + 1,
+                                  headers=dict(headers, **{"Content-Range": f"bytes {start}-{end}/{size}"}))
+        return self.send_body("attachment", filler(size, seed=sys_id), "application/octet-stream",
+                              headers=headers, size=size)
+
+    def serve_asset(self, path: str):
+        content_type, kind = ASSETS.get(path, ("application/javascript", "analytics"))
+        etag = f'"{make_sys_id(path, ASSET_VERSION)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.count(f"asset_{kind}_304", 0)
+            return
+        size = self.config.asset_kb * 1024 if kind in ("script", "stylesheet") else 20 * 1024
+        body = filler(size, seed=path)
+        if kind in ("script", "stylesheet", "analytics"):
+            # js / css ที่ parse ได้ (comment ยาว size bytes)
+            body = itertools.chain(filler(size - 2, b"/*", seed=path), [b"*/"])
+        return self.send_body(f"asset_{kind}", body, content_type, size=size,
+                              headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    def serve_api(self, records: list, params: dict):
+        result = apply_query(records, params.get("sysparm_query", ""))
+        offset = int(params.get("sysparm_offset") or 0)
+        limit = int(params.get("sysparm_limit") or 10000)
+        result = result[offset:offset + limit]
+        if records is self.data.attachments:
+            host = self.headers.get("Host", "localhost")
+            result = [dict(r, download_link=f"http://{host}/sys_attachment.do?sys_id={r['sys_id']}") for r in result]
+        fields = [f for f in params.get("sysparm_fields", "").split(",") if f]
+        if fields:
+            result = [{f: r.get(f, "") for f in fields} for r in result]
+        return self.send_body("api", json.dumps({"result": result}), "application/json")
+
+
+class MockServiceNow(ThreadingHTTPServer):
+    """Threaded mock instance; use start()/stop() to run it in the background"""
+
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig, host: str = "127.0.0.1", port: int = 0, verbose: bool = False):
+        super().__init__((host, port), MockHandler)
+        self.data = MockData(config)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.stats = {}  # kind -> [requests, bytes]
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # client ปิด connection กลางคัน (เช่น probe ของ ranged download) ไม่ใช่ error ของ mock
+        if self.verbose or not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def storage_state(self) -> dict:
+        """Playwright storage_state with the session cookie the mock accepts"""
+        host = self.server_address[0]
+        return {
+            "cookies": [{"name": SESSION_COOKIE, "value": SESSION_VALUE, "domain": host, "path": "/",
+                         "expires": -1, "httpOnly": True, "secure": False, "sameSite": "Lax"}],
+            "origins": [],
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-servicenow", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def summary(self) -> list:
+        with self.lock:
+            return [f"  {kind:<22} {count:>7} req  {size:>15,} bytes"
+                    for kind, (count, size) in sorted(self.stats.items())]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock ServiceNow instance for the exporter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--records", type=int, default=100, help="number of change requests (default: 100)")
+    parser.add_argument("--page-size", type=int, default=20, help="rows per list page (default: 20)")
+    parser.add_argument("--attachments", type=int, default=3, help="attachments per change (default: 3)")
+    parser.add_argument("--latency-ms", type=int, default=0, help="added to every page / API response")
+    parser.add_argument("--pdf-ms", type=int, default=0, help="PDF generation time")
+    parser.add_argument("--pdf-kb", type=int, default=200)
+    parser.add_argument("--attachment-kb", type=int, default=500)
+    parser.add_argument("--asset-kb", type=int, default=300, help="size of the js/css bundles")
+    parser.add_argument("--state", help="write a matching Playwright storage_state to this path")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    config = MockConfig(args.records, args.page_size, args.attachments, args.latency_ms, args.pdf_ms,
+                        args.pdf_kb, args.attachment_kb, args.asset_kb)
+    server = MockServiceNow(config, args.host, args.port, args.verbose)
+    if args.state:
+        with open(args.state, "w", encoding="utf-8") as f:
+            json.dump(server.storage_state(), f, indent=2)
+        print(f"Saved storage state to {args.state}")
+    print(f"Mock ServiceNow at {server.base} ({args.records} changes)")
+    print(f"Run the exporter with: SNOW_BASE={server.base} SNOW_STATE={args.state or 'state.json'} "
+          f"python 02_export_changes.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\n".join(server.summary()))
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Route interception ที่ตัด request ที่ไม่จำเป็นต่อการ export ออก (รูป, font, media, analytics, live update)
+
+ติดตั้งบน BrowserContext ด้วย context.route("**/*") - request ที่ไม่ block จะถูกส่งต่อด้วย route.fallback()
+เพื่อให้ route handler ที่ลงทะเบียนไว้ก่อน (เช่น asset cache) ยังทำงานต่อได้
+ดังนั้นต้อง install filter *หลัง* handler อื่น (Playwright เรียก handler ที่ลงทะเบียนล่าสุดก่อน)
+
+URL ใน ALLOW_PATTERNS ไม่ถูก block เสมอ (gsft_main, GlideForm scripts, download endpoints)
+"""
+import re
+import threading
+
+# profile -> resource types ที่ abort
+PROFILES = {
+    "off": set(),
+    "safe": {"image", "font", "media"},
+    # aggressive: ตัด stylesheet ด้วย (visibility ของ menu / dialog ใน mock และ classic UI ยังใช้ inline style)
+    "aggressive": {"image", "font", "media", "stylesheet"},
+}
+DEFAULT_PROFILE = "safe"
+
+# URL ที่ abort ทุก profile ยกเว้น off: beacon / analytics / live update channel (AMB long polling)
+BLOCK_PATTERNS = [
+    r"/amb(/|$|\?)",
+    r"/analytics",
+    r"google-analytics\.com|googletagmanager\.com|doubleclick\.net",
+    r"/api/now/ui/(usage|appsee)",
+    r"/xmlstats\.do|/stats\.do",
+    r"/api/now/v1/batch\?.*sn_pendo|pendo\.io",
+]
+
+# ห้าม block เด็ดขาด
+ALLOW_PATTERNS = [
+    r"/change_request(_list)?\.do",
+    r"/now/nav/ui/classic/",
+    r"/sys_attachment\.do",
+    r"/download_all_attachments\.do",
+    r"/scripts/",
+    r"/api/now/(table|attachment)/",
+    r"/login\.do|/saml|/sso",
+]
+
+# ขนาดโดยประมาณต่อ resource type (ใช้ประเมิน bytes ที่ประหยัดได้ เพราะ request ที่ abort ไม่มี response)
+ESTIMATED_BYTES = {
+    "image": 15_000,
+    "font": 60_000,
+    "media": 250_000,
+    "stylesheet": 80_000,
+    "script": 40_000,
+    "xhr": 2_000,
+    "fetch": 2_000,
+    "eventsource": 1_000,
+    "websocket": 1_000,
+}
+
+
+class NetworkFilter:
+    """Decides which requests to abort and counts what was blocked (shared by all contexts of a run)"""
+
+    def __init__(self, profile: str = DEFAULT_PROFILE, block_patterns=(), allow_patterns=()):
+        self.profile = profile
+        self.blocked_types = set(PROFILES[profile])
+        patterns = BLOCK_PATTERNS + list(block_patterns) if profile != "off" else list(block_patterns)
+        self._block = re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+        self._allow = re.compile("|".join(f"(?:{p})" for p in ALLOW_PATTERNS + list(allow_patterns)))
+        self._lock = threading.Lock()
+        self.blocked = {}  # reason -> count
+        self.passed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.blocked_types) or self._block is not None
+
+    def decide(self, url: str, resource_type: str):
+        """Reason to block the request, or None to let it through"""
+        if self._allow.search(url):
+            return None
+        if resource_type in self.blocked_types:
+            return resource_type
+        if self._block is not None and self._block.search(url):
+            return f"pattern:{resource_type}"
+        return None
+
+    def _count(self, reason):
+        with self._lock:
+            if reason is None:
+                self.passed += 1
+            else:
+                self.blocked[reason] = self.blocked.get(reason, 0) + 1
+
+    def handle(self, route):
+        """Sync route handler"""
+        request = route.request
+        reason = self.decide(request.url, request.resource_type)
+        self._count(reason)
+        if reason is None:
+            route.fallback()
+        else:
+            route.abort("blockedbyclient")
+
+    async def handle_async(self, route):
+        """async_playwright route handler"""
+        request = route.request
+        reason = self.decide(request.url, request.resource_type)
+        self._count(reason)
+        if reason is None:
+            await route.fallback()
+        else:
+            await route.abort("blockedbyclient")
+
+    def install(self, context):
+        if self.enabled:
+            context.route("**/*", self.handle)
+
+    async def install_async(self, context):
+        if self.enabled:
+            await context.route("**/*", self.handle_async)
+
+    def estimated_bytes_saved(self) -> int:
+        with self._lock:
+            return sum(ESTIMATED_BYTES.get(reason.split(":")[-1], 5_000) * count
+                       for reason, count in self.blocked.items())
+
+    def summary(self) -> list:
+        with self._lock:
+            blocked = dict(self.blocked)
+            passed = self.passed
+        lines = [f"  profile {self.profile}: {sum(blocked.values())} blocked, {passed} passed, "
+                 f"~{self.estimated_bytes_saved():,} bytes saved (estimated)"]
+        lines += [f"  {reason:<22} {count:>7}" for reason, count in sorted(blocked.items())]
+        return lines
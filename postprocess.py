@@ -0,0 +1,123 @@
+"""
+แตก attachments_all.zip (Download All) และจัดไฟล์เข้าโฟลเดอร์ตามประเภทใน process pool แยก
+
+browser ไปเปิด record ถัดไปได้ทันทีหลังโหลด zip เสร็จ งาน CPU / disk ของการแตก zip ไม่ไปถ่วง stage ที่รอ browser
+  - child process: stream-extract zip เข้า <CHG>/Attachment/ แล้ว link แต่ละไฟล์เข้า
+    UAT Signoff / AppScan / CRFile / Supporting Documents ตาม classify_attachment (กฎเดียวกับ Supporting Documents)
+    ขนาด / sha256 ของไฟล์ที่จัดแล้วก็คำนวณใน child ด้วย
+  - process หลัก (callback): บันทึกผลลง manifest เป็น artifact supporting_docs
+    ไฟล์ที่ form บอกว่ามีแต่ไม่อยู่ใน zip -> supporting_docs failed (ทำใหม่ตอน resume)
+    zip เสียแตกไม่ได้ -> attachments_zip failed ด้วย (โหลด zip ใหม่ตอน resume)
+ใช้ spawn ไม่ใช้ fork: process หลักมี thread ของ Playwright อยู่
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from attachments import ATTACHMENT_DIR, category_path, extract_zip, link_or_copy
+from manifest import STATUS_DONE, STATUS_FAILED, digest_files
+
+DEFAULT_UNPACK_WORKERS = 2
+
+
+def unpack_and_route(folder: str, zip_path: str, expected=()) -> dict:
+    """Runs in a pool process: extract zip_path into folder/Attachment and link each entry into its category
+
+    expected: the form's attachments (filename + assign_names' "name")
+    """
+    start = time.perf_counter()
+    folder = Path(folder)
+    extracted = extract_zip(Path(zip_path), folder / ATTACHMENT_DIR, expected)
+    routed = [link_or_copy(path, category_path(folder, path.name)) for path in extracted]
+    names = {path.name for path in extracted}
+    size, sha256 = digest_files(routed) if routed else (0, None)
+    return {
+        "extracted": [str(path) for path in extracted],
+        "routed": [str(path) for path in routed],
+        "bytes": size,
+        "sha256": sha256,
+        "missing": [attachment["filename"] for attachment in expected if attachment["name"] not in names],
+        "duration_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+class PostProcessor:
+    """Hands Download All zips to a process pool and records the routed files in the manifest"""
+
+    def __init__(self, manifest=None, workers: int = DEFAULT_UNPACK_WORKERS, metrics=None):
+        self.manifest = manifest
+        self.metrics = metrics
+        self._pool = None
+        if workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.submitted = 0
+        self.done = 0
+        self.failed = 0
+        self.files = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._pool is not None
+
+    def submit(self, number: str, folder: Path, zip_path: Path, expected=()) -> bool:
+        """Queue zip_path for unpacking. False when the pool is off (the caller unpacks inline)."""
+        if self._pool is None:
+            return False
+        queued = time.perf_counter()
+        future = self._pool.submit(unpack_and_route, str(folder), str(zip_path), tuple(expected))
+        with self._lock:
+            self._pending.add(future)
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._finished(number, Path(zip_path), queued, f))
+        return True
+
+    def _finished(self, number: str, zip_path: Path, queued: float, future):
+        # callback ทำงานใน thread ของ executor - manifest มี lock ของตัวเอง
+        with self._lock:
+            self._pending.discard(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            error = f"unpack {zip_path.name}: {e}"
+            print(f"[WARN] {number}: {error}")
+            with self._lock:
+                self.failed += 1
+            if self.manifest is not None:
+                for artifact in ("supporting_docs", "attachments_zip"):
+                    self.manifest.record(number, artifact, STATUS_FAILED, error=error)
+            return
+
+        error = None
+        if result["missing"]:
+            error = f"not in {zip_path.name}: {', '.join(result['missing'])}"
+            print(f"[WARN] {number}: {error}")
+        with self._lock:
+            self.done += 1
+            self.files += len(result["extracted"])
+        if self.manifest is not None:
+            self.manifest.record(number, "supporting_docs", STATUS_FAILED if error else STATUS_DONE,
+                                 result["bytes"], result["sha256"], len(result["routed"]),
+                                 int(result["duration_ms"]), error)
+        if self.metrics is not None:
+            self.metrics.observe("unpack", result["duration_ms"], error is None, number=number)
+            self.metrics.observe("unpack_queue", (time.perf_counter() - queued) * 1000 - result["duration_ms"],
+                                 True, number=number)
+        print(f"✓ {number}: {len(result['extracted'])} file(s) unpacked from {zip_path.name} and routed")
+
+    def close(self):
+        """Wait for every queued zip, then stop the pool"""
+        if self._pool is None:
+            return
+        with self._lock:
+            pending = len(self._pending)
+        if pending:
+            print(f"[INFO] Waiting for {pending} zip(s) still unpacking...")
+        self._pool.shutdown(wait=True)
+
+    def summary(self) -> list:
+        return [f"  zips: {self.submitted} queued, {self.done} unpacked, {self.failed} failed, "
+                f"{self.files} file(s) routed"]
@@ -0,0 +1,233 @@
+"""
+คิว retry ของ record ที่ fail + circuit breaker ที่พัก worker ทุกตัวเมื่อ error พุ่ง
+
+เดิม record ที่ fail แค่ [WARN] แล้วข้ามไป (ค้างใน manifest จนกว่าจะรันใหม่) และช่วงที่ instance ช้า / ตอบ 429 / 503
+worker ทุกตัวก็ยังยิงต่อ - record หลายร้อยตัวค้างเงียบ ๆ และ instance ยิ่งช้า
+
+  - RetryQueue: record ที่ fail (เปิด form ไม่ได้ หรือบาง artifact failed) ถูกเก็บพร้อมเวลาที่ลองใหม่ได้
+    (exponential backoff + jitter) แล้วลองใหม่ตอนท้าย run
+    process_record ทำเฉพาะ artifact ที่ยัง pending ใน manifest -> retry ระดับ artifact ในตัว
+    ลองครบ max_attempts แล้วยัง fail -> ปล่อยไว้ pending ให้ resume รอบหน้า
+  - CircuitBreaker: ดูผลของ record ล่าสุด window ตัว ถ้า error rate >= threshold (หรือ server ตอบ 429 / 503)
+    -> open: worker ทุกตัวหยุดรอที่ wait() จนครบ cooldown
+    -> half-open: ปล่อย record เดียวไปลอง สำเร็จ = closed, fail = open อีกรอบด้วย cooldown x 2 (ไม่เกิน max)
+       wait() คืน token ให้ probe แล้ว record(ok, probe) ต้องส่ง token นั้นกลับมา - ผลของ record อื่นที่ยังค้างอยู่
+       (เริ่มก่อนวงจรเปิด) ไม่ปิด / ไม่เปิดวงจร
+  - retry_call: ลองซ้ำแบบ backoff สำหรับงานสั้น ๆ ที่ fail ไม่ควรจบ run (โหลดหน้า list, vcr_next)
+"""
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+from auth import SessionExpired
+
+MAX_ATTEMPTS = 3
+BASE_DELAY_S = 30
+MAX_DELAY_S = 10 * 60
+CALL_ATTEMPTS = 4
+CALL_BASE_DELAY_S = 5
+
+ERROR_THRESHOLD = 0.5
+WINDOW = 20
+MIN_SAMPLES = 8
+COOLDOWN_S = 60
+MAX_COOLDOWN_S = 15 * 60
+THROTTLE_STATUSES = (429, 503)
+
+
+def backoff_delay(attempt: int, base_s: float = BASE_DELAY_S, max_s: float = MAX_DELAY_S) -> float:
+    """Exponential backoff for the attempt-th retry (1-based) with jitter, so workers don't retry in lockstep"""
+    delay = min(max_s, base_s * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def retry_call(fn, what: str, attempts: int = CALL_ATTEMPTS, base_s: float = CALL_BASE_DELAY_S):
+    """fn() with up to attempts tries and backoff between them. SessionExpired is not retried here
+    (the caller re-authenticates); the last error is re-raised."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except SessionExpired:
+            raise
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff_delay(attempt, base_s)
+            print(f"[WARN] {what} failed ({e}) - retry {attempt}/{attempts - 1} in {delay:.0f}s")
+            time.sleep(delay)
+
+
+class RetryQueue:
+    """Failed records waiting for their backoff to expire; drained at the end of the run"""
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, base_s: float = BASE_DELAY_S, max_s: float = MAX_DELAY_S):
+        self.max_attempts = max_attempts
+        self.base_s = base_s
+        self.max_s = max_s
+        self._lock = threading.Lock()
+        self._waiting = {}   # number -> (due, item)
+        self.attempts = {}   # number -> retries queued so far
+        self.requeued = 0
+        self.recovered = 0
+        self.gave_up = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._waiting)
+
+    def add(self, item: dict, reason: str = "") -> bool:
+        """Queue item for another try. False when it has used up its retries (left pending for the next run)."""
+        number = item["number"]
+        with self._lock:
+            attempt = self.attempts.get(number, 0) + 1
+            if attempt > self.max_attempts:
+                self.gave_up += 1
+                if self.max_attempts:
+                    print(f"[WARN] {number}: still failing after {self.max_attempts} retr(ies) - "
+                          f"left pending for the next run")
+                else:
+                    print(f"[WARN] {number}: failed (retries off) - left pending for the next run")
+                return False
+            self.attempts[number] = attempt
+            delay = backoff_delay(attempt, self.base_s, self.max_s)
+            self._waiting[number] = (time.monotonic() + delay, item)
+            self.requeued += 1
+        print(f"[INFO] {number}: retry {attempt}/{self.max_attempts} queued (not before {delay:.0f}s)"
+              + (f" - {reason}" if reason else ""))
+        return True
+
+    def succeeded(self, number: str):
+        with self._lock:
+            if number in self.attempts:
+                self.recovered += 1
+
+    def next_batch(self) -> list:
+        """Wait until the earliest queued record is due, then take every due record. [] when the queue is empty."""
+        with self._lock:
+            if not self._waiting:
+                return []
+            wait = min(due for due, _ in self._waiting.values()) - time.monotonic()
+        if wait > 0:
+            print(f"[INFO] Waiting {wait:.0f}s before retrying failed change(s)")
+            time.sleep(wait)
+        now = time.monotonic()
+        with self._lock:
+            due = [number for number, (at, _) in self._waiting.items() if at <= now]
+            return [self._waiting.pop(number)[1] for number in due]
+
+    def summary(self) -> list:
+        return [f"  {self.requeued} retr(ies) queued, {self.recovered} change(s) recovered, "
+                f"{self.gave_up} gave up (pending for the next run)"]
+
+
+class CircuitBreaker:
+    """Pauses every worker while the recent error rate is too high, then lets one probe record through"""
+
+    def __init__(self, threshold: float = ERROR_THRESHOLD, window: int = WINDOW, min_samples: int = MIN_SAMPLES,
+                 cooldown_s: float = COOLDOWN_S, max_cooldown_s: float = MAX_COOLDOWN_S, metrics=None):
+        self.threshold = threshold
+        self.min_samples = min(min_samples, window)
+        self.cooldown_s = cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._results = deque(maxlen=window)
+        self.state = "closed"
+        self._cooldown = cooldown_s
+        self._open_until = 0.0
+        self._probe_started = None
+        self._probe = None                 # token ของ probe ปัจจุบัน (half-open)
+        self._tokens = itertools.count(1)
+        self.trips = 0
+        self.paused_s = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def wait(self, probe=None):
+        """Block while the circuit is open (called before each record). Returns a probe token when the caller
+        is the half-open probe - pass it to record(), and back to wait() when retrying the same record."""
+        if not self.enabled:
+            return None
+        with self._cond:
+            if probe is not None and probe == self._probe and self.state == "half_open":
+                return probe  # probe เดิมลองใหม่ (เช่นหลัง login ใหม่) - ไม่ต้องรอตัวเอง
+            while self.state != "closed":
+                now = time.monotonic()
+                if self.state == "open":
+                    if now < self._open_until:
+                        self._cond.wait(self._open_until - now)
+                        continue
+                    self.state = "half_open"
+                    self._probe_started = None
+                    self._probe = None
+                    print("[INFO] Circuit half-open - trying one record")
+                    self._event("circuit_half_open")
+                # half-open: record เดียวไปลอง ที่เหลือรอผล (probe ไม่รายงานผลภายใน cooldown -> ปล่อยตัวใหม่)
+                if self._probe_started is None or now - self._probe_started > self._cooldown:
+                    self._probe_started = now
+                    self._probe = next(self._tokens)
+                    return self._probe
+                self._cond.wait(self._cooldown)
+            return None
+
+    def record(self, ok: bool, probe=None):
+        """Outcome of one record (probe: the token wait() returned for it, if any)"""
+        if not self.enabled:
+            return
+        with self._cond:
+            if self.state == "half_open":
+                if probe is None or probe != self._probe:
+                    return  # record ที่เริ่มก่อนวงจรเปิด หรือ probe ที่หมดเวลาไปแล้ว - ไม่ใช่ผลของ probe
+                self._probe = None
+                if ok:
+                    self.state = "closed"
+                    self._cooldown = self.cooldown_s
+                    self._results.clear()
+                    print("[INFO] Circuit closed - resuming all workers")
+                    self._event("circuit_closed")
+                    self._cond.notify_all()
+                else:
+                    self._trip("probe record failed", min(self._cooldown * 2, self.max_cooldown_s))
+                return
+            if self.state == "open":
+                return  # record ที่เริ่มก่อนวงจรเปิด
+            self._results.append(ok)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_samples and failures / len(self._results) >= self.threshold:
+                self._trip(f"{failures}/{len(self._results)} recent records failed", self._cooldown)
+
+    def throttled(self, status: int, retry_after: float = 0):
+        """The server answered 429 / 503: open now (for at least Retry-After)"""
+        if not self.enabled:
+            return
+        with self._cond:
+            cooldown = max(self._cooldown, retry_after)
+            if self.state == "open":
+                self._open_until = max(self._open_until, time.monotonic() + cooldown)
+                return
+            self._trip(f"server answered HTTP {status}", cooldown)
+
+    def _trip(self, reason: str, cooldown: float):
+        # เรียกขณะถือ _cond
+        self.state = "open"
+        self._cooldown = cooldown
+        self._open_until = time.monotonic() + cooldown
+        self._results.clear()
+        self.trips += 1
+        self.paused_s += cooldown
+        print(f"[WARN] Circuit open: {reason} - pausing all workers for {cooldown:.0f}s")
+        self._event("circuit_open", reason=reason, cooldown_s=round(cooldown))
+        self._cond.notify_all()
+
+    def _event(self, kind: str, **fields):
+        if self.metrics is not None:
+            self.metrics.event(kind, **fields)
+
+    def summary(self) -> list:
+        if not self.enabled:
+            return ["  off"]
+        return [f"  opened {self.trips} time(s), ~{self.paused_s:.0f}s paused, state {self.state}"]
@@ -0,0 +1,163 @@
+"""
+เรียนรู้ว่า selector / context (frame หรือ page) ไหนเจอ element ของ UI บน instance นี้ แล้วลองอันนั้นก่อน
+
+ปุ่มของ ServiceNow (เมนู Export, ok_button, download_button, header_add_attachment, download_all_button,
+attachment_closemodal ...) อยู่ใน gsft_main บ้าง อยู่บน page หลักบ้าง แล้วแต่ UI / release ของ instance
+เดิมไล่ count() ตาม chain ทุก record - registry จำ strategy ที่ชนะแล้วเรียงให้ลองก่อน (ปกติเหลือ probe เดียว)
+
+  - strategy = (context, selector) ตาม ELEMENTS
+  - ชนะ: hits + 1 / ถูกลองก่อนตัวที่ชนะแต่ไม่เจอ: misses + 1 และ streak + 1
+    (ไม่เจอสักตัว = element ไม่มีในหน้านี้ เช่น record ไม่มีไฟล์แนบ - ไม่นับเป็น miss ของใคร)
+  - miss ติดกัน DEMOTE_AFTER ครั้ง -> ย้ายไปท้ายแถว (กลับมาได้เมื่อชนะอีกครั้ง)
+สถิติเก็บใน selector_stats.json แยกตาม instance (DEV / PRD ใช้ไฟล์เดียวกันได้ ลำดับไม่ปนกัน)
+"""
+import json
+import os
+import threading
+from pathlib import Path
+
+SELECTOR_STATS = Path("selector_stats.json")
+DEMOTE_AFTER = 3
+
+ACTIONS_BUTTON = 'button.additional-actions-context-menu-button[aria-label="additional actions"]'
+EXPORT_MENU = 'div.context_item[role="menuitem"][data-context-menu-label="Export"]'
+EXPORT_MENU_ID = 'div.context_item[item_id="context_exportmenu"]'
+DOWNLOAD_ALL = "input#download_all_button"
+DOWNLOAD_ALL_ONCLICK = 'input[onclick*="downloadAllAttachments"]'
+
+# element -> strategy ตามลำดับเริ่มต้น (ลำดับของ chain เดิม)
+ELEMENTS = {
+    "additional_actions": [("frame", ACTIONS_BUTTON), ("page", ACTIONS_BUTTON)],
+    "export_menu": [
+        ("frame", EXPORT_MENU), ("frame", EXPORT_MENU_ID),
+        ("page", EXPORT_MENU), ("page", EXPORT_MENU_ID),
+    ],
+    "ok_button": [("frame", "button#ok_button"), ("page", "button#ok_button")],
+    "download_button": [("frame", "button#download_button"), ("page", "button#download_button")],
+    "header_add_attachment": [
+        ("frame", "button#header_add_attachment"),
+        ("frame", 'button.icon-paperclip[aria-label="Manage Attachments"]'),
+        ("page", "button#header_add_attachment"),
+    ],
+    "download_all_button": [
+        ("page", DOWNLOAD_ALL), ("frame", DOWNLOAD_ALL),
+        ("page", DOWNLOAD_ALL_ONCLICK), ("frame", DOWNLOAD_ALL_ONCLICK),
+    ],
+    "attachment_closemodal": [
+        ("page", "button#attachment_closemodal"), ("frame", "button#attachment_closemodal"),
+        ("frame", 'button[data-dismiss="GlideModal"].close'),
+    ],
+}
+
+
+def strategy_key(context: str, selector: str) -> str:
+    return f"{context}:{selector}"
+
+
+class SelectorRegistry:
+    """Per-instance learned ordering of the locator strategies of each UI element"""
+
+    def __init__(self, instance: str, path: Path = SELECTOR_STATS):
+        self.instance = instance
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._all = {}
+        if self.path is not None and self.path.exists():
+            try:
+                self._all = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Ignoring unreadable {self.path}: {e}")
+        # element -> strategy key -> {"hits", "misses", "streak"}
+        self.stats = self._all.setdefault(instance, {})
+        self.lookups = {}  # element -> [lookups, found, found on the first try] (run นี้)
+
+    def _entry(self, element: str, key: str) -> dict:
+        return self.stats.setdefault(element, {}).setdefault(key, {"hits": 0, "misses": 0, "streak": 0})
+
+    def ordered(self, element: str) -> list:
+        """Strategies of element, best first: demoted last, then most hits, then the default order"""
+        strategies = ELEMENTS[element]
+        with self._lock:
+            learned = self.stats.get(element, {})
+
+            def rank(item):
+                index, (context, selector) = item
+                entry = learned.get(strategy_key(context, selector), {})
+                return entry.get("streak", 0) >= DEMOTE_AFTER, -entry.get("hits", 0), index
+
+            return [strategy for _, strategy in sorted(enumerate(strategies), key=rank)]
+
+    def locators(self, element: str, page, frame) -> list:
+        """[(strategy key, locator)] in learned order"""
+        targets = {"page": page, "frame": frame}
+        return [(strategy_key(context, selector), targets[context].locator(selector).first)
+                for context, selector in self.ordered(element)]
+
+    def _record(self, element: str, tried: list, winner):
+        """tried: keys probed before winner (None = nothing matched)"""
+        with self._lock:
+            counts = self.lookups.setdefault(element, [0, 0, 0])
+            counts[0] += 1
+            if winner is None:
+                return
+            for key in tried:
+                entry = self._entry(element, key)
+                entry["misses"] += 1
+                entry["streak"] += 1
+            entry = self._entry(element, winner)
+            entry["hits"] += 1
+            entry["streak"] = 0
+            counts[1] += 1
+            counts[2] += not tried
+
+    def find(self, element: str, page, frame):
+        """First strategy whose locator matches right now (count() probes in learned order), or None"""
+        tried = []
+        for key, locator in self.locators(element, page, frame):
+            try:
+                found = locator.count() > 0
+            except Exception:
+                found = False
+            if found:
+                self._record(element, tried, key)
+                return locator
+            tried.append(key)
+        self._record(element, tried, None)
+        return None
+
+    def first_visible(self, waiter, stage: str, element: str, page, frame, raise_on_timeout: bool = True):
+        """waiter.first_visible over element's strategies in learned order, recording the winner"""
+        candidates = self.locators(element, page, frame)
+        keys = [key for key, _ in candidates]
+        try:
+            winner = waiter.first_visible(stage, [locator for _, locator in candidates], raise_on_timeout)
+        except Exception:
+            self._record(element, keys, None)
+            raise
+        for i, (key, locator) in enumerate(candidates):
+            if locator is winner:
+                self._record(element, keys[:i], key)
+                return winner
+        self._record(element, keys, None)
+        return None
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            text = json.dumps(self._all, indent=1, sort_keys=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def summary(self) -> list:
+        """Per element: lookups this run, hit rate, first-try rate and the current best strategy"""
+        lines = []
+        for element in ELEMENTS:
+            lookups, found, first = self.lookups.get(element, (0, 0, 0))
+            if not lookups:
+                continue
+            context, selector = self.ordered(element)[0]
+            lines.append(f"  {element:<22} n={lookups:<5} found {found / lookups:5.0%}  "
+                         f"first try {first / lookups:5.0%}  best {context}: {selector}")
+        return lines
@@ -0,0 +1,135 @@
+"""
+หลาย authenticated session (storage state) สำหรับกระจาย context ของ exporter
+
+ServiceNow ทำ transaction ของ session เดียวกันทีละอัน (session lock) การเปิดหลาย tab บน state.json เดียว
+จึงช่วยได้ไม่มาก - บันทึกหลาย session ด้วย 01_login_save_state.py --name <ชื่อ> (เช่น service account ละชื่อ)
+แล้วให้ exporter กระจาย context ไปตาม session:
+
+  - แต่ละ session รับ context พร้อมกันได้ไม่เกิน limit (--session-limit)
+  - session ที่ fail ติดกัน MAX_CONSECUTIVE_FAILURES ครั้ง ถูกพักไว้ COOLDOWN_S วินาที
+    context ที่ใช้ session นั้นอยู่จะย้ายไป session อื่นที่ยังว่าง
+"""
+import threading
+import time
+from pathlib import Path
+
+STATES_DIR = Path("states")
+DEFAULT_SESSION_LIMIT = 2
+MAX_CONSECUTIVE_FAILURES = 3
+COOLDOWN_S = 300
+
+
+def state_path(name: str) -> Path:
+    return STATES_DIR / f"{name}.json"
+
+
+def resolve_states(names: str, default_state: str) -> list:
+    """[(name, path)] for --sessions: "a,b", "all" (every states/*.json) or empty (the single default state)"""
+    if not names:
+        return [("default", Path(default_state))]
+    if names == "all":
+        paths = sorted(STATES_DIR.glob("*.json"))
+        if not paths:
+            raise FileNotFoundError(f"No saved sessions in {STATES_DIR}/ - run 01_login_save_state.py --name NAME")
+        return [(path.stem, path) for path in paths]
+    states = [(name.strip(), state_path(name.strip())) for name in names.split(",") if name.strip()]
+    missing = [str(path) for _, path in states if not path.exists()]
+    if missing:
+        raise FileNotFoundError(f"Session state not found: {', '.join(missing)}")
+    return states
+
+
+class Session:
+    """One saved storage state and its health"""
+
+    def __init__(self, name: str, path: Path, limit: int):
+        self.name = name
+        self.path = Path(path)
+        self.limit = limit
+        self.in_use = 0
+        self.ok = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.cooldowns = 0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    @property
+    def state(self) -> str:
+        return str(self.path)
+
+
+class SessionPool:
+    """Hands out sessions to contexts: least loaded healthy session first, at most `limit` contexts each"""
+
+    def __init__(self, states, limit: int = DEFAULT_SESSION_LIMIT):
+        self.sessions = [Session(name, path, limit) for name, path in states]
+        self._cond = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        return sum(s.limit for s in self.sessions)
+
+    def _pick(self, exclude=None):
+        free = [s for s in self.sessions if s.in_use < s.limit and s.healthy and s is not exclude]
+        return min(free, key=lambda s: (s.in_use, s.consecutive_failures), default=None)
+
+    def acquire(self, exclude=None, timeout: float = None) -> Session:
+        """Block until a session has a free slot. Returns None on timeout."""
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                session = self._pick(exclude) or (self._pick() if exclude is not None else None)
+                if session is not None:
+                    session.in_use += 1
+                    return session
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                # session ที่พักอยู่จะกลับมาเมื่อหมด cooldown - ตื่นมาเช็คเป็นระยะ
+                self._cond.wait(min(remaining or 5.0, 5.0))
+
+    def release(self, session: Session):
+        with self._cond:
+            session.in_use -= 1
+            self._cond.notify_all()
+
+    def report(self, session: Session, ok: bool) -> bool:
+        """Record the result of one record on session. Returns False when the session was just put on cooldown."""
+        with self._cond:
+            if ok:
+                session.ok += 1
+                session.consecutive_failures = 0
+                return True
+            session.failed += 1
+            session.consecutive_failures += 1
+            # session เดียวไม่มีที่ให้ย้ายไป - แค่นับไว้
+            if session.consecutive_failures < MAX_CONSECUTIVE_FAILURES or len(self.sessions) == 1:
+                return True
+            session.consecutive_failures = 0
+            session.cooldown_until = time.monotonic() + COOLDOWN_S
+            session.cooldowns += 1
+        print(f"[WARN] Session {session.name}: {MAX_CONSECUTIVE_FAILURES} failures in a row - "
+              f"resting it for {COOLDOWN_S}s")
+        return False
+
+    def switch(self, session: Session) -> Session:
+        """Give up session (put on cooldown) for another one with a free slot (the same one if none)"""
+        with self._cond:
+            other = self._pick(exclude=session)
+            if other is None:
+                # ทุก session อื่นเต็ม - ใช้ session เดิมต่อ ไม่รอจนหมด cooldown
+                return session
+            session.in_use -= 1
+            other.in_use += 1
+            self._cond.notify_all()
+            return other
+
+    def summary(self) -> list:
+        with self._cond:
+            return [f"  {s.name:<16} limit {s.limit}  ok {s.ok:>6}  failed {s.failed:>5}  "
+                    f"cooldowns {s.cooldowns}{'' if s.healthy else '  (resting)'}"
+                    for s in self.sessions]
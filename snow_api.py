@@ -0,0 +1,226 @@
+"""
+ServiceNow REST helpers (Table API / Attachment API) ที่ใช้ session เดียวกับ browser
+
+ใช้ Playwright APIRequestContext (context.request) ซึ่งแชร์ cookies จาก state.json
+ทำให้ไม่ต้องเปิดหน้า list แล้วอ่านทีละ row
+"""
+import re
+from datetime import datetime, timedelta
+
+API_PAGE_SIZE = 1000
+SINCE_OVERLAP_HOURS = 14
+
+# encoded query ไปอยู่ใน URL ของ GET (list / Table API) - เกิน ~8 KB instance จะตอบ 414 / ตัดทิ้ง
+MAX_QUERY_CHARS = 6000
+NOT_IN_CHUNK = 200
+RANGE_MIN = 3  # เลขติดกันตั้งแต่กี่ตัวถึงเขียนเป็นช่วง (field<first^ORfield>last)
+NUMBER_PATTERN = re.compile(r"^(\D*)(\d+)$")
+
+# field CAB Date ใน view "cab" (ใช้เรียงแบบเดียวกับการคลิกหัวคอลัมน์ CAB Date)
+CAB_DATE_FIELD = "cab_date"
+CHANGE_FIELDS = ("number", "sys_id", CAB_DATE_FIELD, "sys_updated_on")
+TIE_BREAKER = "ORDERBYsys_id"  # ลำดับสุดท้ายของทุก query ที่ page ด้วย offset (ค่า unique)
+ATTACHMENT_FIELDS = ("sys_id", "file_name", "size_bytes", "table_sys_id", "sys_created_on", "download_link")
+
+
+class ApiError(Exception):
+    """Raised when the REST API returns a non-2xx status or a non-JSON body"""
+
+    def __init__(self, status: int, url: str, message: str = ""):
+        self.status = status
+        self.url = url
+        super().__init__(f"HTTP {status} for {url} {message}".strip())
+
+
+def api_url(base: str, path: str) -> str:
+    return base.rstrip("/") + path
+
+
+def fetch_user_token(page, base: str):
+    """Read g_ck (X-UserToken) from a lightweight classic page. Returns None if not available."""
+    page.goto(api_url(base, "/change_request_list.do?sysparm_rows=1"), wait_until="domcontentloaded")
+    return page.evaluate("() => window.g_ck || null")
+
+
+def page_params(query: str, fields, page_size: int, offset: int) -> dict:
+    """Query string for one Table API page"""
+    return {
+        "sysparm_query": query,
+        "sysparm_fields": ",".join(fields),
+        "sysparm_limit": page_size,
+        "sysparm_offset": offset,
+        "sysparm_exclude_reference_link": "true",
+        "sysparm_no_count": "true",
+    }
+
+
+def change_query(query: str = "") -> str:
+    """Append the CAB Date ordering (newest first) to an encoded query"""
+    # CAB Date ซ้ำกัน / ว่างได้ - sys_id เป็นตัวตัดสินลำดับให้คงที่ ไม่งั้น offset paging ข้าม / ซ้ำ record ได้
+    order = f"ORDERBYDESC{CAB_DATE_FIELD}^{TIE_BREAKER}"
+    return f"{query}^{order}" if query else order
+
+
+def since_query(field: str, watermark: str) -> str:
+    """Encoded query for field at or after watermark ('YYYY-MM-DD HH:MM:SS', UTC as returned by the API)
+
+    gs.dateGenerate ตีความเวลาตาม time zone ของ user จึงถอยไป SINCE_OVERLAP_HOURS
+    แล้วให้ผู้เรียกกรองด้วยค่า UTC ที่ API คืนมาอีกชั้น
+    """
+    start = datetime.strptime(watermark, "%Y-%m-%d %H:%M:%S") - timedelta(hours=SINCE_OVERLAP_HOURS)
+    return f"{field}>=javascript:gs.dateGenerate('{start:%Y-%m-%d}','{start:%H:%M:%S}')"
+
+
+def and_query(*parts) -> str:
+    return "^".join(part for part in parts if part)
+
+
+def date_range_query(field: str, start=None, end=None) -> str:
+    """Encoded query for field between the dates start and end ('YYYY-MM-DD', both inclusive, either optional)"""
+    terms = []
+    if start:
+        terms.append(f"{field}>=javascript:gs.dateGenerate('{start}','00:00:00')")
+    if end:
+        terms.append(f"{field}<=javascript:gs.dateGenerate('{end}','23:59:59')")
+    return and_query(*terms)
+
+
+def number_runs(numbers) -> list:
+    """Runs of consecutive change numbers (same prefix and width) as [(first, last, count)], in order"""
+    parsed = sorted({(m.group(1), len(m.group(2)), int(m.group(2)))
+                     for m in map(NUMBER_PATTERN.match, numbers) if m})
+    runs = []
+    for prefix, width, value in parsed:
+        if runs and runs[-1][0] == (prefix, width) and runs[-1][2] == value - 1:
+            runs[-1][2] = value
+        else:
+            runs.append([(prefix, width), value, value])
+    return [(f"{prefix}{first:0{width}d}", f"{prefix}{last:0{width}d}", last - first + 1)
+            for (prefix, width), first, last in runs]
+
+
+def exclude_numbers_query(numbers, field: str = "number", max_chars: int = MAX_QUERY_CHARS) -> tuple:
+    """Encoded query that excludes as many of numbers as fit in max_chars. Returns (query, count excluded).
+
+    Runs of consecutive numbers become one range term, biggest first; the rest go into NOT IN
+    chunks. Whatever does not fit is left for the caller's own filter.
+    """
+    terms, singles, excluded, length = [], [], 0, 0
+
+    def add(term: str, count: int) -> bool:
+        nonlocal excluded, length
+        if length + len(term) + 1 > max_chars:
+            return False
+        terms.append(term)
+        excluded += count
+        length += len(term) + 1
+        return True
+
+    for first, last, count in sorted(number_runs(numbers), key=lambda run: -run[2]):
+        if count < RANGE_MIN:
+            singles += [first, last][:count]
+        elif not add(f"{field}<{first}^OR{field}>{last}", count):
+            break
+
+    for i in range(0, len(singles), NOT_IN_CHUNK):
+        chunk = singles[i:i + NOT_IN_CHUNK]
+        # chunk สุดท้ายที่ใส่ไม่หมด ตัดให้พอดีกับที่เหลือ
+        room = max_chars - length - len(f"{field}NOT IN") - 1
+        while chunk and len(",".join(chunk)) > room:
+            chunk = chunk[:len(chunk) // 2] if len(chunk) > 1 else []
+        if not chunk or not add(f"{field}NOT IN{','.join(chunk)}", len(chunk)):
+            break
+    return and_query(*terms), excluded
+
+
+class ApiSession:
+    """REST calls on an APIRequestContext; adds X-UserToken (g_ck) once if cookie-only calls are rejected"""
+
+    def __init__(self, request, base: str, token_page=None):
+        self.request = request
+        self.base = base
+        self.token_page = token_page
+        self.user_token = None
+
+    def get_result(self, path: str, params: dict) -> list:
+        """GET path and return the "result" list"""
+        url = api_url(self.base, path)
+        while True:
+            headers = {"Accept": "application/json"}
+            if self.user_token:
+                headers["X-UserToken"] = self.user_token
+
+            response = self.request.get(url, params=params, headers=headers, timeout=120_000)
+            if response.status in (401, 403) and self.user_token is None and self.token_page is not None:
+                # REST จาก session cookie บาง instance ต้องส่ง X-UserToken (g_ck) ด้วย
+                self.user_token = fetch_user_token(self.token_page, self.base)
+                if self.user_token:
+                    print("[API] Retrying with X-UserToken")
+                    continue
+            if not response.ok:
+                raise ApiError(response.status, url, response.status_text)
+            try:
+                return response.json().get("result", [])
+            except Exception as e:
+                # session หมดอายุมักได้หน้า login (HTML) กลับมาแทน JSON
+                raise ApiError(response.status, url, f"invalid JSON: {e}")
+
+    def iter_records(self, path: str, query: str = "", fields=(), page_size: int = API_PAGE_SIZE):
+        """Yield records, paging with sysparm_limit / sysparm_offset"""
+        offset = 0
+        while True:
+            records = self.get_result(path, page_params(query, fields, page_size, offset))
+            yield from records
+
+            if len(records) < page_size:
+                return
+            offset += page_size
+
+    def iter_table(self, table: str, query: str = "", fields=(), page_size: int = API_PAGE_SIZE):
+        yield from self.iter_records(f"/api/now/table/{table}", query, fields, page_size)
+
+    def iter_change_requests(self, query: str = ""):
+        """Yield change_request records (number, sys_id, CAB date, sys_updated_on), newest CAB date first"""
+        yield from self.iter_table("change_request", change_query(query), CHANGE_FIELDS)
+
+    def iter_attachments(self, query: str = ""):
+        """Yield attachment metadata from the Attachment API (/api/now/attachment)"""
+        yield from self.iter_records("/api/now/attachment", f"{query}^{TIE_BREAKER}" if query else TIE_BREAKER,
+                                     ATTACHMENT_FIELDS)
+
+
+# ---------- async (async_playwright) variants ----------
+
+async def fetch_user_token_async(page, base: str):
+    await page.goto(api_url(base, "/change_request_list.do?sysparm_rows=1"), wait_until="domcontentloaded")
+    return await page.evaluate("() => window.g_ck || null")
+
+
+async def table_get_async(request, base: str, table: str, params: dict, user_token=None) -> list:
+    url = api_url(base, f"/api/now/table/{table}")
+    headers = {"Accept": "application/json"}
+    if user_token:
+        headers["X-UserToken"] = user_token
+
+    response = await request.get(url, params=params, headers=headers, timeout=120_000)
+    if not response.ok:
+        raise ApiError(response.status, url, response.status_text)
+    try:
+        return (await response.json()).get("result", [])
+    except Exception as e:
+        raise ApiError(response.status, url, f"invalid JSON: {e}")
+
+
+async def aiter_change_requests(request, base: str, query: str = "", user_token=None,
+                                page_size: int = API_PAGE_SIZE):
+    """Async generator version of iter_change_requests"""
+    offset = 0
+    while True:
+        params = page_params(change_query(query), CHANGE_FIELDS, page_size, offset)
+        records = await table_get_async(request, base, "change_request", params, user_token)
+        for record in records:
+            yield record
+
+        if len(records) < page_size:
+            return
+        offset += page_size
@@ -0,0 +1,20 @@
+"""
+pytest fixtures: โมดูลอยู่ที่ root ของ repo (ไม่มี package) และ mock ServiceNow ที่รันใน thread
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mock_servicenow import MockConfig, MockServiceNow  # noqa: E402
+
+
+@pytest.fixture
+def mock_instance():
+    server = MockServiceNow(MockConfig(records=3, attachments_per_record=2, attachment_kb=100)).start()
+    try:
+        yield server
+    finally:
+        server.stop()
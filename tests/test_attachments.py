@@ -0,0 +1,41 @@
+import zipfile
+
+from attachments import assign_names, classify_attachment, extract_zip, store_path
+
+
+def attachments():
+    return [{"filename": "report.pdf", "sys_id": "aaaaaaaa" + "0" * 24, "size": 100},
+            {"filename": "Report.pdf", "sys_id": "bbbbbbbb" + "0" * 24, "size": 3000},
+            {"filename": "UAT signoff.docx", "sys_id": "c" * 32, "size": 10}]
+
+
+def test_assign_names_tags_same_named_attachments():
+    names = [a["name"] for a in assign_names(attachments())]
+    assert names == ["report (aaaaaaaa).pdf", "Report (bbbbbbbb).pdf", "UAT signoff.docx"]
+
+
+def test_extract_zip_uses_the_same_names(tmp_path):
+    files = assign_names(attachments())
+    zip_path = tmp_path / "all.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        zf.writestr("Report.pdf", b"B" * 3000)
+        zf.writestr("report.pdf", b"A" * 100)
+        zf.writestr("UAT signoff.docx", b"U" * 10)
+    extracted = extract_zip(zip_path, tmp_path / "Attachment", files)
+    assert sorted(extracted) == sorted(store_path(tmp_path, a["name"]) for a in files)
+    assert store_path(tmp_path, "report (aaaaaaaa).pdf").read_bytes() == b"A" * 100
+
+
+def test_extract_zip_without_attachments_keeps_duplicates(tmp_path):
+    zip_path = tmp_path / "all.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        zf.writestr("a/x.txt", b"1")
+        zf.writestr("b/x.txt", b"2")
+    assert [p.name for p in extract_zip(zip_path, tmp_path / "out")] == ["x.txt", "x (2).txt"]
+
+
+def test_classify_attachment():
+    assert classify_attachment("UAT signoff.docx") == "UAT Signoff"
+    assert classify_attachment("AppScan report.pdf") == "AppScan"
+    assert classify_attachment("RE approval.msg") == "CRFile"
+    assert classify_attachment("notes.txt") == "Supporting Documents"
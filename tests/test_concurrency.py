@@ -0,0 +1,66 @@
+import asyncio
+
+from concurrency import AimdController
+
+
+def fill(controller, signal_stage: str, ms: float, ok: bool = True, count: int = None):
+    for _ in range(count or controller.window):
+        controller.observe(signal_stage, ms, ok)
+
+
+def test_increases_when_fast_and_saturated():
+    controller = AimdController(max_limit=4, start=1, window=5)
+    with controller.slot():
+        fill(controller, "wait.form_ready", 100)
+    assert controller.limit == 2
+
+
+def test_does_not_increase_when_slots_are_idle():
+    controller = AimdController(max_limit=4, start=2, window=5)
+    fill(controller, "wait.form_ready", 100)
+    assert controller.limit == 2
+
+
+def test_halves_on_slow_p90_and_on_errors():
+    controller = AimdController(max_limit=8, start=8, window=5, targets_ms={"form": 1000})
+    fill(controller, "wait.form_ready", 5000)
+    assert controller.limit == 4
+    fill(controller, "pdf", 100, ok=False)
+    assert controller.limit == 2
+    assert [(old, new) for _, old, new, _ in controller.history] == [(8, 4), (4, 2)]
+
+
+def test_never_below_min_or_above_max():
+    controller = AimdController(max_limit=2, start=1, min_limit=1, window=2)
+    for _ in range(5):
+        fill(controller, "wait.form_ready", 10 ** 6)
+    assert controller.limit == 1
+    for _ in range(5):
+        with controller.slot():
+            fill(controller, "wait.form_ready", 1)
+    assert controller.limit == 2
+
+
+def test_ignores_other_stages():
+    controller = AimdController(max_limit=4, start=1, window=1)
+    controller.observe("go_back", 10 ** 6, False)
+    assert controller.limit == 1 and not controller.history
+
+
+def test_async_slot_waits_for_a_free_slot():
+    controller = AimdController(max_limit=1, start=1)
+
+    async def run():
+        order = []
+
+        async def job(name):
+            async with controller.async_slot():
+                order.append(name)
+                await asyncio.sleep(0.05)
+                assert controller.active == 1
+
+        await asyncio.gather(job("a"), job("b"))
+        return order
+
+    assert sorted(asyncio.run(run())) == ["a", "b"]
+    assert controller.active == 0
@@ -0,0 +1,170 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import download_engine
+from download_engine import PART_STATE_SUFFIX, DownloadError, HttpDownloader, StaleRangeError, part_path
+from mock_servicenow import filler
+
+
+def attachment(instance):
+    """(url, expected bytes, ETag) of the mock's first attachment"""
+    item = instance.data.attachments[0]
+    size = int(item["size_bytes"])
+    url = f"{instance.base}sys_attachment.do?sys_id={item['sys_id']}"
+    return url, b"".join(filler(size, seed=item["sys_id"])), f'"{item["sys_id"]}"'
+
+
+def state_path(target):
+    return target.with_name(target.name + PART_STATE_SUFFIX)
+
+
+@pytest.fixture
+def downloader(mock_instance):
+    dl = HttpDownloader(mock_instance.storage_state()["cookies"])
+    yield dl
+    dl.close()
+
+
+@pytest.fixture
+def small_ranges(monkeypatch):
+    # ไฟล์ 100 KB ของ mock โหลดแบบแบ่งช่วงละ 16 KB
+    monkeypatch.setattr(download_engine, "RANGED_MIN_BYTES", 64 * 1024)
+    monkeypatch.setattr(download_engine, "SEGMENT_BYTES", 16 * 1024)
+
+
+def test_fresh_download(mock_instance, downloader, tmp_path):
+    url, body, _ = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    assert downloader.fetch(url, target) == len(body)
+    assert target.read_bytes() == body
+    assert not part_path(target).exists() and not state_path(target).exists()
+
+
+def test_stream_resume_with_validator(mock_instance, downloader, tmp_path):
+    url, body, etag = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    part_path(target).write_bytes(body[:40_000])
+    state_path(target).write_text(json.dumps({"url": url, "stream": True, "validator": etag,
+                                              "total": len(body)}))
+    assert downloader.fetch(url, target) == len(body)
+    assert target.read_bytes() == body
+    assert downloader.resumed == 1
+
+
+@pytest.mark.parametrize("state", [None, {"stream": True, "validator": None}])
+def test_stream_part_without_validator_is_discarded(mock_instance, downloader, tmp_path, state):
+    url, body, _ = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    part_path(target).write_bytes(b"X" * 40_000)  # ไม่รู้ว่ามาจาก version ไหน
+    if state is not None:
+        state_path(target).write_text(json.dumps(dict(state, url=url, total=len(body))))
+    downloader.fetch(url, target)
+    assert target.read_bytes() == body
+    assert downloader.resumed == 0
+
+
+def test_stream_part_with_stale_validator_restarts(mock_instance, downloader, tmp_path):
+    url, body, _ = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    part_path(target).write_bytes(b"X" * 40_000)
+    state_path(target).write_text(json.dumps({"url": url, "stream": True, "validator": '"old"',
+                                              "total": len(body)}))
+    downloader.fetch(url, target)
+    assert target.read_bytes() == body
+
+
+def ranged_part(target, url, body, validator, total=None, done=(0, 1, 2)):
+    """A .part + state left by an interrupted ranged download: the first segments done"""
+    total = total or len(body)
+    prefix = body[:len(done) * download_engine.SEGMENT_BYTES]
+    part_path(target).write_bytes((prefix + b"X" * total)[:total])
+    state_path(target).write_text(json.dumps({"url": url, "total": total, "done": list(done),
+                                              "validator": validator}))
+
+
+def test_ranged_download(mock_instance, downloader, tmp_path, small_ranges):
+    url, body, _ = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    downloader.fetch(url, target)
+    assert target.read_bytes() == body
+    assert downloader.ranged == 1
+
+
+def test_ranged_resume_with_validator(mock_instance, downloader, tmp_path, small_ranges):
+    url, body, etag = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    ranged_part(target, url, body, etag)
+    downloader.fetch(url, target)
+    assert target.read_bytes() == body
+    assert downloader.resumed == 1
+
+
+def test_ranged_part_without_validator_is_discarded(mock_instance, downloader, tmp_path, small_ranges):
+    # segment ที่ "done" เป็นขยะ: ถ้าโหลดต่อโดยไม่มี validator ไฟล์จะเป็น byte เก่าปนใหม่
+    url, body, _ = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    ranged_part(target, url, b"X" * len(body), None)
+    downloader.fetch(url, target)
+    assert target.read_bytes() == body
+    assert downloader.resumed == 0
+
+
+def test_ranged_segment_of_another_version_is_rejected(mock_instance, downloader, small_ranges, tmp_path):
+    url, body, etag = attachment(mock_instance)
+    target = tmp_path / "a.bin"
+    state = {"url": url, "total": len(body) + 5, "done": [], "validator": etag}
+    part_path(target).write_bytes(b"")
+    with pytest.raises(StaleRangeError):
+        downloader._fetch_ranged(url, {}, target, state)
+    assert not part_path(target).exists() and not state_path(target).exists()
+
+
+def test_expect_prefix_mismatch(mock_instance, downloader, tmp_path):
+    url, _, _ = attachment(mock_instance)
+    with pytest.raises(DownloadError, match="unexpected content"):
+        downloader.fetch(url, tmp_path / "a.pdf", expect_prefix=b"%PDF")
+
+
+class Redirects(BaseHTTPRequestHandler):
+    """/away -> another host, /here -> /ok on the same host; records the Cookie header per request"""
+
+    cookies = []
+
+    def do_GET(self):
+        type(self).cookies.append((self.path, self.headers.get("Cookie")))
+        if self.path in ("/away", "/here"):
+            location = f"{self.server.other}/login" if self.path == "/away" else "/ok"
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_redirect_off_host_is_not_followed(tmp_path):
+    server = HTTPServer(("127.0.0.1", 0), Redirects)
+    server.other = "http://localhost:9"  # ห้ามยิงไป - cookies ของ instance ต้องไม่ออกนอก host
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Redirects.cookies = []
+    downloader = HttpDownloader([{"name": "JSESSIONID", "value": "secret"}])
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        with pytest.raises(DownloadError) as error:
+            downloader.fetch(f"{base}/away", tmp_path / "a")
+        assert error.value.expired and downloader.expired
+        assert downloader.fetch(f"{base}/here", tmp_path / "b") == 2
+        assert [path for path, _ in Redirects.cookies] == ["/away", "/here", "/ok"]
+    finally:
+        downloader.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,93 @@
+import threading
+
+from retry import CircuitBreaker, RetryQueue, backoff_delay
+
+
+def test_backoff_delay_is_capped():
+    assert 15 <= backoff_delay(1, 30, 600) <= 30
+    assert backoff_delay(20, 30, 600) <= 600
+
+
+def test_retry_queue_requeues_until_max_attempts():
+    queue = RetryQueue(max_attempts=2, base_s=0, max_s=0)
+    item = {"number": "CHG0000001"}
+    assert queue.add(item, "pdf")
+    assert queue.next_batch() == [item]
+    assert queue.add(item, "pdf")
+    assert queue.next_batch() == [item]
+    assert not queue.add(item, "pdf")
+    assert queue.next_batch() == []
+    queue.succeeded("CHG0000001")
+    assert (queue.requeued, queue.recovered, queue.gave_up) == (2, 1, 1)
+
+
+def test_retry_queue_with_retries_off(capsys):
+    queue = RetryQueue(max_attempts=0)
+    assert not queue.add({"number": "CHG0000001"})
+    assert "retries off" in capsys.readouterr().out
+    assert len(queue) == 0
+
+
+def tripped(**kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker(threshold=0.5, window=4, min_samples=2, cooldown_s=0.05, **kwargs)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_breaker_stays_closed_below_min_samples():
+    breaker = CircuitBreaker(threshold=0.5, window=10, min_samples=5)
+    for _ in range(4):
+        breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_breaker_only_the_probe_closes_the_circuit():
+    breaker = tripped()
+    probe = breaker.wait()
+    assert probe is not None and breaker.state == "half_open"
+    breaker.record(True)  # record ที่เริ่มก่อนวงจรเปิด
+    assert breaker.state == "half_open"
+    assert breaker.wait(probe) == probe  # probe ลองใหม่ (เช่นหลัง login) ไม่รอตัวเอง
+    breaker.record(True, probe)
+    assert breaker.state == "closed"
+
+
+def test_breaker_failed_probe_doubles_the_cooldown():
+    breaker = tripped()
+    probe = breaker.wait()
+    breaker.record(False, probe)
+    assert breaker.state == "open"
+    assert breaker._cooldown == 0.1
+    assert breaker.trips == 2
+
+
+def test_breaker_holds_other_workers_while_probing():
+    breaker = tripped()
+    probe = breaker.wait()
+    released = threading.Event()
+
+    def worker():
+        breaker.wait()
+        released.set()
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    assert not released.wait(0.02)
+    breaker.record(True, probe)
+    assert released.wait(1)
+    thread.join(1)
+
+
+def test_breaker_throttled_opens_for_retry_after():
+    breaker = CircuitBreaker(cooldown_s=1)
+    breaker.throttled(429, retry_after=5)
+    assert breaker.state == "open" and breaker._cooldown == 5
+
+
+def test_breaker_disabled():
+    breaker = CircuitBreaker(threshold=0)
+    for _ in range(50):
+        breaker.record(False)
+    assert breaker.wait() is None and breaker.state == "closed"
@@ -0,0 +1,36 @@
+from mock_servicenow import MockConfig, MockData, apply_query
+from snow_api import change_query, exclude_numbers_query, number_runs
+
+
+def numbers(*values):
+    return [f"CHG{value:07d}" for value in values]
+
+
+def test_number_runs():
+    assert number_runs(numbers(5, 1, 2, 3, 9)) == [("CHG0000001", "CHG0000003", 3), ("CHG0000005", "CHG0000005", 1),
+                                                   ("CHG0000009", "CHG0000009", 1)]
+
+
+def test_exclude_numbers_query_ranges_and_singles():
+    query, excluded = exclude_numbers_query(numbers(1, 2, 3, 4, 7, 9))
+    assert excluded == 6
+    assert query == "number<CHG0000001^ORnumber>CHG0000004^numberNOT INCHG0000007,CHG0000009"
+
+
+def test_exclude_numbers_query_respects_max_chars():
+    done = numbers(*range(1, 400, 2))  # ไม่มีเลขติดกัน -> NOT IN อย่างเดียว
+    query, excluded = exclude_numbers_query(done, max_chars=500)
+    assert len(query) <= 500
+    assert 0 < excluded < len(done)
+    assert exclude_numbers_query(done, max_chars=0) == ("", 0)
+
+
+def test_exclude_numbers_query_filters_the_mock_list():
+    data = MockData(MockConfig(records=60))
+    done = {change["number"] for change in data.changes[:20]} | {"CHG0000031", "CHG0000045"}
+    query, excluded = exclude_numbers_query(done)
+    assert excluded == len(done)
+    remaining = apply_query(data.changes, change_query(query))
+    assert {change["number"] for change in remaining} == {change["number"] for change in data.changes} - done
+    # ลำดับคงที่: CAB date ใหม่ก่อน แล้ว sys_id
+    assert [change["cab_date"] for change in remaining] == sorted((c["cab_date"] for c in remaining), reverse=True)
@@ -0,0 +1,155 @@
+"""
+Event-driven waits แทน wait_for_timeout แบบ fix เวลา
+
+ทุก wait รอ signal จริง (selector, network idle, GlideForm ready, list reload)
+มีเพดานเวลาต่อ stage (STAGE_BUDGETS) และบันทึกเวลาที่รอจริงไว้ เพื่อใช้ปรับ budget จากข้อมูล
+"""
+import threading
+import time
+
+# เพดานเวลา (ms) ต่อ stage
+STAGE_BUDGETS = {
+    "list_frame": 10_000,
+    "list_table": 60_000,
+    "list_sort": 15_000,
+    "form_ready": 60_000,
+    "actions_menu": 5_000,
+    "export_submenu": 5_000,
+    "pdf_dialog": 10_000,
+    "pdf_ready": 30_000,
+    "attachments_modal": 10_000,
+    "modal_close": 5_000,
+    "go_back": 60_000,
+    "next_page": 60_000,
+}
+DEFAULT_BUDGET = 30_000
+POLL_INTERVAL = 100
+
+GLIDE_FORM_READY_JS = """
+    () => document.readyState === 'complete'
+        && !location.pathname.endsWith('_list.do')
+        && typeof window.g_form !== 'undefined'
+        && !!document.querySelector('form')
+"""
+
+LIST_READY_JS = """
+    () => document.readyState === 'complete'
+        && location.pathname.endsWith('_list.do')
+        && !!document.querySelector("table.list_table, table[role='table'], div[role='grid']")
+"""
+
+LIST_CHANGED_JS = """
+    (prev) => {
+        const a = document.querySelector('a.linked.formlink');
+        return document.readyState === 'complete' && !!a && a.innerText.trim() !== prev;
+    }
+"""
+
+
+class WaitTimeout(Exception):
+    """Raised when a stage's readiness signal does not arrive within its budget"""
+
+    def __init__(self, stage: str, budget_ms: int):
+        self.stage = stage
+        super().__init__(f"wait '{stage}' exceeded {budget_ms} ms")
+
+
+class Waiter:
+    """Waits on readiness signals with a per-stage upper bound and records the actual wait time"""
+
+    def __init__(self, budgets=None):
+        self.budgets = dict(STAGE_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+        self._lock = threading.Lock()
+        self._samples = {}   # stage -> [elapsed_ms]
+        self._timeouts = {}  # stage -> count
+        self.listeners = []  # callables(stage, elapsed_ms, ok)
+
+    def budget(self, stage: str) -> int:
+        return self.budgets.get(stage, DEFAULT_BUDGET)
+
+    def record(self, stage: str, start: float, ok: bool):
+        """Record a wait that started at start (time.perf_counter()) and return its length in ms"""
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._samples.setdefault(stage, []).append(elapsed)
+            if not ok:
+                self._timeouts[stage] = self._timeouts.get(stage, 0) + 1
+        for listener in self.listeners:
+            listener(stage, elapsed, ok)
+        return elapsed
+
+    def _run(self, stage: str, fn, raise_on_timeout: bool):
+        start = time.perf_counter()
+        try:
+            fn(self.budget(stage))
+        except Exception:
+            self.record(stage, start, False)
+            if raise_on_timeout:
+                raise
+            return False
+        self.record(stage, start, True)
+        return True
+
+    def selector(self, stage: str, target, selector: str, state: str = "visible",
+                 raise_on_timeout: bool = True) -> bool:
+        """Wait for selector in a page or frame"""
+        return self._run(stage, lambda budget: target.wait_for_selector(selector, state=state, timeout=budget),
+                         raise_on_timeout)
+
+    def locator(self, stage: str, locator, state: str = "visible", raise_on_timeout: bool = True) -> bool:
+        return self._run(stage, lambda budget: locator.wait_for(state=state, timeout=budget), raise_on_timeout)
+
+    def form_ready(self, stage: str, frame, raise_on_timeout: bool = True) -> bool:
+        """Wait until the record form is loaded and GlideForm (g_form) is available"""
+        return self._run(stage, lambda budget: frame.wait_for_function(GLIDE_FORM_READY_JS, timeout=budget),
+                         raise_on_timeout)
+
+    def list_ready(self, stage: str, frame, raise_on_timeout: bool = True) -> bool:
+        """Wait until frame shows a loaded list page (e.g. after go_back from a form)"""
+        return self._run(stage, lambda budget: frame.wait_for_function(LIST_READY_JS, timeout=budget),
+                         raise_on_timeout)
+
+    def list_changed(self, stage: str, frame, previous_first: str, raise_on_timeout: bool = True) -> bool:
+        """Wait until the list shows a different first row than before (next page, sort)"""
+        return self._run(stage,
+                         lambda budget: frame.wait_for_function(LIST_CHANGED_JS, arg=previous_first,
+                                                                timeout=budget),
+                         raise_on_timeout)
+
+    def network_idle(self, stage: str, page, raise_on_timeout: bool = False) -> bool:
+        return self._run(stage, lambda budget: page.wait_for_load_state("networkidle", timeout=budget),
+                         raise_on_timeout)
+
+    def first_visible(self, stage: str, locators, raise_on_timeout: bool = True):
+        """Poll candidate locators (possibly in different frames) and return the first visible one"""
+        start = time.perf_counter()
+        deadline = start + self.budget(stage) / 1000
+        while True:
+            for locator in locators:
+                try:
+                    if locator.is_visible():
+                        self.record(stage, start, True)
+                        return locator
+                except Exception:
+                    pass
+            if time.perf_counter() >= deadline:
+                self.record(stage, start, False)
+                if raise_on_timeout:
+                    raise WaitTimeout(stage, self.budget(stage))
+                return None
+            time.sleep(POLL_INTERVAL / 1000)
+
+    def summary(self) -> list:
+        """One line per stage: count, mean / max wait and timeouts"""
+        lines = []
+        with self._lock:
+            for stage in sorted(self._samples):
+                samples = self._samples[stage]
+                lines.append(
+                    f"  {stage:<18} n={len(samples):<5} "
+                    f"avg={sum(samples) / len(samples):8.0f} ms  max={max(samples):8.0f} ms  "
+                    f"budget={self.budget(stage)} ms  timeouts={self._timeouts.get(stage, 0)}"
+                )
+        return lines